@@ -4,3 +4,8 @@ DB_URI = os.getenv('DB_URI', None)
 CKPT_DIR = os.getenv('CKPT_DIR', None)
 
 VISUALIZE_RESULT = os.getenv('S3DEXP_VISUALIZE_RESULT', False)
+
+CACHE_DIR = os.getenv('S3DEXP_CACHE_DIR', os.path.expanduser('~/.cache/s3dexp'))
+MANIFEST_DIR = os.getenv('S3DEXP_MANIFEST_DIR', CACHE_DIR)
+PROFILE_CACHE_DIR = os.getenv('S3DEXP_PROFILE_CACHE_DIR', os.path.join(CACHE_DIR, 'profiles'))
+SHM_DIR = os.getenv('S3DEXP_SHM_DIR', '/dev/shm')
@@ -20,6 +20,8 @@ class DiskReadProfile(Base):
     seq_read_ms = sa.Column(sa.Float(53))
     rand_read_ms = sa.Column(sa.Float(53))
     size = sa.Column(sa.Integer)
+    # when the row was last written, so local profile snapshots can detect updates in place
+    updated_at = sa.Column(sa.DateTime, default=sa.func.now(), onupdate=sa.func.now())
 
 
 class DecodeProfile(Base):
@@ -32,6 +34,8 @@ class DecodeProfile(Base):
     height = sa.Column(sa.Integer)
     decode_ms = sa.Column(sa.Float(53))
     hostname = sa.Column(sa.String(1024), nullable=False)
+    # when the row was last written, so local profile snapshots can detect updates in place
+    updated_at = sa.Column(sa.DateTime, default=sa.func.now(), onupdate=sa.func.now())
     
     
 class AppExp(Base):
@@ -63,6 +67,10 @@ class EurekaExp(Base):
     avg_mbyteps = sa.Column(sa.Float(53))
     peak_mbyteps = sa.Column(sa.Float(53))
     hostname = sa.Column(sa.String(1024), nullable=False)
+    filter_stats = sa.Column(sa.Text)
+    # reads in flight and MB/s per worker while it was reading, if the reader reports them (PrefetchReadFilter)
+    io_depth = sa.Column(sa.Float(53))
+    io_mbyteps = sa.Column(sa.Float(53))
     # passed_items = sa.Column(sa.Integer)
 
 class FaceExp(Base):
@@ -81,3 +89,5 @@ class FaceExp(Base):
     height = sa.Column(sa.Integer)
     num_faces = sa.Column(sa.Integer)
     box = sa.Column(sa.String(1024))
+    # when the row was last written, so local profile snapshots can detect updates in place
+    updated_at = sa.Column(sa.DateTime, default=sa.func.now(), onupdate=sa.func.now())
@@ -0,0 +1,153 @@
+"""Local snapshot of profile look-up tables (DecodeProfile, FaceExp, ...) queried from the DB.
+
+A table is materialized once into a .npy structured array sorted by key, and memory-mapped on
+subsequent loads. It is rebuilt when a cheap fingerprint of the query (row count, max id, and
+latest `updated_at` of the rows) changes. Without a DB (DB_URI unset, or unreachable) the snapshot is used as is,
+so simulators can run offline.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import tempfile
+
+from logzero import logger
+import numpy as np
+import sqlalchemy as sa
+
+from s3dexp import config
+import s3dexp.db
+import s3dexp.db.utils as dbutils
+
+
+class ProfileTable(object):
+    """Read-only table of profiles, looked up by key with binary search."""
+    def __init__(self, arr):
+        super(ProfileTable, self).__init__()
+        self.arr = arr
+        self._keys = arr['key']
+
+    def __len__(self):
+        return len(self.arr)
+
+    def __getitem__(self, key):
+        i = np.searchsorted(self._keys, key)
+        if i >= len(self._keys) or self._keys[i] != key:
+            raise KeyError(key)
+        return self.arr[i]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __getattr__(self, name):
+        # column access, e.g. table.decode_ms
+        if name in ('arr', '_keys'):
+            raise AttributeError(name)
+        try:
+            return self.arr[name]
+        except ValueError:
+            raise AttributeError(name)
+
+
+def _fingerprint(query, model):
+    # count and max id catch inserts and deletes, updated_at catches updates in place
+    count, max_id, updated_at = query.with_entities(
+        sa.func.count(model.id), sa.func.max(model.id), sa.func.max(model.updated_at)).one()
+    return [int(count), int(max_id or 0), str(updated_at) if updated_at is not None else None]
+
+
+def _replace(path, write):
+    """Write a file atomically: `write` fills a unique temp file in the same directory, which is then renamed over `path`.
+    Processes that have the old file open (or mmap'd) keep reading it, and concurrent writers don't clobber each other."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def _to_array(records, fields, unique_keys):
+    # auto-size string columns
+    dtype = []
+    for i, (name, typ) in enumerate(fields):
+        if typ == 'S':
+            typ = 'S{}'.format(max([1] + [len(r[i]) for r in records]))
+        dtype.append((name, typ))
+    arr = np.array(records, dtype=dtype)
+    arr = arr[np.argsort(arr['key'], kind='mergesort')]
+    dup = arr['key'][1:] == arr['key'][:-1]
+    if unique_keys:
+        assert not np.any(dup), "Duplicate profile keys, e.g., {}".format(arr['key'][1:][dup][:5])
+    else:
+        # keep the last record of each key, as a dict would
+        arr = arr[np.append(~dup, True)]
+    return arr
+
+
+def load_profile_table(name, params, model, build_query, fields, to_record, unique_keys=True):
+    """Load a profile table from the local snapshot, rebuilding it from the DB if stale.
+    
+    Arguments:
+        name {str} -- name of the table, used in the file name
+        params {dict} -- query parameters. Each distinct set gets its own snapshot.
+        model {class} -- the ORM model being queried. Must have `id` and `updated_at` columns.
+        build_query {function} -- sess -> Query of `model`
+        fields {list} -- [(name, numpy type)] of columns. The first must be 'key'. 'S' means auto-sized string.
+        to_record {function} -- ORM object -> tuple in the order of `fields`
+
+    Keyword Arguments:
+        unique_keys {bool} -- assert keys are unique. If False, the last record of a key wins. (default: {True})
+
+    Returns:
+        ProfileTable
+    """
+    assert fields[0][0] == 'key'
+    digest = hashlib.md5(json.dumps([name, sorted(params.items())])).hexdigest()
+    base = os.path.join(config.PROFILE_CACHE_DIR, '{}-{}'.format(name, digest))
+    npy_path, meta_path = base + '.npy', base + '.json'
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(npy_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+    sess = None
+    fingerprint = None
+    if s3dexp.db.engine is not None:
+        try:
+            sess = dbutils.get_session()
+            query = build_query(sess)
+            fingerprint = _fingerprint(query, model)
+        except sa.exc.OperationalError as e:
+            logger.warn("Cannot reach DB, falling back to local profile snapshot: {}".format(e))
+            sess = None
+
+    if meta is not None and (fingerprint is None or fingerprint == meta['fingerprint']):
+        logger.info("Using profile snapshot {} ({})".format(npy_path, 'offline' if fingerprint is None else 'up to date'))
+        if sess is not None:
+            sess.close()
+        return ProfileTable(np.load(npy_path, mmap_mode='r'))
+
+    assert sess is not None, "No DB and no local snapshot for {} {}".format(name, params)
+    records = map(to_record, query.all())
+    sess.close()
+    arr = _to_array(records, fields, unique_keys)
+
+    try:
+        os.makedirs(config.PROFILE_CACHE_DIR)
+    except OSError as e:
+        # another process may create it at the same time
+        if e.errno != errno.EEXIST:
+            raise
+    _replace(npy_path, lambda f: np.save(f, arr))
+    _replace(meta_path, lambda f: json.dump({'name': name, 'params': params, 'fingerprint': fingerprint}, f))
+    logger.info("Saved {} profiles to snapshot {}".format(len(arr), npy_path))
+    return ProfileTable(np.load(npy_path, mmap_mode='r'))
@@ -1,6 +1,9 @@
+import collections
 import s3dexp.db
 
+from logzero import logger
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import MultipleResultsFound
 
 
 def get_session():
@@ -23,4 +26,79 @@ def insert_or_update_one(sess, model, keys_dict, vals_dict):
         create_dict.update(vals_dict)
         record = model(**create_dict)
         sess.add(record)
-    return record
\ No newline at end of file
+    return record
+
+
+def _key_normalizer(sess):
+    # MySQL's default collations compare strings case-insensitively and ignore trailing spaces
+    if sess.get_bind().dialect.name == 'mysql':
+        return lambda v: v.lower().rstrip(' ') if isinstance(v, basestring) else v
+    return lambda v: v
+
+
+def bulk_insert_or_update(sess, model, records, chunk_size=1000):
+    """Bulk version of insert_or_update_one().
+
+    Arguments:
+        records {list} -- list of dicts, each with 'keys_dict' and 'vals_dict'
+
+    Keyword Arguments:
+        chunk_size {int} -- number of records per round-trip (default: {1000})
+
+    The tables have no unique index on the key columns (only on `id`), so a native
+    `INSERT ... ON DUPLICATE KEY UPDATE` cannot detect duplicates. Instead, each chunk costs
+    one SELECT (IN on one key column) to find existing rows, then one bulk UPDATE and one bulk INSERT.
+    Keys are matched as the DB compares them (e.g., case-insensitively on MySQL).
+    If several records have the same keys, the last one wins.
+    Like insert_or_update_one(), raises MultipleResultsFound if several rows of the table match a record.
+    """
+    if sess is None:
+        return None
+    norm = _key_normalizer(sess)
+
+    for start in range(0, len(records), chunk_size):
+        # merge duplicates within the chunk, keep input order
+        merged = collections.OrderedDict()
+        for r in records[start:start+chunk_size]:
+            key = tuple(sorted((k, norm(v)) for k, v in r['keys_dict'].items()))
+            entry = merged.setdefault(key, ({}, {}))
+            entry[0].update(r['keys_dict'])     # as given, for inserts
+            entry[1].update(r['vals_dict'])
+
+        # narrow down with IN on the most selective key column, then match full keys here
+        field_sets = set(tuple(k for k, _ in key) for key in merged)
+        values = collections.defaultdict(set)   # key column -> values in this chunk
+        for key in merged:
+            for k, v in key:
+                values[k].add(v)
+        common = set.intersection(*map(set, field_sets))
+        assert common, "Records in a chunk must share at least one key column"
+        pivot = max(common, key=lambda k: len(values[k]))
+
+        existing = collections.defaultdict(list)   # key -> ids
+        columns = [model.id] + [getattr(model, k) for k in sorted(values)]
+        for row in sess.query(*columns).filter(getattr(model, pivot).in_(values[pivot])):
+            row = row._asdict()
+            for fields in field_sets:
+                key = tuple((k, norm(row[k])) for k in fields)
+                if key in merged:
+                    existing[key].append(row['id'])
+
+        updates, inserts = [], []
+        for key, (keys_dict, vals_dict) in merged.items():
+            if key in existing:
+                if len(existing[key]) > 1:
+                    raise MultipleResultsFound("{} rows of {} match {}".format(len(existing[key]), model.__tablename__, keys_dict))
+                d = dict(vals_dict)
+                d['id'] = existing[key][0]
+                updates.append(d)
+            else:
+                d = dict(keys_dict)
+                d.update(vals_dict)
+                inserts.append(d)
+
+        if updates:
+            sess.bulk_update_mappings(model, updates)
+        if inserts:
+            sess.bulk_insert_mappings(model, inserts)
+        logger.debug("Bulk upsert into {}: {} updated, {} inserted".format(model.__tablename__, len(updates), len(inserts)))
@@ -0,0 +1,74 @@
+"""Image difference measures for frame-skipping video search (e.g., NoScope's difference detector).
+
+They run on every sampled frame, so the work is done in OpenCV, which uses integer arithmetic on uint8
+and releases the GIL, and large frames are split into row tiles across a thread pool.
+"""
+import cv2
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import threading
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(num_threads):
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._processes < num_threads:
+            if _pool is not None:
+                # its threads exit once work already submitted is done
+                _pool.close()
+            _pool = ThreadPool(num_threads)
+    return _pool
+
+
+def _row_tiles(num_rows, num_tiles):
+    bounds = np.linspace(0, num_rows, num_tiles + 1).astype(int)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def sse(arr1, arr2, num_threads=1):
+    """Sum of squared error between two images of the same shape and dtype (e.g., uint8).
+
+    Keyword Arguments:
+        num_threads {int} -- split the rows into this many tiles computed in parallel (default: {1})
+    """
+    assert isinstance(arr1, np.ndarray) and isinstance(arr2, np.ndarray)
+    assert arr1.shape == arr2.shape, "{}, {}".format(arr1.shape, arr2.shape)
+    if num_threads <= 1 or arr1.shape[0] < 2 * num_threads:
+        return cv2.norm(arr1, arr2, cv2.NORM_L2SQR)
+
+    def tile_sse(rows):
+        return cv2.norm(arr1[rows[0]:rows[1]], arr2[rows[0]:rows[1]], cv2.NORM_L2SQR)
+
+    return sum(_get_pool(num_threads).map(tile_sse, _row_tiles(arr1.shape[0], num_threads)))
+
+
+def downscale(arr, scale):
+    """Shrink an image by `scale` (< 1). Bilinear sampling: INTER_AREA would cost more than the full size comparison."""
+    return cv2.resize(arr, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+
+def mse(arr1, arr2, num_threads=1, scale=None):
+    """Mean squared error between two images of the same shape.
+
+    Keyword Arguments:
+        num_threads {int} -- see sse() (default: {1})
+        scale {float} -- compare the images downscaled by this factor, e.g., 0.25.
+            Cheaper but smooths small differences (default: {None})
+    """
+    if scale:
+        arr1, arr2 = downscale(arr1, scale), downscale(arr2, scale)
+    return sse(arr1, arr2, num_threads) / arr1.size
+
+
+def mse_numpy(arr1, arr2, chunk_rows=40):
+    """The former float64 numpy implementation of mse(), kept as a baseline for benchmarks"""
+    assert isinstance(arr1, np.ndarray) and isinstance(arr2, np.ndarray)
+    assert arr1.shape == arr2.shape, "{}, {}".format(arr1.shape, arr2.shape)
+    sum_squared_error = 0.
+    # Too small -> high GIL overhead. Too large -> large memory writes.
+    for x in range(0, arr1.shape[0], chunk_rows):
+        sum_squared_error += np.sum((arr1[x:x+chunk_rows].astype(np.float) - arr2[x:x+chunk_rows].astype(np.float))**2)
+    return sum_squared_error / arr1.size
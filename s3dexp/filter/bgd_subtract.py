@@ -1,8 +1,11 @@
 import cv2
 import numpy as np
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 class BackgroundSubtractionFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ('bg_subt', )
+
     def __init__(self):
         super(BackgroundSubtractionFilter, self).__init__()
         self.lowerBound = np.array([150, 150, 150])
@@ -8,9 +8,12 @@ from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 import s3dexp.config
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 class ClassificationFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ()
+
     def __init__(self, targets, confidence=0.9, server='localhost', port=5000):
         super(ClassificationFilter, self).__init__(targets, confidence, server, port)
 
@@ -1,9 +1,12 @@
 import cv2
 import numpy as np
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 
 class ColorFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ()
+
     def __init__(self, bgr_lb=[0, 0, 180], bgr_ub=[50, 50, 255], pixels_threshold=10000):
         """Simple colorness filter based on pixel thresholds. 
         Default parameter is a "redness" filters.
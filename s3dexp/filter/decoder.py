@@ -6,10 +6,13 @@ import cv2
 import numpy as np
 from logzero import logger
 
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 
 class DecodeFilter(Filter):
+    reads = (Item.DATA, )
+    writes = (Item.ARRAY, )
+
     def __init__(self):
         super(DecodeFilter, self).__init__()
 
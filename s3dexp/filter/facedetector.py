@@ -4,9 +4,12 @@ import numpy as np
 import os
 
 import s3dexp.config
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 class FaceDetectorFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ('face_detection', )
+
     def __init__(self, min_faces=1):
         super(FaceDetectorFilter, self).__init__(min_faces)
         self.min_faces = min_faces
@@ -45,6 +48,9 @@ class ObamaDetectorFilter(Filter):
         super(ObamaDetectorFilter, self).__init__(use_boxes, tolerance)
         self.use_boxes = use_boxes
         self.tolerance = tolerance
+        self.reads = (Item.ARRAY, use_boxes) if use_boxes else (Item.ARRAY, )
+        # draws the matched box on the array to save it
+        self.writes = (Item.ARRAY, ) if s3dexp.config.VISUALIZE_RESULT else ()
 
     def __call__(self, item):
         # Have to import it after fork:
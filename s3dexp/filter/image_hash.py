@@ -1,13 +1,16 @@
 import cv2
 import numpy
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 class ImageHashFilter(Filter):
+    writes = ('hash', )
+
     def __init__(self, use_boxes=None):
         super(ImageHashFilter, self).__init__(use_boxes)
         self.hash_func = cv2.img_hash.BlockMeanHash_create()
         assert use_boxes is None or isinstance(use_boxes), "use_boxes must be an attribute name to get boxes from"
         self.use_boxes = use_boxes  # if not None, run hash on this boxes rather than whole-image
+        self.reads = (Item.ARRAY, use_boxes) if use_boxes else (Item.ARRAY, )
 
     def __call__(self, item):
         if not self.use_boxes:
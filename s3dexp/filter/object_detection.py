@@ -8,15 +8,21 @@ from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 import s3dexp.config
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 class ObjectDetectionFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ()
+
     def __init__(self, targets, confidence=0.9, server='localhost', port=5000):
         super(ObjectDetectionFilter, self).__init__(targets, confidence, server, port)
 
         self.targets = targets
         self.confidence =confidence
         self.server, self.port = server, port
+        if s3dexp.config.VISUALIZE_RESULT:
+            # draws the detected boxes on the array to save it
+            self.writes = (Item.ARRAY, )
 
         retry = Retry(total=3, backoff_factor=0.3, method_whitelist=False)
         adapter = HTTPAdapter(max_retries=retry)
@@ -1,10 +1,26 @@
+import collections
 from logzero import logger
+from multiprocessing.pool import ThreadPool
 import os
+import threading
+import time
 
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
+
+
+def _read_file(path):
+    tic = time.time()
+    size = os.path.getsize(path)
+    with open(path, 'r') as f:
+        fd = f.fileno()
+        buf = os.read(fd, size)
+    return buf, time.time() - tic
 
 
 class SimpleReadFilter(Filter):
+    reads = ()
+    writes = (Item.DATA, )
+
     def __init__(self):
         super(SimpleReadFilter, self).__init__()
 
@@ -21,3 +37,105 @@ class SimpleReadFilter(Filter):
         self.session_stats['bytes_from_disk'] += size
         return True
 
+
+class PrefetchReadFilter(Filter):
+    reads = ()
+    writes = (Item.DATA, )
+
+    def __init__(self, io_depth=8):
+        """Reader that keeps up to `io_depth` reads in flight using a thread pool.
+        It starts reading the paths search_work() pulls ahead of the current item (see Filter.hint()),
+        so the window of outstanding reads rolls over from one call to the next, in single-item and batch mode.
+        Items are filled in queue order.
+
+        Reports to session_stats:
+            io_busy_s -- sum of per-read latencies
+            io_active_s -- wall time with at least one read in flight
+            io_bytes -- bytes read, including prefetched items dropped upstream
+            io_depth -- achieved average number of reads in flight while reading (io_busy_s / io_active_s)
+            io_mbyteps -- achieved MB/s while reading
+        
+        Keyword Arguments:
+            io_depth {int} -- max outstanding reads per worker (default: {8})
+        """
+        super(PrefetchReadFilter, self).__init__(io_depth)
+        assert io_depth >= 1
+        self.io_depth = io_depth
+        self.lookahead = io_depth
+        self.pool = None    # created lazily, after fork
+        self._pending = collections.OrderedDict()  # path -> (seq, AsyncResult), in queue order
+        self._seq = 0
+        # updated by the pool threads
+        self._io_lock = threading.Lock()
+        self._in_flight = 0
+        self._last_change = 0.
+        self._io = collections.defaultdict(float)
+
+    def _track(self, delta, elapsed=0., nbytes=0):
+        with self._io_lock:
+            now = time.time()
+            if self._in_flight > 0:
+                self._io['io_active_s'] += now - self._last_change
+            self._last_change = now
+            self._in_flight += delta
+            self._io['io_busy_s'] += elapsed
+            self._io['io_bytes'] += nbytes
+
+    def _read(self, path):
+        self._track(1)
+        buf, elapsed = '', 0.
+        try:
+            buf, elapsed = _read_file(path)
+            return buf, elapsed
+        finally:
+            self._track(-1, elapsed, len(buf))
+
+    def _submit(self, path):
+        if self.pool is None:
+            self.pool = ThreadPool(self.io_depth)
+        self._seq += 1
+        self._pending[path] = (self._seq, self.pool.apply_async(self._read, (path, )))
+
+    def hint(self, paths):
+        for path in paths:
+            if path not in self._pending:
+                self._submit(path)
+
+    def __call__(self, item):
+        return self.call_batch([item, ])[0]
+
+    def call_batch(self, items):
+        tic = time.time()
+        results = []
+        for item in items:
+            if item.src not in self._pending:
+                self._submit(item.src)
+            results.append(self._pending.pop(item.src))
+        # reads hinted before these items are of items dropped upstream
+        last_seq = max(seq for seq, _ in results)
+        while self._pending and next(iter(self._pending.values()))[0] < last_seq:
+            self._pending.popitem(last=False)
+
+        nbytes = 0
+        for item, (_, res) in zip(items, results):
+            item.data, _ = res.get()
+            nbytes += len(item.data)
+
+        stats = self.session_stats
+        stats['bytes_from_disk'] += nbytes
+        with self._io_lock:
+            stats.update(self._io)
+        if stats['io_active_s'] > 0:
+            stats['io_depth'] = stats['io_busy_s'] / stats['io_active_s']
+            stats['io_mbyteps'] = stats['io_bytes'] * 1e-6 / stats['io_active_s']
+        logger.debug("Read {} items, {} bytes, {:.3f} ms".format(len(items), nbytes, (time.time() - tic) * 1000))
+        return [True] * len(items)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self._pending.clear()
+        with self._io_lock:
+            self.session_stats.update(self._io)
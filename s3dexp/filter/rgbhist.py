@@ -1,11 +1,14 @@
 import itertools
 import cv2
 import numpy as np
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 
 # https://www.pyimagesearch.com/2014/01/22/clever-girl-a-guide-to-utilizing-color-histograms-for-computer-vision-and-image-search-engines/
 
 class RGBHist1dFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ('rgb_hist_1d', )
+
     def __init__(self, color='r', higher_than=200, pixels_threshold=1000):
         super(RGBHist1dFilter, self).__init__(color, higher_than, pixels_threshold)
         color = color.lower()
@@ -28,6 +31,9 @@ class RGBHist1dFilter(Filter):
 
 
 class RGBHist2dFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ('rgb_hist_2d', )
+
     def __init__(self):
         super(RGBHist2dFilter, self).__init__()
 
@@ -46,6 +52,9 @@ class RGBHist2dFilter(Filter):
 
 
 class RGBHist3dFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ('rgb_hist_3d', )
+
     N_BINS = 8
 
     def __init__(self, color='r', higher_than=200, pixels_threshold=1000, other_lower_than=128):
@@ -1,7 +1,13 @@
+from logzero import logger
+import time
+
 from s3dexp.sim.client import SmartStorageClient
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item, required_attrs
 
 class SmartReadFilter(Filter):
+    reads = ()
+    writes = (Item.DATA, )
+
     def __init__(self, map_from_dir, map_to_ppm_dir):
         super(SmartReadFilter, self).__init__()
         self.ss_client = SmartStorageClient(map_from_dir, map_to_ppm_dir)
@@ -13,9 +19,12 @@ class SmartReadFilter(Filter):
         return True
 
 class SmartDecodeFilter(Filter):
-    def __init__(self, map_from_dir, map_to_ppm_dir):
+    reads = ()
+    writes = (Item.ARRAY, )
+
+    def __init__(self, map_from_dir, map_to_ppm_dir, cache_mbytes=None):
         super(SmartDecodeFilter, self).__init__(map_from_dir)
-        self.ss_client = SmartStorageClient(map_from_dir, map_to_ppm_dir)
+        self.ss_client = SmartStorageClient(map_from_dir, map_to_ppm_dir, cache_mbytes=cache_mbytes)
 
     def __call__(self, item):
         path = item.src
@@ -26,9 +35,12 @@ class SmartDecodeFilter(Filter):
 
 
 class SmartFaceFilter(Filter):
-    def __init__(self, map_from_dir, map_to_ppm_dir, min_faces=1):
+    reads = ()
+    writes = (Item.ARRAY, 'face_detection')
+
+    def __init__(self, map_from_dir, map_to_ppm_dir, min_faces=1, cache_mbytes=None):
         super(SmartFaceFilter, self).__init__(map_from_dir, min_faces)
-        self.ss_client = SmartStorageClient(map_from_dir, map_to_ppm_dir)
+        self.ss_client = SmartStorageClient(map_from_dir, map_to_ppm_dir, cache_mbytes=cache_mbytes)
         self.min_faces = 1
 
     def __call__(self, item):
@@ -40,3 +52,42 @@ class SmartFaceFilter(Filter):
         self.session_stats['bytes_from_disk'] += sum(map(lambda b: abs(3*(b[0]-b[2])*(b[1]-b[3])), boxes))
 
         return len(boxes) >= self.min_faces
+
+
+class OffloadFilter(Filter):
+    reads = ()
+    writes = None   # whatever the device-side filters write
+
+    def __init__(self, device):
+        """Run the device-side prefix of a filter chain on an emulated device (s3dexp.smart.emdevice.EmDevice).
+        Items discarded on the device never reach the host; surviving items come back 
+        with the attributes the device-side filters set and the host-side filters read.
+        """
+        super(OffloadFilter, self).__init__()
+        self.device = device
+        self.client_id = device.connect()
+        self.ship = None
+        self._str = "OffloadFilter({})".format(device)
+
+    def set_downstream(self, filters):
+        # only transfer what the host-side filters need
+        self.ship = required_attrs(filters)
+        logger.info("Attributes to ship from the device: {}".format('all' if self.ship is None else sorted(self.ship)))
+
+    def __call__(self, item):
+        return self.call_batch([item])[0]
+
+    def call_batch(self, items):
+        completion_time, nbytes, results = self.device.call(self.client_id, [item.src for item in items], self.ship)
+        slack = completion_time - time.time()
+        if slack > 0:
+            time.sleep(slack)
+        self.session_stats['bytes_from_disk'] += nbytes
+
+        rets = []
+        for item, attrs in zip(items, results):
+            if attrs is not None:
+                for k, v in attrs.items():
+                    item[k] = v
+            rets.append(attrs is not None)
+        return rets
@@ -13,7 +13,7 @@ from kv_client import Client, kinetic_pb2
 StatusCodes = kinetic_pb2.Command.Status.StatusCode
 MsgTypes = kinetic_pb2.Command.MessageType
 
-from s3dexp.search import Filter
+from s3dexp.search import Filter, Item
 from s3dexp.kinetic.proxy_client import KineticProxyClient
 
 def get_drives_envvar():
@@ -22,6 +22,9 @@ def get_drives_envvar():
     return rv
 
 class SimpleKineticGetFilter(Filter):
+    reads = ()
+    writes = (Item.DATA, )
+
     def __init__(self, drive_ips=None):
         super(SimpleKineticGetFilter, self).__init__()
 
@@ -78,6 +81,9 @@ import numpy as np
 from s3dexp.kinetic.proxy_pb2 import Message
 
 class ProxyKineticGetDecodeFilter(Filter):
+    reads = ()
+    writes = (Item.ARRAY, )
+
     def __init__(self, drive_ips=None, base_dir='/home/zf/activedisk/data/flickr15k/', decoded_dir='/mnt/ramfs/', mpixps=140., em_wait=True):
         super(ProxyKineticGetDecodeFilter, self).__init__()
 
@@ -0,0 +1,245 @@
+"""A persistent index of the files of a dataset (path, size, inode, mtime, FIE physical start,
+and optionally all extents), so that drivers don't walk the whole directory tree on every run.
+
+Refresh is incremental: only directories whose mtime changed are re-listed.
+Files modified in place (which doesn't touch the directory mtime) are only picked up
+with refresh(verify=True), which stats every file.
+"""
+
+import hashlib
+import multiprocessing as mp
+import os
+
+from logzero import logger
+import numpy as np
+
+from s3dexp import config
+from s3dexp.scan_scheduler import _extents_or_empty
+from s3dexp.utils import get_fie_physical_start
+
+FIE_UNKNOWN = -1
+
+
+def _normalize_ext(ext):
+    return ext if ext.startswith('.') else '.' + ext
+
+
+def _fie_or_unknown(path):
+    try:
+        return path, get_fie_physical_start(path)
+    except (IOError, OSError, StopIteration):
+        return path, FIE_UNKNOWN
+
+
+class Manifest(object):
+    def __init__(self, base_dir, ext='.jpg', manifest_path=None):
+        super(Manifest, self).__init__()
+        self.base_dir = os.path.realpath(base_dir)
+        self.ext = _normalize_ext(ext)
+        if manifest_path is None:
+            key = hashlib.md5('{}:{}'.format(self.base_dir, self.ext)).hexdigest()
+            manifest_path = os.path.join(config.MANIFEST_DIR, 'manifest-{}.npz'.format(key))
+        self.manifest_path = manifest_path
+
+        self._dirs = {}     # dir -> mtime
+        self._files = {}    # path -> (size, ino, mtime, fie)
+        self._extents = {}  # path -> list of (logical, physical, length), once mapped by update_extents()
+
+    def load(self):
+        """Load from disk. Returns False if there is no saved manifest."""
+        if not os.path.exists(self.manifest_path):
+            return False
+        npz = np.load(self.manifest_path)
+        self._dirs = dict(zip(npz['dirs']['path'], npz['dirs']['mtime']))
+        files = npz['files']
+        self._files = dict((r['path'], (int(r['size']), int(r['ino']), float(r['mtime']), int(r['fie'])))
+                           for r in files)
+        self._extents = {}
+        if 'extents' in npz.files:
+            extents = npz['extents']
+            for r in files[files['ext_count'] >= 0]:
+                self._extents[r['path']] = map(tuple, extents[r['ext_first']:r['ext_first'] + r['ext_count']].tolist())
+        logger.info("Loaded manifest of {} files from {}".format(len(self._files), self.manifest_path))
+        return True
+
+    def save(self):
+        d = os.path.dirname(self.manifest_path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        path_len = max([1] + map(len, self._dirs.keys() + self._files.keys()))
+        dirs = np.array(sorted(self._dirs.items()), dtype=[('path', 'S{}'.format(path_len)), ('mtime', 'f8')])
+        # extents of all files in one (logical, physical, length) array, each file pointing to its range. -1: not mapped
+        records, extents = [], []
+        for p, rec in sorted(self._files.items()):
+            ext = self._extents.get(p)
+            records.append((p, ) + rec + (len(extents), -1 if ext is None else len(ext)))
+            extents.extend(ext or [])
+        files = np.array(records, dtype=[('path', 'S{}'.format(path_len)), ('size', 'i8'), ('ino', 'u8'),
+                                         ('mtime', 'f8'), ('fie', 'i8'), ('ext_first', 'i8'), ('ext_count', 'i8')])
+        extents = np.array(extents, dtype=np.int64).reshape((-1, 3))
+        # write to a temp file first so a crash doesn't leave a truncated manifest
+        tmp_path = self.manifest_path + '.tmp.npz'
+        np.savez(tmp_path, dirs=dirs, files=files, extents=extents)
+        os.rename(tmp_path, self.manifest_path)
+        logger.info("Saved manifest of {} files to {}".format(len(self._files), self.manifest_path))
+
+    def _stat_file(self, path, st=None):
+        st = st or os.stat(path)
+        old = self._files.get(path)
+        fie = FIE_UNKNOWN
+        if old is not None and old[:3] == (st.st_size, st.st_ino, st.st_mtime):
+            fie = old[3]
+        else:
+            self._extents.pop(path, None)
+        self._files[path] = (st.st_size, st.st_ino, st.st_mtime, fie)
+
+    def _scan_dir(self, d):
+        """List one directory. Returns (subdirectories not yet known, set of files present)."""
+        self._dirs[d] = os.stat(d).st_mtime
+        present = set()
+        new_subdirs = []
+        for name in os.listdir(d):
+            p = os.path.join(d, name)
+            if os.path.isdir(p):
+                if p not in self._dirs:
+                    new_subdirs.append(p)
+            elif os.path.splitext(name)[1] == self.ext:
+                present.add(p)
+                self._stat_file(p)
+        return new_subdirs, present
+
+    def _drop_dir(self, d):
+        prefix = d + os.sep
+        for p in [p for p in self._dirs if p == d or p.startswith(prefix)]:
+            del self._dirs[p]
+        for p in [p for p in self._files if p.startswith(prefix)]:
+            del self._files[p]
+
+    def refresh(self, verify=False):
+        """Bring the manifest up to date with the file system.
+        
+        Keyword Arguments:
+            verify {bool} -- also stat every known file to catch in-place modification (default: {False})
+        
+        Returns:
+            bool -- whether anything was re-scanned
+        """
+        if not self._dirs:
+            stack = [self.base_dir]
+        else:
+            stack = []
+            for d, mtime in self._dirs.items():
+                if d not in self._dirs:
+                    continue    # dropped along with a parent
+                try:
+                    changed = os.stat(d).st_mtime != mtime
+                except OSError:
+                    self._drop_dir(d)
+                    continue
+                if changed:
+                    stack.append(d)
+
+        scanned = set()
+        present = set()
+        while stack:
+            d = stack.pop()
+            new_subdirs, files = self._scan_dir(d)
+            stack.extend(new_subdirs)
+            present.update(files)
+            scanned.add(d)
+
+        # drop files deleted from re-scanned directories
+        if scanned:
+            for p in [p for p in self._files if os.path.dirname(p) in scanned and p not in present]:
+                del self._files[p]
+
+        if verify:
+            for p in self._files.keys():
+                try:
+                    self._stat_file(p)
+                except OSError:
+                    del self._files[p]
+
+        if scanned:
+            logger.info("Scanned {} directories under {}".format(len(scanned), self.base_dir))
+        return bool(scanned) or verify
+
+    def update_fie(self, num_workers=16):
+        """Fill in FIE physical start for files that don't have it. Returns number of files updated."""
+        todo = [p for p, rec in self._files.items() if rec[3] == FIE_UNKNOWN]
+        if not todo:
+            return 0
+        logger.info("Getting FIE of {} files with {} workers".format(len(todo), num_workers))
+        pool = mp.Pool(num_workers)
+        try:
+            for p, fie in pool.imap_unordered(_fie_or_unknown, todo, 64):
+                self._files[p] = self._files[p][:3] + (fie, )
+        finally:
+            pool.close()
+            pool.join()
+        return len(todo)
+
+    def update_extents(self, num_workers=16):
+        """Map all extents of files that don't have them (FIEMAP), also filling in their FIE physical start.
+        Returns number of files updated."""
+        todo = [p for p in self._files if p not in self._extents]
+        if not todo:
+            return 0
+        logger.info("Running FIEMAP on {} files with {} workers".format(len(todo), num_workers))
+        pool = mp.Pool(num_workers)
+        try:
+            for p, extents in pool.imap_unordered(_extents_or_empty, todo, 64):
+                self._extents[p] = extents
+                if extents:
+                    self._files[p] = self._files[p][:3] + (extents[0][1], )
+        finally:
+            pool.close()
+            pool.join()
+        return len(todo)
+
+    @property
+    def paths(self):
+        return sorted(self._files.keys())
+
+    def __len__(self):
+        return len(self._files)
+
+    def size(self, path):
+        return self._files[path][0]
+
+    def ino(self, path):
+        return self._files[path][1]
+
+    def fie(self, path):
+        return self._files[path][3]
+
+    def extents(self, path):
+        """List of (logical, physical, length), or None if not mapped yet (see update_extents())"""
+        return self._extents.get(path) if path in self._files else None
+
+    def extent_map(self, paths=None):
+        """path -> list of extents of the mapped files among `paths` (default: all files)"""
+        paths = self._files.keys() if paths is None else paths
+        return dict((p, self._extents[p]) for p in paths if p in self._files and p in self._extents)
+
+
+def load_manifest(base_dir, ext='.jpg', manifest_path=None, fie=False, verify=False, extents=False):
+    """Load the manifest of base_dir (building it the first time), refresh it, and save if changed.
+    
+    Keyword Arguments:
+        fie {bool} -- make sure FIE physical start is known for all files (default: {False})
+        extents {bool} -- make sure all extents are known for all files, e.g., for scan_scheduler (default: {False})
+    
+    Returns:
+        Manifest
+    """
+    m = Manifest(base_dir, ext, manifest_path)
+    m.load()
+    changed = m.refresh(verify=verify)
+    if fie:
+        changed = m.update_fie() > 0 or changed
+    if extents:
+        changed = m.update_extents() > 0 or changed
+    if changed:
+        m.save()
+    return m
@@ -0,0 +1,63 @@
+import ctypes
+import multiprocessing as mp
+
+from logzero import logger
+import numpy as np
+
+
+class SharedArrayRing(object):
+    """A pool of fixed-size array slots in shared memory for handing decoded images from
+    worker processes to a consumer without pickling them.
+
+    Producer: slot_id, arr = ring.acquire(); write into arr; ring.commit(slot_id)
+    Consumer: slot_id, arr, meta = ring.get(); use arr; ring.release(slot_id)
+
+    Only slot ids (and optional small metadata) go through the queues. `arr` is a numpy view
+    into the shared buffer, so it must not be used after release().
+    Must be created before forking the producers.
+    """
+
+    def __init__(self, num_slots, shape, dtype=np.uint8):
+        super(SharedArrayRing, self).__init__()
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        slot_nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self._buf = mp.RawArray(ctypes.c_uint8, num_slots * slot_nbytes)
+        self._arrays = np.frombuffer(self._buf, dtype=self.dtype).reshape((num_slots, ) + self.shape)
+
+        self._free = mp.Queue()
+        self._ready = mp.Queue()
+        for i in range(num_slots):
+            self._free.put(i)
+        logger.info("Created SharedArrayRing of {} x {} {}, {:.1f} MB".format(
+            num_slots, self.shape, self.dtype, num_slots * slot_nbytes * 1e-6))
+
+    def view(self, slot_id):
+        return self._arrays[slot_id]
+
+    def acquire(self, block=True, timeout=None):
+        """Producer: block until a slot is free. Returns (slot_id, writable view)."""
+        slot_id = self._free.get(block, timeout)
+        return slot_id, self._arrays[slot_id]
+
+    def commit(self, slot_id, meta=None):
+        """Producer: publish a filled slot to the consumer. slot_id None sends `meta` alone, e.g., an end marker."""
+        self._ready.put((slot_id, meta))
+
+    def put(self, arr, meta=None):
+        """Producer: copy `arr` into a free slot and publish it."""
+        assert arr.shape == self.shape, "Expect shape {}, got {}".format(self.shape, arr.shape)
+        slot_id, view = self.acquire()
+        view[...] = arr
+        self.commit(slot_id, meta)
+
+    def get(self, block=True, timeout=None):
+        """Consumer: returns (slot_id, view, meta) of the next filled slot."""
+        slot_id, meta = self._ready.get(block, timeout)
+        return slot_id, (self._arrays[slot_id] if slot_id is not None else None), meta
+
+    def release(self, slot_id):
+        """Consumer: hand the slot back to producers."""
+        self._free.put(slot_id)
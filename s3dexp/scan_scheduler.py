@@ -0,0 +1,120 @@
+"""Order a scan of many files by their physical location on disk (via FIEMAP),
+so that a search on an HDD reads the dataset with as little seeking as possible."""
+
+import bisect
+import multiprocessing as mp
+
+from logzero import logger
+
+from s3dexp.fiemap import fiemap2, FIEMAP_FLAG_SYNC
+
+
+def get_extents(path):
+    """Return a list of (logical, physical, length) of all extents of a file, in logical order."""
+    with open(path, 'r') as f:
+        extents = [(rec.logical, rec.physical, rec.length) for rec in fiemap2(f, flags=FIEMAP_FLAG_SYNC)]
+    return sorted(extents)
+
+
+def _extents_or_empty(path):
+    try:
+        return path, get_extents(path)
+    except (IOError, OSError) as e:
+        logger.warn("FIEMAP failed on {}: {}".format(path, e))
+        return path, []
+
+
+def build_extent_map(paths, manifest=None, num_workers=16):
+    """Map each path to its list of extents. Runs FIEMAP in parallel.
+    If a Manifest (s3dexp.manifest) of the data set is given, the extents are kept in it: 
+    files it has mapped before and that are unchanged are not mapped again, and the manifest is saved if updated.
+
+    Returns:
+        dict -- path -> list of (logical, physical, length)
+    """
+    extent_map = {}
+    if manifest is not None:
+        if manifest.update_extents(num_workers) > 0:
+            manifest.save()
+        extent_map = manifest.extent_map(paths)
+
+    # files outside the manifest
+    todo = [p for p in paths if p not in extent_map]
+    if todo:
+        logger.info("Running FIEMAP on {} files with {} workers".format(len(todo), num_workers))
+        pool = mp.Pool(num_workers)
+        try:
+            for path, extents in pool.imap_unordered(_extents_or_empty, todo, 64):
+                extent_map[path] = extents
+        finally:
+            pool.close()
+            pool.join()
+
+    return extent_map
+
+
+def _span(extents):
+    # physical position where reading the file starts and where the head is left afterwards
+    if not extents:
+        return 0, 0
+    first, last = extents[0], extents[-1]
+    return first[1], last[1] + last[2]
+
+
+def scan_order(extent_map):
+    """Return paths in C-SCAN (one-directional elevator) order: always read next the unread file
+    whose first extent is the closest ahead of where the previous file left the head, wrapping
+    around at the end. Files are read in logical order, so a fragmented file leaves the head at
+    the end of its last extent rather than its first."""
+    spans = sorted((_span(extents) + (path, ) for path, extents in extent_map.items()))
+    starts = [s[0] for s in spans]
+    n = len(spans)
+
+    # next_unread[i]: smallest j >= i not yet read (n if none). Path-compressed.
+    next_unread = list(range(n + 1))
+
+    def find(i):
+        root = i
+        while next_unread[root] != root:
+            root = next_unread[root]
+        while next_unread[i] != root:
+            next_unread[i], i = root, next_unread[i]
+        return root
+
+    order = []
+    head = 0
+    for _ in range(n):
+        i = find(bisect.bisect_left(starts, head))
+        if i == n:
+            i = find(0)     # wrap around
+        _, head, path = spans[i]
+        next_unread[i] = i + 1
+        order.append(path)
+    return order
+
+
+def seek_distance(order, extent_map):
+    """Total physical distance (bytes) the head travels between extents to read files in `order`."""
+    dist = 0
+    head = None
+    for path in order:
+        for _, physical, length in extent_map[path]:
+            if head is not None:
+                dist += abs(physical - head)
+            head = physical + length
+    return dist
+
+
+def schedule(paths, manifest=None, num_workers=16, extent_map=None):
+    """Return `paths` reordered to minimize seek distance. Files that FIEMAP cannot map go last.
+    Pass the data set's Manifest to keep the extents in it (see build_extent_map()),
+    or `extent_map` (path -> extents) if the extents are already known."""
+    if extent_map is None:
+        extent_map = build_extent_map(paths, manifest=manifest, num_workers=num_workers)
+    mapped = dict((p, extent_map[p]) for p in paths if extent_map.get(p))
+    order = scan_order(mapped)
+    unmapped = [p for p in paths if p not in mapped]
+    num_extents = sum(map(len, mapped.values()))
+    logger.info("Scheduled {} files ({} extents, {} unmapped). Seek distance {:.1f} GB".format(
+        len(order), num_extents, len(unmapped), seek_distance(order, mapped) * 1e-9))
+    return order + unmapped
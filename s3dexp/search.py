@@ -1,40 +1,52 @@
+import array
 import collections
+import csv
+import ctypes
+import json
 import multiprocessing as mp
 import os
+import pickle
 import time
 
 from logzero import logger
 import numpy as np
 from tqdm import tqdm
 
+from s3dexp.utils import thread_cputime
+
 
 class Item(object):
+    # keys of the built-in attributes, e.g., for Filter.reads and Filter.writes
+    SRC = '_src'
+    DATA = ''
+    ARRAY = '_array'
+
     def __init__(self, src):
         super(Item, self).__init__()
         self._attrs = dict()
         assert isinstance(src, (str, unicode))
-        self._attrs['_src'] = src
+        self._attrs[Item.SRC] = src
 
     @property
     def src(self):
-        return self._attrs['_src']
+        return self._attrs[Item.SRC]
 
     @property
     def data(self):
-        return self._attrs['']
+        return self._attrs[Item.DATA]
 
     @data.setter
     def data(self, v):
-        self._attrs[''] = v
+        self._attrs[Item.DATA] = v
 
     @property
     def array(self):
-        return self._attrs['_array']
+        return self._attrs[Item.ARRAY]
 
     @array.setter 
     def array(self, v):
         assert isinstance(v, np.ndarray), "Expect numpy array, got {}".format(type(v))
-        self._attrs['_array'] = v
+        self._attrs[Item.ARRAY] = v
 
     def __getitem__(self, key):
         return self._attrs[key]
@@ -46,7 +58,24 @@ class Item(object):
         return key in self._attrs
 
 
+def attr_size(val):
+    """Bytes it takes to ship an Item attribute"""
+    if isinstance(val, np.ndarray):
+        return val.nbytes
+    elif isinstance(val, (str, bytes)):
+        return len(val)
+    return len(pickle.dumps(val, pickle.HIGHEST_PROTOCOL))
+
+
 class Filter(object):
+    # Keys of the Item attributes the filter reads and writes (besides src). 
+    # reads = None means it may read anything, so everything must be kept for it; writes = None means unknown.
+    # Filters whose attributes depend on their arguments set these in __init__.
+    reads = None
+    writes = None
+    # number of paths after the current item that the filter wants to know of in advance, see hint()
+    lookahead = 0
+
     def __init__(self, *args, **kwargs):
         super(Filter, self).__init__()
         self._str = "{}({}, {})".format(type(self).__name__, ','.join(map(str,args)), str(kwargs))
@@ -54,6 +83,11 @@ class Filter(object):
     def __call__(self, item):
         raise NotImplementedError
 
+    def call_batch(self, items):
+        """Run the filter on a list of items. Returns a list of bools in the same order.
+        Override this for filters that can process a stack of items at once."""
+        return [self(item) for item in items]
+
     def __str__(self):
         return self._str
 
@@ -62,6 +96,103 @@ class Filter(object):
         # e.g., bytes read from (emulated) disk
         self.session_stats = dct
 
+    def set_downstream(self, filters):
+        # Pass in the filters that run after this one, 
+        # e.g., to find out which attributes they need with required_attrs()
+        pass
+
+    def hint(self, paths):
+        # Pass in paths of items that will come next, in queue order, e.g., to start reading them.
+        # Some may never reach this filter if an upstream filter drops them.
+        pass
+
+    def close(self):
+        # Release resources, e.g., thread pools. Called when the worker is done.
+        pass
+
+
+def required_attrs(filters):
+    """Keys of the Item attributes that must be present before running `filters` in order.
+    None if some filter does not declare what it reads."""
+    needed, written = set(), set()
+    for f in filters:
+        if f.reads is None:
+            return None
+        needed |= set(f.reads) - written
+        written |= set(f.writes or ())
+    return needed
+
+
+def must_precede(a, b):
+    """Whether filter `a`, which comes before `b` in a chain, must stay before it
+    judging by the attributes they declare to read and write."""
+    if a.reads is None or b.reads is None or a.writes is None or b.writes is None:
+        return True
+    a_reads, a_writes, b_reads, b_writes = map(set, (a.reads, a.writes, b.reads, b.writes))
+    return bool(a_writes & b_reads or a_reads & b_writes or a_writes & b_writes)
+
+
+class FilterOrderOptimizer(object):
+    """Reorders a filter chain online to minimize the expected cost per item (predicate ordering).
+    Using each filter's measured wall time per item and pass rate, every `interval` items it
+    puts the filter with the lowest rank = cost / (1 - pass rate) first among those whose dependencies (see must_precede()) have run.
+    Filters not measured yet rank first so that they get measured.
+    After reordering, each filter is told its new downstream filters (Filter.set_downstream()).
+    """
+    def __init__(self, filters, filter_stats, interval=100):
+        """
+        Arguments:
+            filters {list} -- the filter chain in its original order
+            filter_stats {list} -- per-filter stats as updated by search_work(), in the same order
+        """
+        super(FilterOrderOptimizer, self).__init__()
+        self.filters = list(filters)
+        self.filter_stats = filter_stats
+        self.interval = interval
+        n = len(self.filters)
+        # filters that must run before each filter
+        self._deps = [set(i for i in range(j) if must_precede(self.filters[i], self.filters[j])) for j in range(n)]
+        self._order = range(n)
+        self._countdown = interval
+
+    @property
+    def chain(self):
+        """The filters in the current order"""
+        return [self.filters[i] for i in self._order]
+
+    def tick(self, num_items=1):
+        """Count `num_items` finished items. Reorders the chain every `interval` items."""
+        self._countdown -= num_items
+        if self._countdown <= 0:
+            self._countdown = self.interval
+            order = self._best_order()
+            if order != self._order:
+                self._order = order
+                chain = self.chain
+                # e.g., what OffloadFilter ships depends on the filters after it
+                for i, f in enumerate(chain):
+                    f.set_downstream(chain[i+1:])
+                logger.info("[Worker {}] Reordered filters: {}".format(os.getpid(), ', '.join(map(str, chain))))
+
+    def _rank(self, i):
+        st = self.filter_stats[i]
+        if st['items'] == 0:
+            return float('-inf')
+        cost = st['wall_time'] / st['items']
+        drop_rate = 1. - float(st['passed_items']) / st['items']
+        return cost / drop_rate if drop_rate > 0 else float('inf')
+
+    def _best_order(self):
+        order = []
+        placed = set()
+        while len(order) < len(self.filters):
+            ready = [i for i in range(len(self.filters)) if i not in placed and self._deps[i] <= placed]
+            # ties (e.g., filters that never drop) keep the original order
+            i = min(ready, key=lambda i: (self._rank(i), i))
+            order.append(i)
+            placed.add(i)
+        return order
+
 
 class FilterConfig(object):
     def __init__(self, filter_cls, args=[], kwargs={}):
@@ -74,6 +205,55 @@ class FilterConfig(object):
     def instantiate(self):
         return self.filter_cls(*self.args, **self.kwargs)
 
+    def __str__(self):
+        # same as Filter.__str__() of the instance
+        return "{}({}, {})".format(self.filter_cls.__name__, ','.join(map(str, self.args)), str(self.kwargs))
+
+
+# per-filter counters kept by search_work()
+FILTER_STAT_KEYS = ('calls', 'items', 'passed_items', 'wall_time', 'cpu_time', 'bytes_in', 'bytes_out')
+
+
+def _new_filter_stats(names):
+    stats = []
+    for name in names:
+        st = collections.OrderedDict(name=name)
+        st.update((k, 0.) for k in FILTER_STAT_KEYS)
+        stats.append(st)
+    return stats
+
+
+def _merge_filter_stats(into, filter_stats):
+    for dst, src in zip(into, filter_stats):
+        for k in FILTER_STAT_KEYS:
+            dst[k] += src[k]
+
+
+def format_filter_stats(filter_stats):
+    """A human-readable table of per-filter stats (e.g., context.stats['filters'])"""
+    lines = ["{:>8} {:>8} {:>10} {:>10} {:>12} {:>12}  {}".format(
+        'items', 'pass %', 'wall ms', 'cpu ms', 'MB in', 'MB out', 'filter')]
+    for st in filter_stats:
+        items = max(st['items'], 1)
+        lines.append("{:8.0f} {:8.1f} {:10.3f} {:10.3f} {:12.3f} {:12.3f}  {}".format(
+            st['items'], 100. * st['passed_items'] / items, 1e3 * st['wall_time'] / items, 1e3 * st['cpu_time'] / items,
+            st['bytes_in'] * 1e-6, st['bytes_out'] * 1e-6, st['name']))
+    return '\n'.join(lines)
+
+
+def dump_filter_stats(filter_stats, path):
+    """Write per-filter stats to a .json or .csv file"""
+    filter_stats = [dict(st) for st in filter_stats]
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(filter_stats, f, indent=2)
+    else:
+        with open(path, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=('name', ) + FILTER_STAT_KEYS)
+            writer.writeheader()
+            writer.writerows(filter_stats)
+    logger.info("Wrote stats of {} filters to {}".format(len(filter_stats), path))
+
 
 class Context(object):
     """Shared data structure by multi processes. Don't update it too frequently."""
@@ -87,14 +267,177 @@ class Context(object):
             cpu_time=0.,
             passed_items=0,
             bytes_from_disk=0,
+            io_busy_s=0.,
+            io_active_s=0.,
+            io_bytes=0,
+            filters=[],
         )
 
+    def init_filter_stats(self, names):
+        # keep accumulating over runs of the same chain, like the other stats
+        names = list(names)
+        if [st['name'] for st in self.stats['filters']] != names:
+            self.stats['filters'] = _new_filter_stats(names)
+
+    def add_filter_stats(self, filter_stats):
+        # call with self.lock held
+        merged = self.stats['filters']
+        _merge_filter_stats(merged, filter_stats)
+        self.stats['filters'] = merged
+
+
+class _SharedStats(object):
+    """dict-like view of a few float counters kept in shared memory."""
+    KEYS = ('num_items', 'num_workers', 'cpu_time', 'passed_items', 'bytes_from_disk', 'io_busy_s', 'io_active_s', 'io_bytes')
+
+    def __init__(self):
+        super(_SharedStats, self).__init__()
+        self._arr = mp.RawArray('d', len(self.KEYS))
+        self._filter_names = []
+        self._filter_arr = None
+
+    def init_filters(self, names):
+        # must be called before forking workers
+        names = list(names)
+        if names == self._filter_names:
+            return
+        self._filter_names = names
+        self._filter_arr = mp.RawArray('d', len(names) * len(FILTER_STAT_KEYS))
+
+    def add_filters(self, filter_stats):
+        for i, st in enumerate(filter_stats):
+            for j, k in enumerate(FILTER_STAT_KEYS):
+                self._filter_arr[i * len(FILTER_STAT_KEYS) + j] += st[k]
+
+    def __getitem__(self, key):
+        if key == 'filters':
+            stats = _new_filter_stats(self._filter_names)
+            for i, st in enumerate(stats):
+                for j, k in enumerate(FILTER_STAT_KEYS):
+                    st[k] = self._filter_arr[i * len(FILTER_STAT_KEYS) + j]
+            return stats
+        return self._arr[self.KEYS.index(key)]
 
-def search_work(filter_configs, context, worker_id=0):
-    assert isinstance(context, Context)
+    def __setitem__(self, key, val):
+        self._arr[self.KEYS.index(key)] = val
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def items(self):
+        return zip(self.KEYS, self._arr[:])
+
+    def __repr__(self):
+        return str(dict(self.items()))
+
+
+class _SharedPathQueue(object):
+    """Paths packed into a shared-memory table before workers are forked.
+    Workers claim the next chunk by bumping a shared cursor, so there is no broker process.
+    Mimics the subset of JoinableQueue used by search_work()."""
+    def __init__(self):
+        super(_SharedPathQueue, self).__init__()
+        self._cursor = mp.Value('l', 0)
+        self._blob = None
+        self._offsets = None
+        self._num_paths = 0
+        self._batch_size = 1
+
+    def load(self, paths, batch_size=1):
+        # must be called before forking workers. 
+        # Packs the paths as they come from an iterable, without holding a list of them.
+        blob = bytearray()
+        offsets = array.array('l', [0])
+        for p in paths:
+            blob.extend(p.encode('utf-8') if isinstance(p, unicode) else p)
+            offsets.append(len(blob))
+        self._blob = mp.RawArray('c', max(1, len(blob)))
+        if blob:
+            ctypes.memmove(self._blob, (ctypes.c_char * len(blob)).from_buffer(blob), len(blob))
+        self._offsets = mp.RawArray('l', len(offsets))
+        ctypes.memmove(self._offsets, offsets.buffer_info()[0], len(offsets) * offsets.itemsize)
+        self._num_paths = len(offsets) - 1
+        self._batch_size = batch_size
+        self._cursor.value = 0
+        return self._num_paths
+
+    def _path(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i+1]]
+
+    def get(self):
+        """Return the next path (or list of paths if batch_size > 1). None when exhausted."""
+        with self._cursor.get_lock():
+            start = self._cursor.value
+            self._cursor.value = min(start + self._batch_size, self._num_paths)
+        end = min(start + self._batch_size, self._num_paths)
+        if start >= end:
+            return None
+        if self._batch_size == 1:
+            return self._path(start)
+        return [self._path(i) for i in range(start, end)]
+
+    def task_done(self):
+        pass
+
+    def put(self, _):
+        raise NotImplementedError("Paths must be loaded before workers start. Use load().")
+
+    def join(self):
+        pass
+
+
+class SharedContext(object):
+    """Drop-in alternative to Context that needs no Manager process.
+    The work list and stats live in shared memory inherited by forked workers.
+    `manager` is accepted for signature compatibility with Context and ignored."""
+    def __init__(self, manager=None, qsize=None):
+        super(SharedContext, self).__init__()
+        self.lock = mp.Lock()
+        self.q = _SharedPathQueue()
+        self.stats = _SharedStats()
+
+    def init_filter_stats(self, names):
+        self.stats.init_filters(names)
+
+    def add_filter_stats(self, filter_stats):
+        # call with self.lock held
+        self.stats.add_filters(filter_stats)
+
+
+def _input_size(item, keys):
+    if keys is None:
+        return sum(attr_size(v) for k, v in item._attrs.items() if k != Item.SRC)
+    return sum(attr_size(item[k]) for k in keys if k in item)
+
+
+def _call_filter(f, items, batch, st, count_bytes=False):
+    """Run `f` on a batch of items, or on one item in a list, and update its stats `st`. Returns the list of results.
+    Sizing attributes costs more than a cheap filter, so bytes_in and bytes_out are only counted if `count_bytes`."""
+    if count_bytes:
+        bytes_in = sum(_input_size(item, f.reads) for item in items)
+        before = [dict(item._attrs) for item in items]
+    tic, tic_cpu = time.time(), thread_cputime()
+    rets = f.call_batch(items) if batch else [f(items[0])]
+    st['cpu_time'] += thread_cputime() - tic_cpu
+    st['wall_time'] += time.time() - tic
+    st['calls'] += 1
+    st['items'] += len(items)
+    st['passed_items'] += sum(map(bool, rets))
+    if count_bytes:
+        st['bytes_in'] += bytes_in
+        # whatever the filter added or replaced
+        st['bytes_out'] += sum(attr_size(v) for item, old in zip(items, before) for k, v in item._attrs.items() if old.get(k) is not v)
+    return rets
+
+
+def search_work(filter_configs, context, worker_id=0, reorder_interval=None, filter_bytes=False):
+    assert isinstance(context, (Context, SharedContext))
     logger.info("[Worker {}] started".format(os.getpid()))
     filters = map(lambda fc: fc.instantiate(), filter_configs)
     map(logger.debug, map(str, filters))
+    filter_stats = _new_filter_stats(map(str, filters))
+    stats_of = dict((id(f), st) for f, st in zip(filters, filter_stats))
+    optimizer = FilterOrderOptimizer(filters, filter_stats, reorder_interval) if reorder_interval else None
 
     tic_cpu = time.clock()
     count = 0
@@ -103,35 +446,68 @@ def search_work(filter_configs, context, worker_id=0):
     # allow different filters to update some global stats
     session_stats = collections.defaultdict(float)
     session_stats['worker_id'] = worker_id
-    for f in filters:
+    for i, f in enumerate(filters):
         f.set_session_stats(session_stats)
+        f.set_downstream(filters[i+1:])
+    # pull this many paths from the queue ahead of the current one and hint the filters about them
+    lookahead = max(f.lookahead for f in filters) if filters else 0
+    pending = collections.deque()
 
     try:
         while True:
-            src = context.q.get()
-            try:
+            if not pending:
+                pending.append(context.q.get())
+            ahead = sum(_num_paths(s) for s in list(pending)[1:])
+            while ahead < lookahead and pending[-1] is not None:
+                src = context.q.get()
+                pending.append(src)
                 if src is not None:
+                    ahead += _num_paths(src)
+                    for f in filters:
+                        f.hint(src if isinstance(src, list) else [src])
+            src = pending.popleft()
+            try:
+                if src is None:
+                    logger.info("[Worker {}] terminating on receiving None ".format(os.getpid()))
+                    break
+                elif isinstance(src, list):
+                    # a batch of paths
+                    items = map(Item, src)
+                    for f in (optimizer.chain if optimizer else filters):
+                        rets = _call_filter(f, items, True, stats_of[id(f)], filter_bytes)
+                        items = [item for item, ret in zip(items, rets) if ret]
+                        if not items:
+                            break
+                    if optimizer:
+                        optimizer.tick(len(src))
+                    count += len(src)
+                    count_passed += len(items)
+                    for item in items:
+                        logger.debug("Accepted {}".format(item.src))
+                    del items
+                else:
                     item = Item(src)
                     passed = True
-                    for f in filters:
-                        ret = f(item)
+                    for f in (optimizer.chain if optimizer else filters):
+                        ret, = _call_filter(f, [item], False, stats_of[id(f)], filter_bytes)
                         passed = passed and ret
                         if not passed:
                             break
+                    if optimizer:
+                        optimizer.tick()
                     del item
                     count += 1
                     count_passed += int(passed)
                     if passed:
                         logger.debug("Accepted {}".format(src))
-                else:
-                    logger.info("[Worker {}] terminating on receiving None ".format(os.getpid()))
-                    break
             except Exception as e:
                 logger.error("Exception on {}".format(src))
                 logger.exception(e)
             finally:
                 context.q.task_done()
     finally:
+        for f in filters:
+            f.close()
         elapsed_cpu = time.clock() - tic_cpu
         logger.info("[Worker {}] num_items {}, passed_items {}, elapsed_cpu: {}, session_stats: {}".format(
             os.getpid(), count, count_passed, elapsed_cpu, str(session_stats)))
@@ -141,19 +517,63 @@ def search_work(filter_configs, context, worker_id=0):
             context.stats['cpu_time'] += elapsed_cpu
             context.stats['passed_items'] += count_passed
             context.stats['bytes_from_disk'] += session_stats['bytes_from_disk']
+            for k in ('io_busy_s', 'io_active_s', 'io_bytes'):
+                if k in session_stats:
+                    context.stats[k] += session_stats[k]
+            context.add_filter_stats(filter_stats)
+
+
+def _num_paths(src):
+    return len(src) if isinstance(src, list) else 1
 
     
-def run_search(filter_configs, num_workers, path_list_or_gen, context):
+def _batched(path_list_or_gen, batch_size):
+    batch = []
+    for path in path_list_or_gen:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_search(filter_configs, num_workers, path_list_or_gen, context, batch_size=1, reorder_interval=None, filter_bytes=False):
+    """Run the filter chain on all paths with `num_workers` processes.
+    If batch_size > 1, paths are enqueued as lists of up to batch_size paths
+    and each filter is invoked with Filter.call_batch().
+    If reorder_interval is given, each worker reorders commutable filters every so many items
+    by their measured cost and pass rate (see FilterOrderOptimizer).
+    If filter_bytes, the per-filter stats also count the bytes of attributes each filter reads and writes.
+    """
+    assert batch_size >= 1, "batch_size must be positive: {}".format(batch_size)
+    context.init_filter_stats(map(str, filter_configs))
+    if isinstance(context, SharedContext):
+        # publish all paths before forking so workers inherit the table
+        num_paths = context.q.load(path_list_or_gen, batch_size)
+        logger.info("Loaded {} paths into shared table".format(num_paths))
+
     workers = []
     for i in range(num_workers):
-        w = mp.Process(target=search_work, args=(filter_configs, context, i), name='worker-{}'.format(i))
+        w = mp.Process(target=search_work, args=(filter_configs, context, i, reorder_interval, filter_bytes), name='worker-{}'.format(i))
         w.daemon = True
         w.start()
         workers.append(w)
 
-    for i, path in enumerate(tqdm(path_list_or_gen)):
-        logger.debug("Enque'ing {}".format(path))
-        context.q.put(path)
+    if isinstance(context, SharedContext):
+        logger.info("Waiting for search to finish.")
+        for w in workers:
+            w.join()
+        return
+
+    if batch_size > 1:
+        for batch in tqdm(_batched(path_list_or_gen, batch_size)):
+            logger.debug("Enque'ing batch of {} from {}".format(len(batch), batch[0]))
+            context.q.put(batch)
+    else:
+        for i, path in enumerate(tqdm(path_list_or_gen)):
+            logger.debug("Enque'ing {}".format(path))
+            context.q.put(path)
     # push None as sentinel
     for _ in workers:
         context.q.put(None)
@@ -0,0 +1,167 @@
+import collections
+import heapq
+import itertools
+
+from logzero import logger
+
+
+class FIFOPolicy(object):
+    """Serve requests in arrival order regardless of client."""
+    def __init__(self):
+        super(FIFOPolicy, self).__init__()
+        self._q = collections.deque()
+
+    def push(self, client, item, priority=0):
+        self._q.append(item)
+
+    def pop(self):
+        return self._q.popleft()
+
+    def __len__(self):
+        return len(self._q)
+
+
+class RoundRobinPolicy(object):
+    """One request from each client with pending requests in turn, FIFO within a client."""
+    def __init__(self):
+        super(RoundRobinPolicy, self).__init__()
+        self._queues = collections.OrderedDict()   # client -> deque, in turn order
+        self._len = 0
+
+    def push(self, client, item, priority=0):
+        self._queues.setdefault(client, collections.deque()).append(item)
+        self._len += 1
+
+    def pop(self):
+        client, q = next(iter(self._queues.items()))
+        item = q.popleft()
+        del self._queues[client]
+        if q:
+            self._queues[client] = q    # move to the back of the line
+        self._len -= 1
+        return item
+
+    def __len__(self):
+        return self._len
+
+
+class PriorityPolicy(object):
+    """Lowest priority value first, FIFO among equals."""
+    def __init__(self):
+        super(PriorityPolicy, self).__init__()
+        self._heap = []
+        self._seq = itertools.count()
+
+    def push(self, client, item, priority=0):
+        heapq.heappush(self._heap, (priority, next(self._seq), item))
+
+    def pop(self):
+        return heapq.heappop(self._heap)[-1]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+POLICIES = {
+    'fifo': FIFOPolicy,
+    'rr': RoundRobinPolicy,
+    'priority': PriorityPolicy,
+}
+
+
+class ClientStats(object):
+    def __init__(self):
+        super(ClientStats, self).__init__()
+        self.num_requests = 0
+        self.total_latency = 0.         # completion - request timestamp
+        self.total_queue_wait = 0.      # admission - arrival
+        self.total_arrival_delay = 0.   # arrival - request timestamp, when the request reached the simulator late
+        self.first_arrival = None
+        self.last_completion = None
+
+    def add(self, timestamp, arrival, admitted, completion):
+        self.num_requests += 1
+        self.total_latency += completion - timestamp
+        self.total_queue_wait += admitted - arrival
+        self.total_arrival_delay += arrival - timestamp
+        self.first_arrival = arrival if self.first_arrival is None else min(self.first_arrival, arrival)
+        self.last_completion = completion if self.last_completion is None else max(self.last_completion, completion)
+
+    def format(self):
+        n = self.num_requests
+        span = self.last_completion - self.first_arrival
+        return "{} requests, {:.1f} req/s, avg latency {:.3f} ms, avg queue wait {:.3f} ms, avg arrival delay {:.3f} ms".format(
+            n, n / span if span > 0 else float('nan'),
+            1e3 * self.total_latency / n, 1e3 * self.total_queue_wait / n, 1e3 * self.total_arrival_delay / n)
+
+
+class AdmissionController(object):
+    """Admit requests from many clients into the simulated device.
+
+    A request enters the simulation at its timestamp, or at the current simulated time if it
+    reached the simulator late (simulated time never goes backward). Pending requests wait in
+    per-client queues until fewer than max_inflight requests are being served, and are then
+    picked by the policy. max_inflight=None admits everything at once, leaving contention to
+    the device's own resources.
+    """
+
+    def __init__(self, env, serve_fn, policy='fifo', max_inflight=None):
+        """
+        Arguments:
+            env {simpy.Environment}
+            serve_fn {function} -- serve_fn(request, *args) returns a simpy generator serving the request
+        
+        Keyword Arguments:
+            policy {str} -- one of POLICIES (default: {'fifo'})
+            max_inflight {int} -- max requests served concurrently (default: {None}, unlimited)
+        """
+        super(AdmissionController, self).__init__()
+        assert policy in POLICIES, "Unknown policy {}. Choose from {}".format(policy, POLICIES.keys())
+        self.env = env
+        self.serve_fn = serve_fn
+        self.queue = POLICIES[policy]()
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.stats = collections.defaultdict(ClientStats)
+        self._wakeup = env.event()
+        env.process(self._dispatch())
+        logger.info("Admission policy {}, max inflight {}".format(policy, max_inflight))
+
+    def submit(self, client, timestamp, request, args=(), priority=0):
+        """Submit a request that the client issued at `timestamp`. serve_fn will be called with (request, *args)."""
+        delay = timestamp - self.env.now
+        if delay > 0:
+            self.env.process(self._arrive_later(delay, client, timestamp, request, priority, args))
+        else:
+            self._arrive(client, timestamp, request, priority, args)
+
+    def _arrive_later(self, delay, *args):
+        yield self.env.timeout(delay)
+        self._arrive(*args)
+
+    def _arrive(self, client, timestamp, request, priority, args):
+        self.queue.push(client, (client, timestamp, self.env.now, request, args), priority)
+        self._kick()
+
+    def _kick(self):
+        if not self._wakeup.triggered:
+            self._wakeup.succeed()
+
+    def _dispatch(self):
+        while True:
+            while len(self.queue) and (self.max_inflight is None or self.inflight < self.max_inflight):
+                self.inflight += 1
+                self.env.process(self._serve(*self.queue.pop()))
+            yield self._wakeup
+            self._wakeup = self.env.event()
+
+    def _serve(self, client, timestamp, arrival, request, args):
+        admitted = self.env.now
+        yield self.env.process(self.serve_fn(request, *args))
+        self.inflight -= 1
+        self.stats[client].add(timestamp, arrival, admitted, self.env.now)
+        self._kick()
+
+    def format_stats(self):
+        return '\n'.join("Client {}: {}".format(str(client).encode('hex'), s.format())
+                         for client, s in sorted(self.stats.items()))
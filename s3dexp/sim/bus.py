@@ -2,17 +2,48 @@ from logzero import logger
 import simpy
 
 class BusSim(object):
-    def __init__(self, env, target_mbyteps):
+    def __init__(self, env, target_mbyteps, name='bus'):
         super(BusSim, self).__init__()
         self.target_mbyteps = float(target_mbyteps)
         self.env = env
+        self.name = name
         self._semaphore = simpy.Resource(env)
 
-        logger.info("Initialized bus at {} MBytes/s".format(self.target_mbyteps))
+        # for reporting utilization
+        self.start_time = env.now
+        self.bytes_sent = 0
+        self.busy_time = 0.
 
-    def send(self, size_in_bytes):
-        # a simpy generator
-        sim_elapsed = size_in_bytes * 1e-6 / self.target_mbyteps
+        logger.info("Initialized {} at {} MBytes/s".format(self.name, self.target_mbyteps))
+
+    def send(self, size_in_bytes, upstream=None):
+        """A simpy generator. 
+        If `upstream` (another BusSim, e.g., a host link shared by many devices) is given, 
+        data flows cut-through: both links are held for the transfer, which goes at the slower link's speed.
+        """
+        mbyteps = self.target_mbyteps if upstream is None else min(self.target_mbyteps, upstream.target_mbyteps)
+        sim_elapsed = size_in_bytes * 1e-6 / mbyteps
         with self._semaphore.request() as req:
             yield req
-            yield self.env.timeout(sim_elapsed)
+            if upstream is None:
+                yield self.env.timeout(sim_elapsed)
+            else:
+                with upstream._semaphore.request() as up_req:
+                    yield up_req
+                    yield self.env.timeout(sim_elapsed)
+                upstream._account(size_in_bytes, sim_elapsed)
+        self._account(size_in_bytes, sim_elapsed)
+
+    def utilization(self):
+        elapsed = self.env.now - self.start_time
+        return self.busy_time / elapsed if elapsed > 0 else 0.
+
+    def format_stats(self):
+        elapsed = self.env.now - self.start_time
+        mbyteps = self.bytes_sent * 1e-6 / elapsed if elapsed > 0 else 0.
+        return "{}: {:.1f} MB sent, {:.1f} MB/s, {:.1f}% busy".format(
+            self.name, self.bytes_sent * 1e-6, mbyteps, 100. * self.utilization())
+
+    def _account(self, size_in_bytes, sim_elapsed):
+        self.bytes_sent += size_in_bytes
+        self.busy_time += sim_elapsed
@@ -1,26 +1,53 @@
 import cv2
 from google.protobuf.json_format import MessageToJson
+import itertools
 import json
 from logzero import logger
 import os
+import Queue
+import threading
 import time
 import zmq
 
-from s3dexp.sim.communication_pb2 import Request, Response
-from s3dexp.sim.storage import OP_DECODEONLY, OP_DEBUG_WAIT, OP_DECODE_FACE, OP_DECODE_VIDEO
+from s3dexp.sim.communication_pb2 import Request, RequestBatch, Response
+from s3dexp.sim.frame_cache import SharedFrameCache
+from s3dexp.sim.stats import SkewHistogram
+from s3dexp.sim.storage import OP_DECODEONLY, OP_DEBUG_WAIT, OP_DECODE_FACE, OP_DECODE_VIDEO, MSG_BATCH, PIPE_NAME, \
+    device_pipe_name, shard_of
 from s3dexp.utils import recursive_glob
 
+def _readahead_worker(q, cache):
+    # load PPMs queued by SmartStorageClient._read_ahead() into the cache
+    while True:
+        ppm_path = q.get()
+        if ppm_path not in cache and os.path.exists(ppm_path):
+            arr = cv2.imread(ppm_path, cv2.IMREAD_COLOR)
+            if arr is not None:
+                cache.put(ppm_path, arr)
+
+
 class SmartStorageClient(object):
     """A client talking to an emulated smart storage server. 
     The server is responsible for calculating simulated elapsed time, 
     whereas this client is responsible for generating the actual result faster than simulated speed,
     but blocking-wait for the server's response before returning to the caller.
+    With num_devices > 1, the server emulates several devices and each path is sent to the device given by shard_of().
     The client is not thread-safe.
+
+    Decoded results are loaded from PPM files under map_to_ppm_dir. Either all of them are preloaded into a dict (preload),
+    or, with cache_mbytes, they are kept in a SharedFrameCache of that size shared by all clients on the host.
+    With readahead, video frames following the requested ones at the same stride are loaded into the cache in the background.
     """
 
-    def __init__(self, map_from_dir, map_to_ppm_dir, preload=False):
-        self.transport = ZMQTransport()
-        self.transport.connect()
+    def __init__(self, map_from_dir, map_to_ppm_dir, preload=False, socket_type=zmq.REQ, num_devices=1, pipe_name=PIPE_NAME,
+                 cache_mbytes=None, cache_name='ppm', readahead=0):
+        self.num_devices = num_devices
+        self.transports = []
+        for i in range(num_devices):
+            transport = ZMQTransport(device_pipe_name(pipe_name, i, num_devices), socket_type=socket_type)
+            transport.connect()
+            self.transports.append(transport)
+        self.transport = self.transports[0]     # where the last request went
 
         assert map_to_ppm_dir is not None and os.path.isdir(map_to_ppm_dir), "Please specific a directory to load PPM"
         assert os.path.isdir(map_from_dir), "Src dir not valid."
@@ -37,8 +64,21 @@ class SmartStorageClient(object):
                 self.preload_lut[path] = cv2.imread(path, cv2.IMREAD_COLOR)
             logger.warn("Preloaded {} PPM images".format(len(self.preload_lut)))
 
+        self.cache = SharedFrameCache(cache_name, mbytes=cache_mbytes) if cache_mbytes else None
+        assert not readahead or self.cache, "readahead needs cache_mbytes"
+        self.readahead = readahead
+        self._readahead_q = None
+        self._last_frame = (None, None)     # (video path, frame id) of the last decode_video()
+        self._readahead_upto = None         # last frame id queued for read-ahead
+        if readahead:
+            self._readahead_q = Queue.Queue()
+            t = threading.Thread(target=_readahead_worker, args=(self._readahead_q, self.cache))
+            t.daemon = True
+            t.start()
+
         # for debugging
         self.late_by = 0.0
+        self.late_hist = SkewHistogram('Response arrival skew (real - simulated)')
 
     def read(self, path):
         return self._read_real(path)
@@ -95,16 +135,9 @@ class SmartStorageClient(object):
         self._send_reqeust(request)
 
         # 2. Load PPM
-        # hard code mapping scheme for videos: map_from_dir is not used
-        # <map_to_ppm_dir>/video_name_without_ext/%06d.ppm
-        vid_name = os.path.splitext(os.path.basename(path))[0]
-        ppm_path = os.path.join(self.map_to_ppm_dir, vid_name, '%06d.ppm' % (frame_id+1)) # ffmpeg start at 1
-        if self.preload:
-            arr = self.preload_lut[ppm_path]
-        else:
-            logger.debug("Try to load PPM from {}".format(ppm_path))
-            arr = cv2.imread(ppm_path, cv2.IMREAD_COLOR)
-
+        if self.readahead:
+            self._read_ahead(path, frame_id)
+        arr = self._load_ppm(self._video_ppm_path(path, frame_id))
         assert arr is not None, arr
 
         # 3. Wait for response
@@ -122,13 +155,17 @@ class SmartStorageClient(object):
         self._recv_response()
         return
 
+    def _transport_of(self, path):
+        return self.transports[shard_of(path, self.num_devices)]
+
     def _send_reqeust(self, pb):
         logger.debug("Sending {}".format(MessageToJson(pb)))
+        self.transport = self._transport_of(pb.path)
         self.transport.send(pb.SerializeToString())
 
-    def _recv_response(self):
+    def _recv_response(self, transport=None):
         response = Response()
-        body = self.transport.recv()
+        body = (transport or self.transport).recv()
         response.ParseFromString(body)
 
         logger.debug("Received {}".format(MessageToJson(response)))
@@ -140,6 +177,7 @@ class SmartStorageClient(object):
         elif late < -1e-5:
             logger.debug("Too early by {:.3f} ms".format(-late*1000))
         self.late_by = self.late_by * .5 + late * .5    # simple running average
+        self.late_hist.add(late)
         return response
 
     def _recv(self):
@@ -149,9 +187,42 @@ class SmartStorageClient(object):
     def _load_decoded(self, path):
         relpath = os.path.relpath(path, self.map_from_dir)
         ppm_path = os.path.splitext(os.path.join(self.map_to_ppm_dir, relpath))[0] + '.ppm'
+        return self._load_ppm(ppm_path)
+
+    def _video_ppm_path(self, path, frame_id):
+        # hard code mapping scheme for videos: map_from_dir is not used
+        # <map_to_ppm_dir>/video_name_without_ext/%06d.ppm
+        vid_name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.map_to_ppm_dir, vid_name, '%06d.ppm' % (frame_id+1)) # ffmpeg start at 1
+
+    def _load_ppm(self, ppm_path):
+        if self.preload:
+            return self.preload_lut[ppm_path]
+        if self.cache:
+            arr = self.cache.get(ppm_path)
+            if arr is not None:
+                return arr
+        logger.debug("Try to load PPM from {}".format(ppm_path))
         arr = cv2.imread(ppm_path, cv2.IMREAD_COLOR)
+        if self.cache and arr is not None:
+            self.cache.put(ppm_path, arr)
         return arr
 
+    def _read_ahead(self, path, frame_id):
+        """Queue the next `readahead` frames at the stride of the last two requests of the same video"""
+        last_path, last_frame_id = self._last_frame
+        self._last_frame = (path, frame_id)
+        if last_path != path:
+            self._readahead_upto = frame_id
+        stride = frame_id - last_frame_id if last_path == path else 0
+        if stride <= 0:
+            return
+        for k in range(1, self.readahead + 1):
+            f = frame_id + k * stride
+            if f > self._readahead_upto:
+                self._readahead_q.put(self._video_ppm_path(path, f))
+                self._readahead_upto = f
+
     def _read_real(self, path):
         """Read the file from disk for real so we can actual elapsed time"""
         size = os.path.getsize(path)
@@ -161,12 +232,91 @@ class SmartStorageClient(object):
         return content
 
     def __del__(self):
+        if getattr(self, 'cache', None):
+            logger.info(self.cache.format_stats())
         logger.warn("Avg late by {:.3f} ms".format(self.late_by*1000))
+        if len(self.late_hist):
+            logger.info(self.late_hist.format())
+
+
+class PipelinedSmartStorageClient(SmartStorageClient):
+    """A client that can keep many requests outstanding at the emulated device.
+    Requests carry an ID and are sent in RequestBatch messages over a DEALER socket;
+    responses come back in the order the simulated device completes them.
+    The blocking one-at-a-time methods of SmartStorageClient still work when nothing is outstanding.
+    """
+
+    def __init__(self, map_from_dir, map_to_ppm_dir, preload=False, num_devices=1, pipe_name=PIPE_NAME, **kwargs):
+        super(PipelinedSmartStorageClient, self).__init__(map_from_dir, map_to_ppm_dir, preload, socket_type=zmq.DEALER, 
+                                                          num_devices=num_devices, pipe_name=pipe_name, **kwargs)
+        self._next_request_id = itertools.count(1)
+        self._poller = zmq.Poller()
+        for transport in self.transports:
+            self._poller.register(transport.subscriber, zmq.POLLIN)
+
+    def submit_batch(self, paths, opcode=OP_DECODEONLY, value=None):
+        """Send a RequestBatch with a request per path to each device that stores some of the paths. 
+        Returns the list of request IDs, in the order of paths."""
+        batches = [RequestBatch() for _ in self.transports]
+        timestamp = time.time()
+        ids = []
+        for path in paths:
+            request = batches[shard_of(path, self.num_devices)].requests.add()
+            request.request_id = next(self._next_request_id)
+            request.timestamp = timestamp
+            request.path = path
+            request.opcode = opcode
+            if value is not None:
+                request.value = value
+            ids.append(request.request_id)
+        for transport, batch in zip(self.transports, batches):
+            if len(batch.requests):
+                logger.debug("Sending batch of {} requests to {}".format(len(batch.requests), transport.named_pipe))
+                transport.send(batch.SerializeToString(), batch=True)
+        return ids
+
+    def recv_completion(self):
+        """Block until the next request completes on any device. Returns the Response."""
+        if self.num_devices == 1:
+            return self._recv_response(self.transports[0])
+        subscriber, _ = self._poller.poll()[0]
+        transport = next(t for t in self.transports if t.subscriber is subscriber)
+        return self._recv_response(transport)
+
+    def decode_many(self, paths, queue_depth=32):
+        """Emulate decoding of many paths, keeping up to queue_depth requests outstanding.
+        
+        Arguments:
+            paths {iterable} -- paths to decode
+        
+        Keyword Arguments:
+            queue_depth {int} -- max outstanding requests at the device (default: {32})
+        
+        Yields:
+            (path, ndarray) -- in completion order
+        """
+        paths = iter(paths)
+        outstanding = {}    # request_id -> (path, arr)
+
+        def fill():
+            batch = list(itertools.islice(paths, queue_depth - len(outstanding)))
+            ids = self.submit_batch(batch, OP_DECODEONLY)
+            # prepare the results while the device is working
+            for request_id, path in zip(ids, batch):
+                outstanding[request_id] = (path, self._load_decoded(path))
+
+        fill()
+        while outstanding:
+            response = self.recv_completion()
+            yield outstanding.pop(response.request_id)
+            fill()
 
 
 class ZMQTransport(object):
-    def __init__(self, named_pipe="/tmp/s3dexp-comm"):
+    def __init__(self, named_pipe=PIPE_NAME, socket_type=zmq.REQ):
+        assert socket_type in (zmq.REQ, zmq.DEALER)
         self.named_pipe = named_pipe
+        self.socket_type = socket_type
         self.subscriber = None
         self.listening = False
 
@@ -174,7 +324,7 @@ class ZMQTransport(object):
         if self.listening:
             raise Exception("Client already listening")
         context = zmq.Context()
-        self.subscriber = context.socket(zmq.REQ)
+        self.subscriber = context.socket(self.socket_type)
         self.subscriber.connect("ipc://" + self.named_pipe)
         self.listening = True
 
@@ -184,10 +334,19 @@ class ZMQTransport(object):
         self.subscriber.close()
         self.listening = False
 
-    def send(self, body):
-        self.subscriber.send(body)
+    def send(self, body, batch=False):
+        if self.socket_type == zmq.REQ:
+            assert not batch, "Batches need a DEALER socket"
+            self.subscriber.send(body)
+        else:
+            # DEALER: add the empty delimiter frame that REQ would add
+            frames = [b'', MSG_BATCH, body] if batch else [b'', body]
+            self.subscriber.send_multipart(frames)
         return True
 
     def recv(self):
-        return self.subscriber.recv()
+        if self.socket_type == zmq.REQ:
+            return self.subscriber.recv()
+        else:
+            return self.subscriber.recv_multipart()[-1]
         
\ No newline at end of file
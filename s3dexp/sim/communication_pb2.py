@@ -20,7 +20,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   package='',
   syntax='proto3',
   serialized_options=None,
-  serialized_pb=_b('\n\x13\x63ommunication.proto\"W\n\x07Request\x12\x11\n\ttimestamp\x18\x01 \x01(\x01\x12\x0e\n\x06opcode\x18\x02 \x01(\x05\x12\x0c\n\x04path\x18\x03 \x01(\t\x12\x0c\n\x04wait\x18\x04 \x01(\x05\x12\r\n\x05value\x18\x05 \x01(\t\"R\n\x08Response\x12\x19\n\x11request_timestamp\x18\x01 \x01(\x01\x12\x1c\n\x14\x63ompletion_timestamp\x18\x02 \x01(\x01\x12\r\n\x05value\x18\x03 \x01(\tb\x06proto3')
+  serialized_pb=_b('\n\x13\x63ommunication.proto\"k\n\x07Request\x12\x11\n\ttimestamp\x18\x01 \x01(\x01\x12\x0e\n\x06opcode\x18\x02 \x01(\x05\x12\x0c\n\x04path\x18\x03 \x01(\t\x12\x0c\n\x04wait\x18\x04 \x01(\x05\x12\r\n\x05value\x18\x05 \x01(\t\x12\x12\n\nrequest_id\x18\x06 \x01(\x03\"f\n\x08Response\x12\x19\n\x11request_timestamp\x18\x01 \x01(\x01\x12\x1c\n\x14\x63ompletion_timestamp\x18\x02 \x01(\x01\x12\r\n\x05value\x18\x03 \x01(\t\x12\x12\n\nrequest_id\x18\x04 \x01(\x03\"*\n\x0cRequestBatch\x12\x1a\n\x08requests\x18\x01 \x03(\x0b\x32\x08.Requestb\x06proto3')
 )
 
 
@@ -68,6 +68,13 @@ _REQUEST = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='Request.request_id', index=5,
+      number=6, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -81,7 +88,7 @@ _REQUEST = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=23,
-  serialized_end=110,
+  serialized_end=130,
 )
 
 
@@ -113,6 +120,44 @@ _RESPONSE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='request_id', full_name='Response.request_id', index=3,
+      number=4, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=132,
+  serialized_end=234,
+)
+
+
+_REQUESTBATCH = _descriptor.Descriptor(
+  name='RequestBatch',
+  full_name='RequestBatch',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='requests', full_name='RequestBatch.requests', index=0,
+      number=1, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -125,12 +170,14 @@ _RESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=112,
-  serialized_end=194,
+  serialized_start=236,
+  serialized_end=278,
 )
 
+_REQUESTBATCH.fields_by_name['requests'].message_type = _REQUEST
 DESCRIPTOR.message_types_by_name['Request'] = _REQUEST
 DESCRIPTOR.message_types_by_name['Response'] = _RESPONSE
+DESCRIPTOR.message_types_by_name['RequestBatch'] = _REQUESTBATCH
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 Request = _reflection.GeneratedProtocolMessageType('Request', (_message.Message,), {
@@ -147,5 +194,12 @@ Response = _reflection.GeneratedProtocolMessageType('Response', (_message.Messag
   })
 _sym_db.RegisterMessage(Response)
 
+RequestBatch = _reflection.GeneratedProtocolMessageType('RequestBatch', (_message.Message,), {
+  'DESCRIPTOR' : _REQUESTBATCH,
+  '__module__' : 'communication_pb2'
+  # @@protoc_insertion_point(class_scope:RequestBatch)
+  })
+_sym_db.RegisterMessage(RequestBatch)
+
 
 # @@protoc_insertion_point(module_scope)
@@ -1,12 +1,15 @@
+import bisect
 import cv2
 from logzero import logger
+import numpy as np
 import os
 import simpy
 import time
 
 from s3dexp import this_hostname
-import s3dexp.db.utils as dbutils
 import s3dexp.db.models as models
+from s3dexp.db.profile_cache import load_profile_table
+from s3dexp.utils import get_video_keyframes
 
 
 class DecoderSim(object):
@@ -18,34 +21,28 @@ class DecoderSim(object):
 
         self._semaphore = simpy.Resource(env, capacity=capacity)
 
-        sess = dbutils.get_session()
-        profiles = sess.query(models.DecodeProfile) \
-            .filter(models.DecodeProfile.hostname=='cloudlet029') \
-            .filter(models.DecodeProfile.path.like('{}%'.format(base_dir))) \
-            .filter(models.DecodeProfile.basename.like('%.{}'.format(ext))) \
-            .all()
+        self.table = load_profile_table(
+            'DecodeProfile', {'hostname': 'cloudlet029', 'base_dir': base_dir, 'ext': ext},
+            models.DecodeProfile,
+            lambda sess: sess.query(models.DecodeProfile) \
+                .filter(models.DecodeProfile.hostname=='cloudlet029') \
+                .filter(models.DecodeProfile.path.like('{}%'.format(base_dir))) \
+                .filter(models.DecodeProfile.basename.like('%.{}'.format(ext))),
+            # assume basename is suffiently unique
+            fields=[('key', 'S'), ('decode_ms', 'f8'), ('width', 'i4'), ('height', 'i4')],
+            to_record=lambda p: (os.path.basename(p.path), p.decode_ms, p.width, p.height))
 
-        logger.info("Found {} decode profiles.".format(len(profiles)))
-        orig_mpixps = sum([p.height * p.width / 1e6 for p in profiles]) / sum(p.decode_ms * 1e-3 for p in profiles)
+        logger.info("Found {} decode profiles.".format(len(self.table)))
+        orig_mpixps = np.sum(self.table.height * self.table.width.astype(np.float64) / 1e6) / np.sum(self.table.decode_ms * 1e-3)
         self.time_scaling = float(orig_mpixps) / target_mpixps
         logger.info("Original {} MPix/s, target {} MPix/s,  scaling original time by {}x. Capacity {}".format(orig_mpixps, target_mpixps, self.time_scaling, capacity))
 
-        # assume basename is suffiently unique
-        # look-up table: basename -> target decode time (s), width, height
-        self.lut = {}
-        for p in profiles:
-            self.lut[os.path.basename(p.path)] = (p.decode_ms * 1e-3 * self.time_scaling, p.width, p.height)
-
-        assert len(self.lut) == len(profiles)
-
-        sess.close()
-        del profiles
-
 
     def decode(self, path):
         # a simpy generator
         assert path.endswith(self.ext)
-        sim_elapsed, width, height = self.lut[os.path.basename(path)]
+        p = self.table[os.path.basename(path)]
+        sim_elapsed, width, height = p['decode_ms'] * 1e-3 * self.time_scaling, int(p['width']), int(p['height'])
         with self._semaphore.request() as req:
             yield req   # acquire the lock
             yield self.env.timeout(sim_elapsed)
@@ -53,15 +50,31 @@ class DecoderSim(object):
 
 
 class VideoDecoderSim(object):
-    def __init__(self, env, target_fps, capacity=1):
+    def __init__(self, env, target_fps, capacity=1, cost_model='linear', grab_ratio=1.):
         """A "stateful" decoder that only works for one video at a time. Keep tracks of the "current" frame
-        and can skip frames forward."""
+        and can skip frames forward.
+
+        Arguments:
+            target_fps {float} -- frames decoded per second
+
+        Keyword Arguments:
+            cost_model {str} -- 'linear': skipping forward costs decoding every frame in between.
+                'gop': seek to the last key frame before the requested frame if it is ahead,
+                then decode from there (default: {'linear'})
+            grab_ratio {float} -- with 'gop', cost of a frame decoded only to reach the requested one (grabbed but not
+                color converted), relative to a returned frame (default: {1.})
+        """
         super(VideoDecoderSim, self).__init__()
+        assert cost_model in ('linear', 'gop'), cost_model
         self.env = env
         self.target_fps = target_fps
+        self.cost_model = cost_model
+        self.grab_ratio = grab_ratio
+        self.keyframes = None
         self._semaphore = simpy.Resource(env, capacity=capacity)
         self.current_path = None
-        self.current_frame_id = None
+        self.current_frame_id = None    # last frame requested
+        self._next_frame_id = None      # with 'gop', the frame the decoder would decode next without seeking
         self.video_frames = None
         self.h = self.w = None
         logger.info("Created VideoDecoderSim at {} FPS".format(self.target_fps))
@@ -72,20 +85,34 @@ class VideoDecoderSim(object):
             # open once to get h,w
             self.current_path = path
             self.current_frame_id = 0
+            self._next_frame_id = 0
             cap = cv2.VideoCapture(path)
             self.w = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
             self.h = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
             self.video_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
             logger.info("Initiating new video WxH {}x{} {}".format(self.w, self.h, path))
             cap.release()
+            if self.cost_model == 'gop':
+                self.keyframes = get_video_keyframes(path) or [0]
             
         assert frame_id >= self.current_frame_id
 
-        sim_elapsed = (1. / self.target_fps) * (frame_id - self.current_frame_id)
-        logger.debug("VideoDecoderSim: decoding {} frames, {:.2f} ms".format((frame_id - self.current_frame_id), sim_elapsed*1000))
+        if self.cost_model == 'gop':
+            keyframe = self.keyframes[bisect.bisect_right(self.keyframes, frame_id) - 1]
+            if keyframe <= self._next_frame_id <= frame_id:
+                start = self._next_frame_id
+            else:
+                # seek ahead, or back to decode the last frame again
+                start = keyframe
+            sim_elapsed = (1. / self.target_fps) * (1 + self.grab_ratio * (frame_id - start))
+        else:
+            start = self.current_frame_id
+            sim_elapsed = (1. / self.target_fps) * (frame_id - self.current_frame_id)
+        logger.debug("VideoDecoderSim: decoding {} frames, {:.2f} ms".format((frame_id - start), sim_elapsed*1000))
         with self._semaphore.request() as req:
             yield req
             yield self.env.timeout(sim_elapsed)
             self.current_frame_id = frame_id    # fast-forward
+            self._next_frame_id = frame_id + 1
         
         self.env.exit((self.w, self.h))
\ No newline at end of file
@@ -0,0 +1,83 @@
+from logzero import logger
+import numpy as np
+import os
+import simpy
+
+from s3dexp.scan_scheduler import get_extents
+from s3dexp.smart.emdisk import HDDModel, load_disk_read_profiles
+
+
+class DiskSim(object):
+    def __init__(self, env, base_dir, disk='hdd', ext='jpg', access='rand', capacity=1):
+        """Media read stage of a smart storage device, driven by measured DiskReadProfile's.
+        
+        Arguments:
+            env {simpy.Environment} -- simpy environment
+            base_dir {str} -- data set directory as profiled
+        
+        Keyword Arguments:
+            disk {str} -- `disk` column of the profiles to use (default: {'hdd'})
+            ext {str} -- file extension (default: {'jpg'})
+            access {str} -- 'rand' or 'seq': which measured read time to charge (default: {'rand'})
+            capacity {int} -- number of concurrent reads, e.g., 1 for a single HDD head (default: {1})
+        """
+        super(DiskSim, self).__init__()
+        assert access in ('rand', 'seq')
+        self.env = env
+        self.ext = ext
+        self.base_dir = base_dir
+        self.access = access
+
+        self._semaphore = simpy.Resource(env, capacity=capacity)
+
+        self.table = load_disk_read_profiles(base_dir, disk, ext)
+
+        logger.info("Found {} disk read profiles of {}.".format(len(self.table), disk))
+        read_ms = self.table.rand_read_ms if access == 'rand' else self.table.seq_read_ms
+        if len(self.table):
+            logger.info("Avg {} read {:.3f} ms, {:.1f} MB/s. Capacity {}".format(
+                access, np.mean(read_ms), np.sum(self.table.size) * 1e-3 / np.sum(read_ms), capacity))
+
+    def read(self, path):
+        # a simpy generator
+        assert path.endswith(self.ext)
+        p = self.table[os.path.basename(path)]
+        sim_elapsed = 1e-3 * (p['rand_read_ms'] if self.access == 'rand' else p['seq_read_ms'])
+        with self._semaphore.request() as req:
+            yield req   # acquire the lock
+            yield self.env.timeout(sim_elapsed)
+        self.env.exit(int(p['size']))
+
+
+class HDDSim(object):
+    def __init__(self, env, model, extent_map):
+        """Media read stage modeled as a mechanical HDD (seek, rotation, transfer) from the files' physical layout,
+        so that the read time depends on the order requests are served in.
+        
+        Arguments:
+            env {simpy.Environment} -- simpy environment
+            model {HDDModel} -- e.g., from s3dexp.smart.emdisk.build_hdd_model(). Owned by this disk
+            extent_map {dict} -- path -> list of (logical, physical, length). Files missing from it are looked up with FIEMAP.
+        """
+        super(HDDSim, self).__init__()
+        assert isinstance(model, HDDModel)
+        self.env = env
+        self.model = model
+        self.extent_map = extent_map
+        # one head
+        self._semaphore = simpy.Resource(env, capacity=1)
+
+    def extents(self, path):
+        extents = self.extent_map.get(path)
+        if extents is None:
+            extents = self.extent_map[path] = get_extents(path)
+        return extents
+
+    def read(self, path):
+        # a simpy generator
+        extents = self.extents(path)
+        with self._semaphore.request() as req:
+            yield req   # acquire the head
+            # where the head goes next is only known once it is free
+            yield self.env.timeout(self.model.access(self.env.now, extents))
+        self.env.exit(sum(e[2] for e in extents))
@@ -1,12 +1,13 @@
 import json
 from logzero import logger
+import numpy as np
 import os
 import simpy
 import time
 
 from s3dexp import this_hostname
-import s3dexp.db.utils as dbutils
 import s3dexp.db.models as models
+from s3dexp.db.profile_cache import load_profile_table
 
 
 class FaceDetectorSim(object):
@@ -18,36 +19,29 @@ class FaceDetectorSim(object):
 
         self._semaphore = simpy.Resource(env, capacity=capacity)
 
-        sess = dbutils.get_session()
+        self.table = load_profile_table(
+            'FaceExp', {'base_dir': base_dir, 'ext': ext},
+            models.FaceExp,
+            lambda sess: sess.query(models.FaceExp) \
+                .filter(models.FaceExp.path.like("{}%".format(base_dir))) \
+                .filter(models.FaceExp.basename.like("%.{}".format(ext))),
+            # assume basename is suffiently unique
+            fields=[('key', 'S'), ('detect_ms', 'f8'), ('width', 'i4'), ('height', 'i4'), ('box', 'S')],
+            to_record=lambda p: (os.path.basename(p.path), p.total_ms - p.decode_ms, p.width, p.height, p.box))
 
-        profiles = sess.query(models.FaceExp) \
-            .filter(models.FaceExp.path.like("{}%".format(base_dir))) \
-            .filter(models.FaceExp.basename.like("%.{}".format(ext))) \
-            .all()
+        logger.info("Found {} face detection profiles.".format(len(self.table)))
 
-        logger.info("Found {} face detection profiles.".format(len(profiles)))
-
-        orig_fps = len(profiles) / sum(map(lambda p: 1e-3*(p.total_ms - p.decode_ms), profiles))
+        orig_fps = len(self.table) / np.sum(1e-3 * self.table.detect_ms)
 
         self.time_scaling = float(orig_fps) / target_fps
         logger.info("Original {} FPS, target {} FPS,  scaling original time by {}x".format(orig_fps, target_fps, self.time_scaling))
 
-        # assume basename is suffiently unique
-        # look-up table: basename -> target face detection time (s), width, height, box
-        self.lut = {}
-        for p in profiles:
-            self.lut[os.path.basename(p.path)] = ((p.total_ms - p.decode_ms) * 1e-3 * self.time_scaling, p.width, p.height, json.loads(p.box))
-
-        assert len(self.lut) == len(profiles)
-
-        sess.close()
-        del profiles
-
 
     def detect_face(self, path):
         # a simpy generator
         assert path.endswith(self.ext)
-        sim_elapsed, width, height, boxes = self.lut[os.path.basename(path)]
+        p = self.table[os.path.basename(path)]
+        sim_elapsed, boxes = p['detect_ms'] * 1e-3 * self.time_scaling, json.loads(p['box'])
         with self._semaphore.request() as req:
             yield req   # acquire the lock
             yield self.env.timeout(sim_elapsed)
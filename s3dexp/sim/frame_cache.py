@@ -0,0 +1,322 @@
+import contextlib
+import errno
+import fcntl
+import hashlib
+import itertools
+from logzero import logger
+import numpy as np
+import os
+import struct
+import threading
+
+from s3dexp.config import SHM_DIR
+
+_MAGIC = 0x53334432     # 'S3D2', the layout below
+_HEADER = ('magic', 'num_chunks', 'chunk_bytes', 'max_entries', 'hand', 'num_free', 'num_free_entries', 'tombstones')
+_HEADER_BYTES = 64
+_PAGE = 4096
+
+_EMPTY, _VALID, _FILLING = 0, 1, 2
+
+# one lock per cache file and process: POSIX record locks don't exclude threads of the same process
+_thread_locks = dict()
+_thread_locks_lock = threading.Lock()
+
+
+def _key_hash(key):
+    return struct.unpack('<q', hashlib.md5(key).digest()[:8])[0]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _index_size(max_entries):
+    # a power of two, at most half full
+    size = 1
+    while size < 2 * max_entries:
+        size *= 2
+    return size
+
+
+def _layout(num_chunks, chunk_bytes, max_entries):
+    # (name, dtype, count) in file order, after the header
+    fields = [
+        ('hashes', np.int64, max_entries),
+        ('first', np.int64, max_entries),
+        ('nbytes', np.int64, max_entries),
+        ('shapes', np.int64, max_entries * 3),
+        ('owner', np.int64, max_entries),
+        ('free_entries', np.int64, max_entries),
+        # open addressing hash table of key hash -> entry + 1. 0: never used, -1: deleted
+        ('index', np.int64, _index_size(max_entries)),
+        ('chunk_next', np.int64, num_chunks),
+        ('free_stack', np.int64, num_chunks),
+        ('state', np.int8, max_entries),
+        ('ref', np.int8, max_entries),
+    ]
+    offsets = dict()
+    pos = _HEADER_BYTES
+    for name, dtype, count in fields:
+        offsets[name] = (pos, dtype, count)
+        pos += np.dtype(dtype).itemsize * count
+    pos = (pos + _PAGE - 1) // _PAGE * _PAGE
+    offsets['data'] = (pos, np.uint8, num_chunks * chunk_bytes)
+    return offsets, pos + num_chunks * chunk_bytes
+
+
+class SharedFrameCache(object):
+    """A byte-bounded cache of uint8 frames (e.g., decoded PPMs) in shared memory, shared by all processes and threads
+    that open it with the same `name`. Evicts by CLOCK (an approximation of LRU).
+
+    The memory is a file under S3DEXP_SHM_DIR (default: /dev/shm) split into fixed-size chunks.
+    A frame takes as many chunks as it needs. The first process to open the cache creates it with the given
+    size. Others attach to it as is, with a warning if they ask for another size. The file outlives the processes, so a later run starts warm. Use unlink() to drop it.
+    get() returns a copy, so a frame evicted by another process never changes under the caller.
+    Frames are found through a hash index in the file. Frames left half-written by a process that died are reclaimed.
+    """
+    def __init__(self, name='ppm', mbytes=None, chunk_kbytes=None):
+        """mbytes and chunk_kbytes size the cache if it is created (default: 1024 MB in 256 KB chunks)"""
+        super(SharedFrameCache, self).__init__()
+        self.path = os.path.join(SHM_DIR, 's3dexp-{}.cache'.format(name))
+        with _thread_locks_lock:
+            self._thread_lock = _thread_locks.setdefault(self.path, threading.Lock())
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        sized = mbytes is not None or chunk_kbytes is not None
+        mbytes, chunk_kbytes = mbytes or 1024, chunk_kbytes or 256
+        chunk_bytes = chunk_kbytes * 1024
+        num_chunks = max(1, int(mbytes * 1e6) // chunk_bytes)
+        with self._lock():
+            if os.fstat(self._fd).st_size == 0:
+                self._map(num_chunks, chunk_bytes, num_chunks, create=True)
+                logger.info("Created frame cache {} of {} x {} KB chunks".format(self.path, num_chunks, chunk_kbytes))
+            else:
+                magic, num_chunks_, chunk_bytes_, max_entries = np.fromfile(self.path, dtype=np.int64, count=4)
+                assert magic == _MAGIC, "Not a frame cache of this version: {}. Unlink it.".format(self.path)
+                self._map(int(num_chunks_), int(chunk_bytes_), int(max_entries))
+                logger.info("Attached to frame cache {} of {:.1f} MB".format(self.path, self.capacity_bytes * 1e-6))
+                if sized and (num_chunks_, chunk_bytes_) != (num_chunks, chunk_bytes):
+                    logger.warn("Frame cache {} has {} x {} KB chunks, not the {} x {} KB asked for. Unlink it to resize.".format(
+                        self.path, num_chunks_, chunk_bytes_ // 1024, num_chunks, chunk_kbytes))
+
+        # this process only
+        self.hits = self.misses = 0
+
+    def _map(self, num_chunks, chunk_bytes, max_entries, create=False):
+        offsets, size = _layout(num_chunks, chunk_bytes, max_entries)
+        if create:
+            os.ftruncate(self._fd, size)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(size, ))
+        self._header = self._mm[:_HEADER_BYTES].view(np.int64, np.ndarray)
+        for name, (pos, dtype, count) in offsets.items():
+            # plain ndarray views: indexing a memmap is slower
+            setattr(self, '_' + name, self._mm[pos:pos + np.dtype(dtype).itemsize * count].view(dtype, np.ndarray))
+        self._shapes = self._shapes.reshape((max_entries, 3))
+        self.num_chunks, self.chunk_bytes, self.max_entries = num_chunks, chunk_bytes, max_entries
+        self.capacity_bytes = num_chunks * chunk_bytes
+        self._index_mask = len(self._index) - 1
+        if create:
+            self._header[:] = 0
+            self._state[:] = _EMPTY
+            self._index[:] = 0
+            self._free_stack[:] = np.arange(num_chunks)
+            self._set('num_free', num_chunks)
+            # popped from the end: entry 0 first
+            self._free_entries[:] = np.arange(max_entries)[::-1]
+            self._set('num_free_entries', max_entries)
+            self._set('num_chunks', num_chunks)
+            self._set('chunk_bytes', chunk_bytes)
+            self._set('max_entries', max_entries)
+            self._set('magic', _MAGIC)     # last: marks the cache initialized
+
+    def _get(self, field):
+        return int(self._header[_HEADER.index(field)])
+
+    def _set(self, field, value):
+        self._header[_HEADER.index(field)] = value
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _probe(self, h):
+        # linear probing from the key's home slot
+        i = h & self._index_mask
+        for _ in itertools.repeat(None, len(self._index)):
+            yield i
+            i = (i + 1) & self._index_mask
+
+    def _find(self, h):
+        for i in self._probe(h):
+            v = int(self._index[i])
+            if v == 0:
+                return None
+            if v > 0 and self._hashes[v - 1] == h:
+                return v - 1
+        return None
+
+    def _index_add(self, e, h):
+        for i in self._probe(h):
+            v = self._index[i]
+            if v <= 0:
+                if v < 0:
+                    self._set('tombstones', self._get('tombstones') - 1)
+                self._index[i] = e + 1
+                return
+
+    def _index_remove(self, e):
+        for i in self._probe(int(self._hashes[e])):
+            v = self._index[i]
+            if v == 0:
+                return
+            if v == e + 1:
+                self._index[i] = -1
+                self._set('tombstones', self._get('tombstones') + 1)
+                break
+        # deleted slots lengthen probes. Rebuild once they take a quarter of the index
+        if self._get('tombstones') > len(self._index) // 4:
+            self._index[:] = 0
+            self._set('tombstones', 0)
+            for e in np.flatnonzero(self._state != _EMPTY):
+                self._index_add(int(e), int(self._hashes[e]))
+
+    def _chunks(self, e):
+        c = int(self._first[e])
+        while c >= 0:
+            yield c
+            c = int(self._chunk_next[c])
+
+    def _evict(self, e):
+        num_free = self._get('num_free')
+        for c in self._chunks(e):
+            self._free_stack[num_free] = c
+            num_free += 1
+        self._set('num_free', num_free)
+        self._index_remove(e)
+        self._state[e] = _EMPTY
+        num_free_entries = self._get('num_free_entries')
+        self._free_entries[num_free_entries] = e
+        self._set('num_free_entries', num_free_entries + 1)
+
+    def _abandoned(self, e):
+        # being filled by a process that has died
+        return self._state[e] == _FILLING and not _pid_alive(int(self._owner[e]))
+
+    def _make_room(self, num_chunks):
+        """Evict by CLOCK until `num_chunks` chunks and an entry are free. Returns the free entry or None."""
+        hand = self._get('hand')
+        # two rounds clear all reference bits, so a third means only frames being filled remain
+        for _ in range(3 * self.max_entries):
+            if self._get('num_free_entries') > 0 and self._get('num_free') >= num_chunks:
+                break
+            e = hand
+            hand = (hand + 1) % self.max_entries
+            if self._abandoned(e):
+                logger.warn("Reclaiming frame of dead process {} in {}".format(int(self._owner[e]), self.path))
+                self._evict(e)
+            elif self._state[e] != _VALID:
+                continue
+            elif self._ref[e]:
+                self._ref[e] = 0
+            else:
+                self._evict(e)
+        self._set('hand', hand)
+        num_free_entries = self._get('num_free_entries')
+        if num_free_entries == 0 or self._get('num_free') < num_chunks:
+            return None
+        self._set('num_free_entries', num_free_entries - 1)
+        return int(self._free_entries[num_free_entries - 1])
+
+    def __contains__(self, key):
+        with self._lock():
+            e = self._find(_key_hash(key))
+            return e is not None and self._state[e] == _VALID
+
+    def get(self, key):
+        """Return a copy of the cached frame, or None"""
+        h = _key_hash(key)
+        with self._lock():
+            e = self._find(h)
+            if e is None or self._state[e] != _VALID:
+                self.misses += 1
+                return None
+            self._ref[e] = 1
+            nbytes = int(self._nbytes[e])
+            arr = np.empty(nbytes, dtype=np.uint8)
+            pos = 0
+            for c in self._chunks(e):
+                n = min(self.chunk_bytes, nbytes - pos)
+                start = c * self.chunk_bytes
+                arr[pos:pos + n] = self._data[start:start + n]
+                pos += n
+            shape = tuple(int(d) for d in self._shapes[e] if d > 0)
+        self.hits += 1
+        return arr.reshape(shape)
+
+    def put(self, key, arr):
+        """Cache a uint8 frame of up to 3 dimensions. Returns False if it is already cached or can't fit."""
+        assert arr.dtype == np.uint8 and 1 <= arr.ndim <= 3, "{} {}".format(arr.dtype, arr.shape)
+        h = _key_hash(key)
+        shape = arr.shape
+        arr = np.ascontiguousarray(arr).reshape(-1)
+        num_chunks = -(-arr.size // self.chunk_bytes)
+        if num_chunks > self.num_chunks:
+            return False
+
+        # reserve chunks, then copy without holding the lock
+        with self._lock():
+            e = self._find(h)
+            if e is not None:
+                if not self._abandoned(e):
+                    return False
+                self._evict(e)
+            e = self._make_room(num_chunks)
+            if e is None:
+                return False
+            num_free = self._get('num_free')
+            chunks = self._free_stack[num_free - num_chunks:num_free][::-1].copy()
+            self._set('num_free', num_free - num_chunks)
+            self._chunk_next[chunks[:-1]] = chunks[1:]
+            self._chunk_next[chunks[-1]] = -1
+            self._hashes[e] = h
+            self._first[e] = chunks[0]
+            self._nbytes[e] = arr.size
+            self._shapes[e] = 0
+            self._shapes[e, :len(shape)] = shape
+            self._owner[e] = os.getpid()
+            self._state[e] = _FILLING
+            self._index_add(e, h)
+
+        for i, c in enumerate(chunks):
+            piece = arr[i * self.chunk_bytes:(i + 1) * self.chunk_bytes]
+            start = c * self.chunk_bytes
+            self._data[start:start + piece.size] = piece
+
+        with self._lock():
+            self._state[e] = _VALID
+            self._ref[e] = 1
+        return True
+
+    def used_bytes(self):
+        return (self.num_chunks - self._get('num_free')) * self.chunk_bytes
+
+    def format_stats(self):
+        total = self.hits + self.misses
+        return "Frame cache {}: {:.1f}/{:.1f} MB used, hits {} / {} ({:.1f}%)".format(
+            self.path, self.used_bytes() * 1e-6, self.capacity_bytes * 1e-6, self.hits, total, 100. * self.hits / max(total, 1))
+
+    @staticmethod
+    def unlink(name='ppm'):
+        path = os.path.join(SHM_DIR, 's3dexp-{}.cache'.format(name))
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class SkewHistogram(object):
+    """Histogram of real - simulated time (seconds). Positive = real is late, negative = early."""
+
+    # bucket edges in ms
+    EDGES_MS = (-10., -1., -0.5, -0.1, -0.01, 0., 0.01, 0.1, 0.5, 1., 10.)
+
+    def __init__(self, name='skew'):
+        super(SkewHistogram, self).__init__()
+        self.name = name
+        self._edges = np.array(self.EDGES_MS) * 1e-3
+        self.counts = np.zeros(len(self._edges) + 1, dtype=np.int64)
+        self.total = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, skew):
+        self.counts[np.searchsorted(self._edges, skew, side='right')] += 1
+        self.total += skew
+        self.min = min(self.min, skew)
+        self.max = max(self.max, skew)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def mean(self):
+        return self.total / len(self) if len(self) else 0.
+
+    def format(self):
+        """Multi-line text rendering for logs."""
+        n = len(self)
+        lines = ["{}: n={}, mean {:.3f} ms, min {:.3f} ms, max {:.3f} ms".format(
+            self.name, n, 1e3 * self.mean(), 1e3 * self.min, 1e3 * self.max)]
+        lo = ['-inf'] + ['{:g}'.format(e) for e in self.EDGES_MS]
+        hi = ['{:g}'.format(e) for e in self.EDGES_MS] + ['inf']
+        for l, h, c in zip(lo, hi, self.counts):
+            if c:
+                lines.append("  [{:>6}, {:>6}) ms {:>8} {:5.1f}% {}".format(
+                    l, h, c, 100. * c / n, '#' * int(round(40. * c / n))))
+        return '\n'.join(lines)
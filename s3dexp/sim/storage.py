@@ -4,14 +4,21 @@ import json
 import logging
 import logzero
 from logzero import logger
+import copy
+import math
 import simpy
 import time
+import zlib
 import zmq
 
-from s3dexp.sim.communication_pb2 import Request, Response
+from s3dexp.sim.communication_pb2 import Request, RequestBatch, Response
+from s3dexp.sim.admission import AdmissionController
 from s3dexp.sim.bus import BusSim
 from s3dexp.sim.decoder import DecoderSim, VideoDecoderSim
+from s3dexp.sim.disk import DiskSim, HDDSim
+from s3dexp.smart.emdisk import build_hdd_model
 from s3dexp.sim.face_detector import FaceDetectorSim
+from s3dexp.sim.stats import SkewHistogram
 
 OP_READONLY = 10
 OP_DECODEONLY = 20
@@ -20,29 +27,74 @@ OP_DECODE_FACE = 40
 OP_DECODE_VIDEO = 50
 OP_DEBUG_WAIT = 500
 
+# Base name of the IPC pipe(s). With N > 1 devices, device i listens at <PIPE_NAME>-<i>
+PIPE_NAME = "/tmp/s3dexp-comm"
+
+# Marker frame for a RequestBatch message (sent by DEALER clients): [address, '', MSG_BATCH, body]
+MSG_BATCH = b'batch'
+
 # Simulator should run slightly ahead of real time.
 # This number should be just large enough to account for computation in simulator,
 # serialization overhead, and communication delay to the client,
-# while not too large to avoid inaccurate simulation of requests issued earlier
+# while not too large to avoid inaccurate simulation of requests issued earlier.
+# The server sleeps until run_ahead before the next simulated event or a new request.
+# Use the skew histograms it logs to calibrate this.
 RUN_AHEAD = 0.58e-3  
 
 logzero.loglevel(logging.INFO)
 
+
+def device_pipe_name(pipe_name, device_id, num_devices):
+    """IPC pipe of device `device_id`. A single device keeps the plain `pipe_name`."""
+    if num_devices == 1:
+        return pipe_name
+    return "{}-{}".format(pipe_name, device_id)
+
+
+def shard_of(path, num_devices):
+    """The client-side shard map: which device stores `path`. 
+    Uses a stable hash so every client (and every run) agrees on the placement."""
+    if num_devices == 1:
+        return 0
+    return (zlib.crc32(path) & 0xffffffff) % num_devices
+
+
 # SimPy reference: https://simpy.readthedocs.io/en/latest/contents.html
 class SmartStorageSim(object):
-    def __init__(self, env, decoder, bus, face_detector, video_decoder):
+    """A smart storage device as a pipeline of stages: media read (disk) -> decode -> accelerator (face detector) -> bus DMA.
+    Stages of different requests overlap. Each stage writes into a bounded buffer,
+    so a stage stalls when the next one falls behind:
+        - read buffers hold compressed data from the media until it is decoded
+        - frame buffers hold decoded frames until they are processed and DMA'ed to the host
+    None for unbounded buffers.
+    """
+    def __init__(self, env, decoder, bus, face_detector, video_decoder, policy='fifo', max_inflight=None, host_link=None, name='device',
+                 disk=None, read_buffers=None, frame_buffers=None):
         super(SmartStorageSim, self).__init__()
         assert isinstance(decoder, DecoderSim)
         assert isinstance(bus, BusSim)
+        assert disk is None or isinstance(disk, (DiskSim, HDDSim))
 
         # simpy environment
         self.env = env
 
         #  components
+        self.disk = disk
         self.decoder = decoder
         self.bus = bus
         self.face_detector = face_detector
         self.video_decoder = video_decoder
+        # optional link to the host shared with other devices. Results cross self.bus and then host_link.
+        self.host_link = host_link
+        self.name = name
+
+        # buffers between stages
+        self.read_buffers = simpy.Resource(env, capacity=read_buffers or float('inf'))
+        self.frame_buffers = simpy.Resource(env, capacity=frame_buffers or float('inf'))
+        logger.info("{}: {} read buffers, {} frame buffers".format(name, read_buffers or 'unbounded', frame_buffers or 'unbounded'))
+
+        # orders and admits requests from multiple clients
+        self.admission = AdmissionController(env, self.serve_request, policy=policy, max_inflight=max_inflight)
 
     def serve_request(self, request, address, callback):
         """A generator that can be passed into env.process(). 
@@ -60,24 +112,41 @@ class SmartStorageSim(object):
             payload = json.loads(request.value)
         retval = {'op': op}
 
-        if op == OP_DECODEONLY:
-            # logger.debug("Starting to decode {} at {}".format(request.path, self.env.now))
-            w,h = yield self.env.process(self.decoder.decode(request.path))
-            # logger.debug("Finished decode {} at {}".format(request.path, self.env.now))
-            yield self.env.process(self.bus.send(w*h*3))
+        if op in (OP_DECODEONLY, OP_DECODE_FACE):
+            # 1. media read into a free read buffer
+            with self.read_buffers.request() as in_buf:
+                yield in_buf
+                if self.disk is not None:
+                    yield self.env.process(self.disk.read(request.path))
 
-        elif op == OP_DECODE_FACE:
-            w,h = yield self.env.process(self.decoder.decode(request.path))
-            boxes = yield self.env.process(self.face_detector.detect_face(request.path))
-            # assume we only transmitted the cropped patches
-            transmitted_size = sum(map(lambda b: abs(3*(b[0]-b[2])*(b[1]-b[3])), boxes))
-            yield self.env.process(self.bus.send(transmitted_size))
-            retval['face_boxes'] = boxes
+                # 2. decode into a free frame buffer. The read buffer is freed once decoding is done.
+                out_buf = self.frame_buffers.request()
+                yield out_buf
+                # logger.debug("Starting to decode {} at {}".format(request.path, self.env.now))
+                w,h = yield self.env.process(self.decoder.decode(request.path))
+                # logger.debug("Finished decode {} at {}".format(request.path, self.env.now))
+
+            try:
+                if op == OP_DECODEONLY:
+                    transmitted_size = w*h*3
+                else:
+                    # 3. accelerator
+                    boxes = yield self.env.process(self.face_detector.detect_face(request.path))
+                    # assume we only transmitted the cropped patches
+                    transmitted_size = sum(map(lambda b: abs(3*(b[0]-b[2])*(b[1]-b[3])), boxes))
+                    retval['face_boxes'] = boxes
+
+                # 4. DMA to the host. The frame buffer is freed once sent.
+                yield self.env.process(self.bus.send(transmitted_size, self.host_link))
+            finally:
+                self.frame_buffers.release(out_buf)
 
         elif op == OP_DECODE_VIDEO: # only use for one stream
             frame_id = payload['frame_id']
-            w,h = yield self.env.process(self.video_decoder.decode_frame(request.path, frame_id)) 
-            yield self.env.process(self.bus.send(w*h*3))
+            with self.frame_buffers.request() as out_buf:
+                yield out_buf
+                w,h = yield self.env.process(self.video_decoder.decode_frame(request.path, frame_id)) 
+                yield self.env.process(self.bus.send(w*h*3, self.host_link))
 
         elif op == OP_DEBUG_WAIT:
             yield self.env.timeout(request.wait)
@@ -88,17 +157,36 @@ class SmartStorageSim(object):
         self.env.exit(self.env.now)
 
     
-    def sched_request(self, timestamp, *args, **kwargs):
-        # this is a hack, as we are not supposed to set back the simulator's internal time
-        # but it should be ok to do
-        self.env._now = timestamp
-        self.env.process(self.serve_request(*args, **kwargs))
+    def sched_request(self, timestamp, request, address, callback):
+        """Hand a request issued at `timestamp` by client `address` to the admission controller.
+        The request may carry {"priority": int} in its value (lower is served first by the 'priority' policy)."""
+        priority = json.loads(request.value).get('priority', 0) if request.value else 0
+        self.admission.submit(address, timestamp, request, args=(address, callback), priority=priority)
 
 
 def run_server(
     base_dir = '/mnt/hdd/fast20/jpeg/flickr50k', ext='jpg', 
     decoder_mpixps=140., num_decoder=5, bus_mbyteps=2000, face_fps=30., video_fps=480., 
-    run_ahead=RUN_AHEAD, verbose=False):
+    video_cost='linear', video_grab_ratio=1.,
+    policy='fifo', max_inflight=None,
+    disk=None, disk_access='rand', read_buffers=None, frame_buffers=None,
+    num_devices=1, host_link_mbyteps=None, pipe_name=PIPE_NAME,
+    run_ahead=RUN_AHEAD, report_interval=10., verbose=False):
+    """Emulate `num_devices` smart storage devices in one simulated environment.
+    Each device has its own decoder, bus and face detector, and listens at its own pipe (see device_pipe_name()). 
+    Clients pick the device of a path with shard_of().
+    
+    Keyword Arguments:
+        video_cost {str} -- cost of skipping video frames, 'linear' or 'gop' (see VideoDecoderSim) (default: {'linear'})
+        video_grab_ratio {float} -- with video_cost='gop', relative cost of a frame decoded but not returned (default: {1.})
+        disk {str} -- model the media read stage with DiskReadProfile's of this disk, e.g., 'hdd'. None to skip it (default: {None})
+        disk_access {str} -- 'rand' or 'seq' read times, or 'model' for a mechanical HDD model calibrated against them (default: {'rand'})
+        read_buffers {int} -- per-device buffers between media read and decode. None for unbounded (default: {None})
+        frame_buffers {int} -- per-device buffers between decode and bus DMA. None for unbounded (default: {None})
+        num_devices {int} -- number of devices behind the host (default: {1})
+        host_link_mbyteps {float} -- bandwidth of the host link shared by all devices. None for no shared link (default: {None})
+        pipe_name {str} -- base name of the IPC pipe(s) (default: {PIPE_NAME})
+    """
 
     if verbose:
         logzero.loglevel(logging.DEBUG)
@@ -106,47 +194,123 @@ def run_server(
     logger.info("Run ahead = {:.2f} ms".format(1000*run_ahead))
 
     env = simpy.Environment(initial_time=time.time())
-    decoder = DecoderSim(env, target_mpixps=decoder_mpixps, base_dir=base_dir, capacity=num_decoder)  
-    bus = BusSim(env, target_mbyteps=bus_mbyteps)
-    face_detector = FaceDetectorSim(env, target_fps=face_fps, base_dir=base_dir)
-    video_decoder = VideoDecoderSim(env, target_fps=video_fps)
-    ss = SmartStorageSim(env, decoder, bus, face_detector, video_decoder)
-
-    def on_complete(t, address, request, value):
-        response = Response()
-        response.request_timestamp = request.timestamp
-        response.completion_timestamp = t
-        response.value = json.dumps(value)
-
-        publisher.send_multipart([
-            address,
-            b'',
-            response.SerializeToString(),
-        ])
-        logger.debug("Sent response %s to address %s" % (MessageToJson(response), address))
-
-    pipe_name = "/tmp/s3dexp-comm"
-    context = zmq.Context()
-    publisher = context.socket(zmq.ROUTER)
-    publisher.bind("ipc://" + pipe_name)
-    logger.info("Server listening at: %s" % pipe_name)
+    host_link = BusSim(env, target_mbyteps=host_link_mbyteps, name='host link') if host_link_mbyteps else None
+
+    if disk and disk_access == 'model':
+        hdd_model, extent_map = build_hdd_model(base_dir, disk, ext)
+
+    devices = []
+    for i in range(num_devices):
+        if not disk:
+            disk_sim = None
+        elif disk_access == 'model':
+            # every device has its own head
+            disk_sim = HDDSim(env, copy.copy(hdd_model), extent_map)
+        else:
+            disk_sim = DiskSim(env, base_dir=base_dir, disk=disk, ext=ext, access=disk_access)
+        decoder = DecoderSim(env, target_mpixps=decoder_mpixps, base_dir=base_dir, capacity=num_decoder)  
+        bus = BusSim(env, target_mbyteps=bus_mbyteps, name='device {} bus'.format(i))
+        face_detector = FaceDetectorSim(env, target_fps=face_fps, base_dir=base_dir)
+        video_decoder = VideoDecoderSim(env, target_fps=video_fps, cost_model=video_cost, grab_ratio=video_grab_ratio)
+        devices.append(SmartStorageSim(env, decoder, bus, face_detector, video_decoder, 
+                                       policy=policy, max_inflight=max_inflight, 
+                                       host_link=host_link, name='device {}'.format(i),
+                                       disk=disk_sim, read_buffers=read_buffers, frame_buffers=frame_buffers))
+
+    # real time a response is sent - its simulated completion time
+    send_skew = SkewHistogram('Response send skew (real - simulated)')
+
+    def make_on_complete(publisher):
+        def on_complete(t, address, request, value):
+            response = Response()
+            response.request_id = request.request_id
+            response.request_timestamp = request.timestamp
+            response.completion_timestamp = t
+            response.value = json.dumps(value)
 
+            publisher.send_multipart([
+                address,
+                b'',
+                response.SerializeToString(),
+            ])
+            send_skew.add(time.time() - t)
+            if verbose:
+                logger.debug("Sent response %s to address %s" % (MessageToJson(response), address))
+        return on_complete
+
+    context = zmq.Context()
     poller = zmq.Poller()
-    poller.register(publisher, zmq.POLLIN)
+    publishers = []
+    for i in range(num_devices):
+        publisher = context.socket(zmq.ROUTER)
+        device_pipe = device_pipe_name(pipe_name, i, num_devices)
+        publisher.bind("ipc://" + device_pipe)
+        logger.info("Server listening at: %s" % device_pipe)
+        poller.register(publisher, zmq.POLLIN)
+        publishers.append(publisher)
+    callbacks = [make_on_complete(publisher) for publisher in publishers]
 
     logger.info("======READY")
 
-    while True:
-        #  Wait for next request from client
-        events = dict(poller.poll(0))
-        if publisher in events:
-            address, empty, data = publisher.recv_multipart()
-            request = Request()
-            request.ParseFromString(data)
-            logger.debug("Recv request from %s: %s" % (address, MessageToJson(request)))
-            # assert request.timestamp < time.time(), "Request from future: {} >= {}".format(request.timestamp, time.time())
-            ss.sched_request(request.timestamp, request, address, on_complete)
-        env.run(until=(time.time() + run_ahead))
+    def recv_requests(ready):
+        # drain all pending messages, then admit them in order of arrival
+        arrivals = []
+        for i, publisher in enumerate(publishers):
+            if publisher not in ready:
+                continue
+            while True:
+                try:
+                    frames = publisher.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                address, data = frames[0], frames[-1]
+                if len(frames) == 4 and frames[2] == MSG_BATCH:
+                    batch = RequestBatch()
+                    batch.ParseFromString(data)
+                    requests = batch.requests
+                else:
+                    request = Request()
+                    request.ParseFromString(data)
+                    requests = [request]
+                for request in requests:
+                    if verbose:
+                        logger.debug("Recv request for device %d from %s: %s" % (i, address, MessageToJson(request)))
+                    # assert request.timestamp < time.time(), "Request from future: {} >= {}".format(request.timestamp, time.time())
+                    arrivals.append((request.timestamp, i, address, request))
+        arrivals.sort(key=lambda a: a[0])
+        for timestamp, i, address, request in arrivals:
+            devices[i].sched_request(timestamp, request, address, callbacks[i])
+
+    def report():
+        logger.info(send_skew.format())
+        for ss in devices:
+            logger.info("{}: {}".format(ss.name, ss.admission.format_stats()))
+            logger.info(ss.bus.format_stats())
+        if host_link is not None:
+            logger.info(host_link.format_stats())
+
+    last_report = time.time()
+    try:
+        while True:
+            # Sleep until a request arrives or it's time to fire the next simulated event
+            next_event = env.peek()
+            if next_event == float('inf'):
+                timeout_ms = None if report_interval is None else 1000 * report_interval
+            else:
+                timeout_ms = max(0, int(math.floor(1000 * (next_event - run_ahead - time.time()))))
+            events = dict(poller.poll(timeout_ms))
+            if events:
+                recv_requests(events)
+
+            until = time.time() + run_ahead
+            if until > env.now:
+                env.run(until=until)
+
+            if report_interval is not None and time.time() - last_report > report_interval and len(send_skew):
+                report()
+                last_report = time.time()
+    finally:
+        report()
 
 if __name__ == '__main__':
-    fire.Fire(run_server)
\ No newline at end of file
+    fire.Fire(run_server)
@@ -1,32 +1,166 @@
+import cv2
 from logzero import logger
+import multiprocessing as mp
+import os
+import threading
 import time
 
+from s3dexp.search import Filter, FilterConfig
+from s3dexp.utils import thread_cputime
+
+# thread pools of the libraries filters use, see ProcessDilator.limit_threads()
+_THREADS_ENV = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+class _ThreadTic(threading.local):
+    # __init__ runs in every thread on first access. A thread's CPU clock starts at 0,
+    # so in a thread that never called reset(), dilate() counts from the thread's start.
+    def __init__(self):
+        super(_ThreadTic, self).__init__()
+        self.tic = 0.
+
+
 class ProcessDilator(object):
     """Simulate the in-process computation time between reset() and dilate()
-    if it were run on a slower processor.
+    if it were run on a slower processor with `target_n_cores` cores.
+
+    CPU time is measured per thread. Work that a library hands off to its own thread pool
+    (OpenCV, MKL, ...) is not counted, so limit_threads() limits those pools to one thread.
+    DilatedFilter calls it.
+
+    The target cores are modeled by schedule(): each task runs on the core that frees up first.
+    Their state is in shared memory, so processes forked after creating the dilator share the same target cores.
     """
     
     def __init__(self, target_ghz, target_n_cores=1, platform_ghz=3.0):
         super(ProcessDilator, self).__init__()
         assert 0 < target_ghz < platform_ghz
-        assert isinstance(target_n_cores, int)
+        assert isinstance(target_n_cores, int) and target_n_cores > 0
+        self.target_ghz = target_ghz
+        self.platform_ghz = platform_ghz
         self._scaling = platform_ghz / float(target_ghz)
-        logger.info("Dilator scale factor: {}".format(self._scaling))
-        self._tic = time.clock()
+        logger.info("Dilator scale factor: {}, {} target cores".format(self._scaling, target_n_cores))
         self.target_n_cores = target_n_cores
+        self._local = _ThreadTic()
+        # time each target core becomes free
+        self._core_free = mp.RawArray('d', target_n_cores)
+        self._core_lock = mp.Lock()
+
+    def __repr__(self):
+        # stable, as it ends up in filter names
+        return "ProcessDilator({}, {}, {})".format(self.target_ghz, self.target_n_cores, self.platform_ghz)
+
+    @staticmethod
+    def limit_threads():
+        """Run OpenCV and OpenMP/MKL/OpenBLAS single-threaded in this process, so their work is on the calling thread's CPU clock.
+        The environment variables only take effect on libraries loaded after this. Warns about the ones set otherwise."""
+        cv2.setNumThreads(1)
+        for var in _THREADS_ENV:
+            if os.environ.setdefault(var, '1') != '1':
+                logger.warn("{}={}: work on those threads is not dilated".format(var, os.environ[var]))
 
     def reset(self):
-        self._tic = time.clock()
+        self._local.tic = thread_cputime()
 
     def dilate(self):
         """Return the simulated elapsed CPU
         
         Returns:
             float -- Simulated elapsed CPU time if computation between
-            reset() and dilate() were run on the simulated CPU.
+            reset() and dilate() in this thread were run on one core of the simulated CPU.
+        """
+        elapsed_cputime = thread_cputime() - self._local.tic
+        return elapsed_cputime * self._scaling
+
+    def schedule(self, arrival_time, sim_elapsed):
+        """Run a task of `sim_elapsed` (as returned by dilate()) arriving at `arrival_time` 
+        on the first target core available. 
+        
+        Returns:
+            float -- simulated completion time
         """
-        elapsed_cputime = time.clock() - self._tic
-        return elapsed_cputime * self._scaling / self.target_n_cores
+        with self._core_lock:
+            core = min(range(self.target_n_cores), key=lambda i: self._core_free[i])
+            completion_time = max(self._core_free[core], arrival_time) + sim_elapsed
+            self._core_free[core] = completion_time
+        return completion_time
+
+
+class DilatedFilter(Filter):
+    """Run any filter as if on the simulated CPU of a ProcessDilator:
+    each call is timed with the thread CPU clock, dilated, scheduled on the target cores,
+    and does not return before its simulated completion time.
+    
+    Records 'dilated_cpu_time' and 'dilation_wait' (time spent holding back results) in session_stats.
+    """
+    def __init__(self, inner, dilator):
+        """
+        Arguments:
+            inner {Filter or FilterConfig} -- the filter to wrap. A FilterConfig is instantiated here, i.e., in the worker
+            dilator {ProcessDilator} -- the simulated CPU, shared by the filters it runs
+        """
+        super(DilatedFilter, self).__init__()
+        assert isinstance(dilator, ProcessDilator)
+        dilator.limit_threads()
+        self.inner = inner.instantiate() if isinstance(inner, FilterConfig) else inner
+        self.dilator = dilator
+        self._str = "Dilated({}, {} GHz x {})".format(self.inner, dilator.target_ghz, dilator.target_n_cores)
+
+    @property
+    def reads(self):
+        return self.inner.reads
+
+    @property
+    def writes(self):
+        return self.inner.writes
+
+    def set_session_stats(self, dct):
+        super(DilatedFilter, self).set_session_stats(dct)
+        self.inner.set_session_stats(dct)
+
+    @property
+    def lookahead(self):
+        return self.inner.lookahead
+
+    def set_downstream(self, filters):
+        self.inner.set_downstream(filters)
+
+    def hint(self, paths):
+        self.inner.hint(paths)
+
+    def close(self):
+        self.inner.close()
+
+    def __call__(self, item):
+        arrival_time = time.time()
+        self.dilator.reset()
+        ret = self.inner(item)
+        sim_elapsed = self.dilator.dilate()
+        self._wait_till(self.dilator.schedule(arrival_time, sim_elapsed), sim_elapsed)
+        return ret
+
+    def call_batch(self, items):
+        arrival_time = time.time()
+        self.dilator.reset()
+        rets = self.inner.call_batch(items)
+        sim_elapsed = self.dilator.dilate()
+        # the items of a batch are independent tasks that may go to different cores
+        per_item = sim_elapsed / max(len(items), 1)
+        completion_time = max([self.dilator.schedule(arrival_time, per_item) for _ in items] or [arrival_time])
+        self._wait_till(completion_time, sim_elapsed)
+        return rets
+
+    def _wait_till(self, t, sim_elapsed):
+        self.session_stats['dilated_cpu_time'] += sim_elapsed
+        slack = t - time.time()
+        if slack > 0:
+            time.sleep(slack)
+            self.session_stats['dilation_wait'] += slack
+
+
+def dilate_filter_configs(filter_configs, dilator):
+    """Wrap each filter of a chain so the whole chain runs on the dilator's simulated CPU."""
+    return [FilterConfig(DilatedFilter, args=[fc, dilator]) for fc in filter_configs]
 
 
 if __name__ == '__main__':
@@ -46,4 +180,4 @@ if __name__ == '__main__':
     l.sort()
     sim_elapsed= dilator.dilate()
     print("Dilated speed: {:.1f}ms (actual {:.1f}x, expect {:.1f}x)".format(
-        sim_elapsed*1000, sim_elapsed / elapsed, dilator._scaling))
\ No newline at end of file
+        sim_elapsed*1000, sim_elapsed / elapsed, dilator._scaling))
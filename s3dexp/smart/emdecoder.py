@@ -4,8 +4,8 @@ import numpy as np
 import os
 import time
 
-import s3dexp.db.utils as dbutils
 import s3dexp.db.models as models
+from s3dexp.db.profile_cache import load_profile_table
 
 
 class EmDecoder(object):
@@ -16,29 +16,29 @@ class EmDecoder(object):
         self.map_to_ppm_dir = map_to_ppm_dir
         self.next_available_time = init_time
 
-        sess = dbutils.get_session()
-        profiles = sess.query(models.DecodeProfile) \
-            .filter(models.DecodeProfile.path.like('{}%'.format(map_from_dir))) \
-            .filter(models.DecodeProfile.basename.like('%.{}'.format(ext))) \
-            .all()
-
-        logger.info("Found {} decode profiles.".format(len(profiles)))
-        orig_mpixps = sum([p.height * p.width / 1e6 for p in profiles]) / sum(p.decode_ms / 1e3 for p in profiles)
+        self.table = load_profile_table(
+            'EmDecodeProfile', {'map_from_dir': map_from_dir, 'ext': ext},
+            models.DecodeProfile,
+            lambda sess: sess.query(models.DecodeProfile) \
+                .filter(models.DecodeProfile.path.like('{}%'.format(map_from_dir))) \
+                .filter(models.DecodeProfile.basename.like('%.{}'.format(ext))),
+            # look-up table: relpath -> decode time (ms)
+            fields=[('key', 'S'), ('decode_ms', 'f8'), ('width', 'i4'), ('height', 'i4')],
+            to_record=lambda p: (os.path.relpath(p.path, map_from_dir), p.decode_ms, p.width, p.height),
+            unique_keys=False)
+
+        logger.info("Found {} decode profiles.".format(len(self.table)))
+        orig_mpixps = np.sum(self.table.height * self.table.width.astype(np.float64) / 1e6) / np.sum(self.table.decode_ms / 1e3)
         self.time_scaling = orig_mpixps / target_mpixps
         logger.info("Scaling the original software decode time by {}x".format(self.time_scaling))
 
-        # look-up table: relpath -> target decode time (s)
-        self.lut = dict([os.path.relpath(p.path, map_from_dir), p.decode_ms * 1e-3 * self.time_scaling] for p in profiles)
-
-        sess.close()
-
     def decode(self, arrival_time, path):
         assert path.endswith(self.ext)
         start_time = max(self.next_available_time, arrival_time)
         relpath= os.path.relpath(path, self.map_from_dir)
         ppm_path = os.path.join(self.map_to_ppm_dir, relpath).replace('.'+self.ext, '.ppm')
         arr = cv2.imread(ppm_path, cv2.IMREAD_COLOR)
-        sim_elapsed = self.lut[relpath]
+        sim_elapsed = self.table[relpath]['decode_ms'] * 1e-3 * self.time_scaling
         # logger.debug("Map {} -> {}, expect elapsed {:.1f} ms".format(path, ppm_path, sim_elapsed*1000))
         eta = start_time + sim_elapsed
         self.next_available_time = eta
@@ -0,0 +1,139 @@
+"""Run the first filters of a search on an emulated smart storage device.
+The device is a set of processes that run those filters on a slower (dilated) CPU 
+and send the surviving items back over an emulated bus."""
+
+import collections
+import multiprocessing as mp
+import os
+import time
+
+from logzero import logger
+
+from s3dexp.search import Item, attr_size
+from s3dexp.smart.emcpu import ProcessDilator, dilate_filter_configs
+
+
+class EmBus(object):
+    """A bus serving one transfer at a time, shared by processes forked after it is created."""
+    def __init__(self, mbyteps):
+        super(EmBus, self).__init__()
+        self.mbyteps = float(mbyteps)
+        self._free = mp.RawValue('d', 0.)  # time the bus becomes free
+        self._lock = mp.Lock()
+
+    def transfer(self, arrival_time, nbytes):
+        """Returns the simulated time `nbytes` submitted at `arrival_time` arrive at the host."""
+        with self._lock:
+            completion_time = max(self._free.value, arrival_time) + nbytes * 1e-6 / self.mbyteps
+            self._free.value = completion_time
+        return completion_time
+
+
+class EmDevice(object):
+    def __init__(self, filter_configs, num_clients, cpu_ghz=1.0, cpu_cores=4, bus_mbyteps=1000., platform_ghz=3.0, num_workers=None):
+        """An emulated smart storage device running a filter chain.
+        Must be created, and started, before forking the clients (i.e., search workers) that use it.
+        
+        Arguments:
+            filter_configs {list} -- FilterConfig's of the device-side filters
+            num_clients {int} -- max number of clients that will connect()
+        
+        Keyword Arguments:
+            cpu_ghz {float} -- clock speed of the device's CPU (default: {1.0})
+            cpu_cores {int} -- number of cores of the device's CPU (default: {4})
+            bus_mbyteps {float} -- bandwidth of the bus to the host (default: {1000.})
+            platform_ghz {float} -- clock speed of the CPU the emulation runs on (default: {3.0})
+            num_workers {int} -- number of emulation processes (default: {None}, one per device core)
+        """
+        super(EmDevice, self).__init__()
+        self.dilator = ProcessDilator(cpu_ghz, cpu_cores, platform_ghz)
+        self.filter_configs = dilate_filter_configs(filter_configs, self.dilator)
+        self.bus = EmBus(bus_mbyteps)
+        self.num_workers = num_workers or cpu_cores
+        self._str = "EmDevice({} GHz x {}, {} MB/s)".format(cpu_ghz, cpu_cores, bus_mbyteps)
+
+        self._requests = mp.Queue()
+        self._replies = [mp.Queue() for _ in range(num_clients)]
+        self._next_client = mp.Value('i', 0)
+        self._workers = []
+
+    def __str__(self):
+        return self._str
+
+    def start(self):
+        for i in range(self.num_workers):
+            w = mp.Process(target=_device_work, args=(self.filter_configs, self._requests, self._replies, self.bus),
+                           name='device-worker-{}'.format(i))
+            w.daemon = True
+            w.start()
+            self._workers.append(w)
+        logger.info("Started {} with {} workers".format(self, self.num_workers))
+
+    def stop(self):
+        for _ in self._workers:
+            self._requests.put(None)
+        for w in self._workers:
+            w.join()
+        self._workers = []
+
+    def connect(self):
+        """Claim a client ID. Each client (process) must use its own."""
+        with self._next_client.get_lock():
+            client_id = self._next_client.value
+            self._next_client.value += 1
+        assert client_id < len(self._replies), "Too many clients: {}".format(client_id)
+        return client_id
+
+    def call(self, client_id, srcs, ship=None):
+        """Run the device-side filters on a list of paths.
+        
+        Arguments:
+            client_id {int} -- as returned by connect()
+            srcs {list} -- paths
+        
+        Keyword Arguments:
+            ship {set} -- keys of the attributes to send back. None for all (default: {None})
+        
+        Returns:
+            (float, int, list) -- simulated time the results arrive at the host, 
+                bytes transferred, and per path a dict of the item's attributes or None if discarded on the device
+        """
+        self._requests.put((client_id, srcs, ship))
+        return self._replies[client_id].get()
+
+
+def _device_work(filter_configs, requests, replies, bus):
+    logger.info("[Device worker {}] started".format(os.getpid()))
+    filters = map(lambda fc: fc.instantiate(), filter_configs)
+    session_stats = collections.defaultdict(float)
+    for f in filters:
+        f.set_session_stats(session_stats)
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        client_id, srcs, ship = request
+        items = map(Item, srcs)
+        alive = range(len(items))
+        try:
+            for f in filters:
+                rets = f.call_batch([items[i] for i in alive])
+                alive = [i for i, ret in zip(alive, rets) if ret]
+                if not alive:
+                    break
+        except Exception as e:
+            logger.error("Exception on {}".format(srcs))
+            logger.exception(e)
+            alive = []
+
+        results = [None] * len(items)
+        nbytes = 0
+        for i in alive:
+            attrs = dict((k, v) for k, v in items[i]._attrs.items() if k != Item.SRC and (ship is None or k in ship))
+            nbytes += sum(map(attr_size, attrs.values()))
+            results[i] = attrs
+        session_stats['bytes_to_host'] += nbytes
+        replies[client_id].put((bus.transfer(time.time(), nbytes), nbytes, results))
+
+    logger.info("[Device worker {}] session_stats: {}".format(os.getpid(), str(session_stats)))
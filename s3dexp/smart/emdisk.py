@@ -1,6 +1,15 @@
+from logzero import logger
+import math
+import numpy as np
 import os
 import time
 
+import s3dexp.db.models as models
+from s3dexp.db.profile_cache import load_profile_table
+from s3dexp.manifest import load_manifest
+from s3dexp.scan_scheduler import build_extent_map, get_extents
+
+
 class EmDiskInterface(object):
     def get(self, arrival_time, path):
         raise NotImplementedError
@@ -17,6 +26,175 @@ class RealDisk(EmDiskInterface):
         return arrival_time + elapsed, buf
 
 
+def load_disk_read_profiles(base_dir, disk='hdd', ext='jpg'):
+    """Look-up table: basename -> (seq_read_ms, rand_read_ms, size) measured on `disk` by script/profile_data.py"""
+    return load_profile_table(
+        'DiskReadProfile', {'disk': disk, 'base_dir': base_dir, 'ext': ext},
+        models.DiskReadProfile,
+        lambda sess: sess.query(models.DiskReadProfile) \
+            .filter(models.DiskReadProfile.disk==disk) \
+            .filter(models.DiskReadProfile.path.like('{}%'.format(base_dir))) \
+            .filter(models.DiskReadProfile.path.like('%.{}'.format(ext))),
+        # assume basename is suffiently unique
+        fields=[('key', 'S'), ('seq_read_ms', 'f8'), ('rand_read_ms', 'f8'), ('size', 'i8')],
+        to_record=lambda p: (os.path.basename(p.path), p.seq_read_ms, p.rand_read_ms, p.size or 0))
+
+
+class HDDModel(object):
+    """A mechanical hard disk. Reading a file costs, per extent (as returned by FIEMAP):
+        - seek: min_seek_ms + (full_seek_ms - min_seek_ms) * sqrt(distance / span_bytes)
+        - rotation: wait for the extent to come under the head. The platter angle follows the clock, 
+          and an offset's angle is its position within a track of (transfer rate * rotation period) bytes
+        - or, if the extent starts less than a track ahead of the head: no positioning. The drive reads ahead
+          after each request, so only the part of the gap it has not read ahead yet costs time
+        - transfer: length / transfer rate
+    plus a fixed per-request overhead (command, file system).
+    The model is stateful: it remembers where the head is. Use one instance per disk.
+    """
+
+    # E[sqrt(|X - Y|)] for X, Y ~ U(0, 1): the avg seek of random reads on the sqrt seek curve
+    _MEAN_SQRT_DISTANCE = 8. / 15.
+
+    def __init__(self, transfer_mbyteps=150., overhead_ms=0.2, rpm=7200, min_seek_ms=1., full_seek_ms=15., span_bytes=1e12):
+        super(HDDModel, self).__init__()
+        self.transfer_mbyteps = float(transfer_mbyteps)
+        self.overhead_ms = float(overhead_ms)
+        self.rpm = rpm
+        self.min_seek_ms = float(min_seek_ms)
+        self.full_seek_ms = float(full_seek_ms)
+        self.span_bytes = float(span_bytes)
+
+        self.rotation_s = 60. / rpm
+        self.track_bytes = self.transfer_mbyteps * 1e6 * self.rotation_s
+        self.head = 0   # physical offset under the head
+        self._idle_since = 0.   # when the last request finished and read-ahead started
+
+        logger.info("HDD model: {:.1f} MB/s, overhead {:.2f} ms, {} RPM, seek {:.2f}-{:.2f} ms over {:.1f} GB".format(
+            self.transfer_mbyteps, self.overhead_ms, rpm, self.min_seek_ms, self.full_seek_ms, self.span_bytes * 1e-9))
+
+    @classmethod
+    def calibrate(cls, size, seq_read_ms, rand_read_ms, span_bytes, rpm=7200, min_seek_ms=1., default_mbyteps=150., mean_sqrt_distance=None):
+        """Fit a model to measured per-file read times.
+        Sequential reads (files read in disk order) give transfer rate and overhead by a linear fit of time vs. size.
+        What random reads take on top of that is positioning: avg seek + half a rotation.
+        
+        Arguments:
+            size {ndarray} -- file sizes in bytes
+            seq_read_ms {ndarray} -- read times in disk order. NaN if not measured
+            rand_read_ms {ndarray} -- read times in random order. NaN if not measured
+            span_bytes {int} -- physical range the measured files spread over
+        
+        Keyword Arguments:
+            mean_sqrt_distance {float} -- E[sqrt(seek distance / span_bytes)] between random files. 
+                None to assume files are spread uniformly (default: {None})
+        """
+        size = np.asarray(size, dtype=np.float64)
+        seq_read_ms = np.asarray(seq_read_ms, dtype=np.float64)
+        rand_read_ms = np.asarray(rand_read_ms, dtype=np.float64)
+
+        transfer_mbyteps, overhead_ms = default_mbyteps, 0.
+        seq = ~np.isnan(seq_read_ms)
+        if np.sum(seq) > 1 and np.ptp(size[seq]) > 0:
+            slope, intercept = np.polyfit(size[seq], seq_read_ms[seq], 1)  # ms/byte, ms
+            if slope > 0:
+                transfer_mbyteps, overhead_ms = 1e-3 / slope, max(intercept, 0.)
+        if transfer_mbyteps == default_mbyteps and np.any(seq):
+            logger.warn("Cannot fit transfer rate from sequential reads. Assume {} MB/s".format(default_mbyteps))
+            overhead_ms = max(np.mean(seq_read_ms[seq] - size[seq] * 1e-3 / transfer_mbyteps), 0.)
+
+        half_rotation_ms = 0.5 * 60e3 / rpm
+        avg_seek_ms = min_seek_ms
+        rand = ~np.isnan(rand_read_ms)
+        if np.any(rand):
+            positioning_ms = np.mean(rand_read_ms[rand] - overhead_ms - size[rand] * 1e-3 / transfer_mbyteps)
+            avg_seek_ms = max(positioning_ms - half_rotation_ms, min_seek_ms)
+        full_seek_ms = min_seek_ms + (avg_seek_ms - min_seek_ms) / (mean_sqrt_distance or cls._MEAN_SQRT_DISTANCE)
+
+        return cls(transfer_mbyteps, overhead_ms, rpm, min_seek_ms, full_seek_ms, span_bytes)
+
+    def seek_time(self, distance):
+        if distance == 0:
+            return 0.
+        return 1e-3 * (self.min_seek_ms + (self.full_seek_ms - self.min_seek_ms) * math.sqrt(min(distance / self.span_bytes, 1.)))
+
+    def rotation_time(self, t, physical):
+        """Time to wait at time t until `physical` comes under the head"""
+        head_angle = (t / self.rotation_s) % 1.
+        target_angle = (physical / self.track_bytes) % 1.
+        return ((target_angle - head_angle) % 1.) * self.rotation_s
+
+    def access(self, t, extents):
+        """Simulated time to read `extents` when the disk starts serving at time t. Moves the head.
+        
+        Arguments:
+            t {float} -- start time (seconds)
+            extents {list} -- (logical, physical, length) as returned by s3dexp.scan_scheduler.get_extents()
+        
+        Returns:
+            float -- elapsed seconds
+        """
+        elapsed = 1e-3 * self.overhead_ms
+        for _, physical, length in extents:
+            distance = physical - self.head
+            if 0 <= distance < self.track_bytes:
+                elapsed += max(distance * 1e-6 / self.transfer_mbyteps - (t + elapsed - self._idle_since), 0.)
+            else:
+                elapsed += self.seek_time(abs(distance))
+                elapsed += self.rotation_time(t + elapsed, physical)
+            elapsed += length * 1e-6 / self.transfer_mbyteps
+            self.head = physical + length
+        self._idle_since = t + elapsed
+        return elapsed
+
+
+def build_hdd_model(base_dir, disk='hdd', ext='jpg', rpm=7200, min_seek_ms=1.):
+    """Calibrate an HDDModel against the DiskReadProfile's of a data set, and map the data set's extents.
+    The extents are kept in the data set's manifest.
+    
+    Returns:
+        (HDDModel, dict) -- the model, and path -> list of extents
+    """
+    manifest = load_manifest(base_dir, ext)
+    extent_map = build_extent_map(manifest.paths, manifest=manifest)
+    physical = [(e[1], e[1] + e[2]) for extents in extent_map.values() for e in extents]
+    span_bytes = (max(p[1] for p in physical) - min(p[0] for p in physical)) if physical else 1e12
+    mean_sqrt_distance = None
+    if physical:
+        # how far apart random files actually are
+        starts = np.array([extents[0][1] for extents in extent_map.values() if extents], dtype=np.float64)
+        rs = np.random.RandomState(42)
+        i, j = rs.randint(len(starts), size=(2, 10000))
+        mean_sqrt_distance = np.mean(np.sqrt(np.abs(starts[i] - starts[j]) / span_bytes)) or None
+
+    table = load_disk_read_profiles(base_dir, disk, ext)
+    logger.info("Calibrating HDD model against {} read profiles of {}".format(len(table), disk))
+    model = HDDModel.calibrate(table.size, table.seq_read_ms, table.rand_read_ms, span_bytes, rpm=rpm, min_seek_ms=min_seek_ms, 
+                               mean_sqrt_distance=mean_sqrt_distance)
+    if physical:
+        model.head = min(p[0] for p in physical)
+    return model, extent_map
+
+
 class EmDiskSim(EmDiskInterface):
+    def __init__(self, base_dir, disk='hdd', ext='jpg', rpm=7200, init_time=None):
+        """Emulate a mechanical HDD holding the data set in base_dir, 
+        with the files laid out as they are on the real disk.
+        The data is read for real (preferably from page cache) but charged the modeled time.
+        """
+        super(EmDiskSim, self).__init__()
+        self.model, self.extent_map = build_hdd_model(base_dir, disk, ext, rpm=rpm)
+        self.next_available_time = init_time if init_time is not None else time.time()
+
+    def extents(self, path):
+        extents = self.extent_map.get(path)
+        if extents is None:
+            extents = self.extent_map[path] = get_extents(path)
+        return extents
+
     def get(self, arrival_time, path):
-        raise NotImplementedError
\ No newline at end of file
+        start_time = max(self.next_available_time, arrival_time)
+        eta = start_time + self.model.access(start_time, self.extents(path))
+        self.next_available_time = eta
+        with open(path, 'rb') as f:
+            buf = f.read()
+        return eta, buf
@@ -1,7 +1,8 @@
 from logzero import logger
-from s3dexp.em.emcpu import ProcessDilator
-from s3dexp.em.emdecoder import EmDecoder
-from s3dexp.em.emdisk import EmDiskInterface
+from s3dexp.smart.emcpu import ProcessDilator
+from s3dexp.smart.emdecoder import EmDecoder
+from s3dexp.smart.emdisk import EmDiskInterface, EmDiskSim
+from s3dexp.scan_scheduler import get_extents, schedule
 import time
 
 
@@ -15,7 +16,21 @@ class EmSmartStorage(object):
         self.dilator = dilator
         self.emdecoder = emdecoder
         self.emdisk = emdisk
+        # extents of the files seen so far, for hint='sort' on disks that don't keep them
+        self._extent_map = {}
 
+    def _extents(self, path):
+        if isinstance(self.emdisk, EmDiskSim):
+            return self.emdisk.extents(path)
+        extents = self._extent_map.get(path)
+        if extents is None:
+            try:
+                extents = get_extents(path)
+            except (IOError, OSError) as e:
+                logger.warn("FIEMAP failed on {}: {}".format(path, e))
+                extents = []
+            self._extent_map[path] = extents
+        return extents
 
     def get(self, arrival_time, path):
         return self.emdisk.get(arrival_time, path)
@@ -26,8 +41,27 @@ class EmSmartStorage(object):
         return decode_rct, arr
 
     def get_paths(self, arrival_time, list_path, hint='sort'):
+        """Read and decode a batch of paths that all arrive at arrival_time.
+        The disk reads one file after another while the decoder works on the previous ones.
+        
+        Arguments:
+            arrival_time {float} -- As returned by time.time()
+            list_path {list} -- paths to read and decode
+        
+        Keyword Arguments:
+            hint {str} -- 'sort': the device may reorder the batch by physical location on disk. 
+                'random': serve in the given order (default: {'sort'})
+        
+        Yields:
+            (float, str, ndarray) -- (completion time, path, decoded array) in completion order
+        """
         assert hint in ('sort', 'random')
-        raise NotImplementedError
+        if hint == 'sort':
+            list_path = schedule(list_path, extent_map=dict((p, self._extents(p)) for p in list_path))
+
+        for path in list_path:
+            decode_rct, arr = self.get_decode(arrival_time, path)
+            yield decode_rct, path, arr
 
 
 class LocalClient(object):
@@ -54,3 +88,13 @@ class LocalClient(object):
         rct, arr = self.ss.get_decode(time.time(), *args, **kwargs)
         self._wait_till(rct)
         return arr
+
+    def get_paths(self, list_path, hint='sort'):
+        """Submit a whole batch and stream the results as the device completes them.
+        
+        Yields:
+            (str, ndarray) -- (path, decoded array) in completion order
+        """
+        for rct, path, arr in self.ss.get_paths(time.time(), list_path, hint=hint):
+            self._wait_till(rct)
+            yield path, arr
@@ -0,0 +1,87 @@
+import unittest
+
+import simpy
+
+from s3dexp.sim.admission import AdmissionController, FIFOPolicy, PriorityPolicy, RoundRobinPolicy
+
+
+def _drain(policy):
+    return [policy.pop() for _ in range(len(policy))]
+
+
+class PolicyTest(unittest.TestCase):
+
+    def test_fifo(self):
+        p = FIFOPolicy()
+        for client, item in [('a', 1), ('b', 2), ('a', 3)]:
+            p.push(client, item)
+        self.assertEqual(_drain(p), [1, 2, 3])
+
+    def test_round_robin(self):
+        p = RoundRobinPolicy()
+        for client, item in [('a', 1), ('a', 2), ('a', 3), ('b', 4), ('c', 5), ('b', 6)]:
+            p.push(client, item)
+        self.assertEqual(len(p), 6)
+        self.assertEqual(_drain(p), [1, 4, 5, 2, 6, 3])
+
+    def test_round_robin_client_rejoins_at_the_back(self):
+        p = RoundRobinPolicy()
+        p.push('a', 1)
+        p.push('b', 2)
+        self.assertEqual(p.pop(), 1)
+        p.push('a', 3)
+        p.push('c', 4)
+        self.assertEqual(_drain(p), [2, 3, 4])
+
+    def test_priority(self):
+        p = PriorityPolicy()
+        for client, item, priority in [('a', 1, 2), ('b', 2, 1), ('a', 3, 2), ('c', 4, 0)]:
+            p.push(client, item, priority)
+        self.assertEqual(_drain(p), [4, 2, 1, 3])
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = simpy.Environment()
+        self.served = []    # (start time, request)
+
+    def serve(self, request, duration=1.):
+        self.served.append((self.env.now, request))
+        yield self.env.timeout(duration)
+
+    def test_max_inflight(self):
+        ac = AdmissionController(self.env, self.serve, policy='rr', max_inflight=1)
+        for request, client in enumerate('aaab'):
+            ac.submit(client, 0., request)
+        self.env.run()
+        self.assertEqual(self.served, [(0., 0), (1., 3), (2., 1), (3., 2)])
+        self.assertEqual(ac.stats['a'].num_requests, 3)
+        self.assertAlmostEqual(ac.stats['a'].total_queue_wait, 2. + 3.)
+        self.assertAlmostEqual(ac.stats['a'].total_latency, 1. + 3. + 4.)
+        self.assertEqual(ac.inflight, 0)
+
+    def test_unlimited(self):
+        ac = AdmissionController(self.env, self.serve)
+        for request in range(3):
+            ac.submit('a', 0., request)
+        self.env.run()
+        self.assertEqual(self.served, [(0., 0), (0., 1), (0., 2)])
+
+    def test_arrival(self):
+        ac = AdmissionController(self.env, self.serve, max_inflight=1)
+        ac.submit('a', 2., 0, args=(0.5, ))
+        self.env.run()
+        self.assertEqual(self.served, [(2., 0)])
+        self.assertEqual(self.env.now, 2.5)
+
+        # reached the simulator late: starts now, and the delay counts in its latency
+        ac.submit('b', 1., 1)
+        self.env.run()
+        self.assertEqual(self.served[-1], (2.5, 1))
+        self.assertAlmostEqual(ac.stats['b'].total_arrival_delay, 1.5)
+        self.assertAlmostEqual(ac.stats['b'].total_latency, 2.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import MultipleResultsFound
+
+import s3dexp.db.models as models
+from s3dexp.db.utils import bulk_insert_or_update
+
+
+def _record(path, size, **vals):
+    vals['size'] = size
+    return dict(keys_dict=dict(path=path), vals_dict=vals)
+
+
+class BulkInsertOrUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        models.ImageMeta.__table__.create(engine)
+        self.sess = sessionmaker(bind=engine)()
+
+    def tearDown(self):
+        self.sess.close()
+
+    def rows(self):
+        return sorted((r.path, r.size) for r in self.sess.query(models.ImageMeta))
+
+    def test_insert_and_update(self):
+        bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/a', 1), _record('/b', 2)])
+        self.sess.commit()
+        bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/b', 20), _record('/c', 3)])
+        self.sess.commit()
+        self.assertEqual(self.rows(), [('/a', 1), ('/b', 20), ('/c', 3)])
+
+    def test_keeps_other_columns(self):
+        bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/a', 1, width=640)])
+        bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/a', 2)])
+        self.sess.commit()
+        row = self.sess.query(models.ImageMeta).one()
+        self.assertEqual((row.size, row.width), (2, 640))
+
+    def test_last_duplicate_wins(self):
+        bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/a', 1), _record('/a', 2, width=640), _record('/a', 3)])
+        self.sess.commit()
+        row = self.sess.query(models.ImageMeta).one()
+        self.assertEqual((row.size, row.width), (3, 640))
+
+    def test_chunks(self):
+        records = [_record('/{}'.format(i), i) for i in range(7)]
+        bulk_insert_or_update(self.sess, models.ImageMeta, records, chunk_size=3)
+        records = [_record('/{}'.format(i), 10 * i) for i in range(0, 10, 2)]
+        bulk_insert_or_update(self.sess, models.ImageMeta, records, chunk_size=3)
+        self.sess.commit()
+        self.assertEqual(self.rows(), sorted(('/{}'.format(i), 10 * i if i % 2 == 0 else i) for i in range(7) + [8]))
+
+    def test_multiple_rows_match(self):
+        self.sess.add_all([models.ImageMeta(path='/a', size=1), models.ImageMeta(path='/a', size=2)])
+        self.sess.commit()
+        with self.assertRaises(MultipleResultsFound):
+            bulk_insert_or_update(self.sess, models.ImageMeta, [_record('/a', 3)])
+
+    def test_no_session(self):
+        self.assertIsNone(bulk_insert_or_update(None, models.ImageMeta, [_record('/a', 1)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
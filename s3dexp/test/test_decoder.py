@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import simpy
+
+from s3dexp.sim.decoder import VideoDecoderSim
+from s3dexp.test.test_utils import _write_clip
+from s3dexp.utils import get_video_keyframes
+
+
+class VideoDecoderSimTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, 'clip.mp4')
+        _write_clip(cls.path)
+        if get_video_keyframes(cls.path) != range(0, 200, 12):
+            shutil.rmtree(cls.tmp_dir)
+            raise unittest.SkipTest("OpenCV did not write MPEG-4 video with 12-frame GOPs")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def elapsed_frames(self, decoder, frame_ids):
+        # simulated time of decoding each frame in turn, in frame times
+        env = decoder.env
+        elapsed = []
+        for frame_id in frame_ids:
+            tic = env.now
+            env.run(env.process(decoder.decode_frame(self.path, frame_id)))
+            elapsed.append(round((env.now - tic) * decoder.target_fps, 6))
+        return elapsed
+
+    def test_linear(self):
+        decoder = VideoDecoderSim(simpy.Environment(), 100.)
+        self.assertEqual(self.elapsed_frames(decoder, [0, 10, 10, 30]), [0., 10., 0., 20.])
+
+    def test_gop(self):
+        decoder = VideoDecoderSim(simpy.Environment(), 100., cost_model='gop', grab_ratio=0.5)
+        # 0 and 1 in turn; 30 seeks to key frame 24; 31 follows
+        self.assertEqual(self.elapsed_frames(decoder, [0, 1, 30, 31]), [1., 1., 4., 1.])
+        # 33 is in the same GOP, ahead: decodes on from 32
+        self.assertEqual(self.elapsed_frames(decoder, [33]), [1.5])
+
+    def test_gop_repeat(self):
+        decoder = VideoDecoderSim(simpy.Environment(), 100., cost_model='gop', grab_ratio=0.5)
+        # the same frame again decodes it again from its key frame
+        self.assertEqual(self.elapsed_frames(decoder, [30, 30]), [4., 4.])
+
+    def test_backward(self):
+        decoder = VideoDecoderSim(simpy.Environment(), 100., cost_model='gop')
+        self.elapsed_frames(decoder, [30])
+        with self.assertRaises(AssertionError):
+            self.elapsed_frames(decoder, [29])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from s3dexp.diff import mse, mse_numpy, sse
+
+
+class MSETest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = np.random.RandomState(0)
+        self.arr1 = rnd.randint(0, 256, (480, 640, 3)).astype(np.uint8)
+        self.arr2 = rnd.randint(0, 256, (480, 640, 3)).astype(np.uint8)
+
+    def test_matches_numpy(self):
+        self.assertAlmostEqual(mse(self.arr1, self.arr2), mse_numpy(self.arr1, self.arr2))
+
+    def test_no_overflow(self):
+        # uint8 differences must not wrap around
+        zeros, full = np.zeros((4, 4, 3), np.uint8), np.full((4, 4, 3), 255, np.uint8)
+        self.assertEqual(mse(zeros, full), 255. ** 2)
+        self.assertEqual(mse(full, zeros), 255. ** 2)
+
+    def test_threads(self):
+        expected = sse(self.arr1, self.arr2)
+        for num_threads in [2, 3, 8]:
+            self.assertEqual(sse(self.arr1, self.arr2, num_threads), expected, num_threads)
+        # fewer rows than tiles
+        self.assertEqual(sse(self.arr1[:5], self.arr2[:5], 8), sse(self.arr1[:5], self.arr2[:5]))
+
+    def test_scale(self):
+        self.assertEqual(mse(self.arr1, self.arr1.copy(), scale=0.25), 0.)
+        # a uniform shift survives downscaling
+        shifted = self.arr1 // 2 + 10
+        self.assertAlmostEqual(mse(self.arr1 // 2, shifted, scale=0.25), 100.)
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(AssertionError):
+            mse(self.arr1, self.arr2[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
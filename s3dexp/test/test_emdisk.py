@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from s3dexp.smart.emdisk import HDDModel
+
+
+class HDDModelTest(unittest.TestCase):
+
+    def measurements(self, transfer_mbyteps=100., overhead_ms=0.5, rpm=7200, min_seek_ms=1., full_seek_ms=15.):
+        size = np.linspace(1e5, 1e6, 20)
+        seq_read_ms = overhead_ms + size * 1e-3 / transfer_mbyteps
+        avg_seek_ms = min_seek_ms + (full_seek_ms - min_seek_ms) * HDDModel._MEAN_SQRT_DISTANCE
+        rand_read_ms = seq_read_ms + avg_seek_ms + 0.5 * 60e3 / rpm
+        return size, seq_read_ms, rand_read_ms
+
+    def test_calibrate(self):
+        size, seq_read_ms, rand_read_ms = self.measurements()
+        m = HDDModel.calibrate(size, seq_read_ms, rand_read_ms, span_bytes=1e11)
+        self.assertAlmostEqual(m.transfer_mbyteps, 100.)
+        self.assertAlmostEqual(m.overhead_ms, 0.5)
+        self.assertAlmostEqual(m.min_seek_ms, 1.)
+        self.assertAlmostEqual(m.full_seek_ms, 15.)
+        self.assertEqual(m.span_bytes, 1e11)
+
+    def test_calibrate_skips_nan(self):
+        size, seq_read_ms, rand_read_ms = self.measurements()
+        seq_read_ms[::2] = np.nan
+        rand_read_ms[1::2] = np.nan
+        m = HDDModel.calibrate(size, seq_read_ms, rand_read_ms, span_bytes=1e11)
+        self.assertAlmostEqual(m.transfer_mbyteps, 100.)
+        self.assertAlmostEqual(m.full_seek_ms, 15.)
+
+    def test_calibrate_mean_sqrt_distance(self):
+        # files packed in a part of the span seek less on average
+        size, seq_read_ms, rand_read_ms = self.measurements(full_seek_ms=10.)
+        m = HDDModel.calibrate(size, seq_read_ms, rand_read_ms, span_bytes=1e11,
+                               mean_sqrt_distance=HDDModel._MEAN_SQRT_DISTANCE / 2)
+        self.assertAlmostEqual(m.full_seek_ms, 19.)
+
+    def test_calibrate_same_size(self):
+        # no slope to fit: assume the default transfer rate
+        size = np.full(10, 1e6)
+        seq_read_ms = np.full(10, 12.)
+        m = HDDModel.calibrate(size, seq_read_ms, np.full(10, np.nan), span_bytes=1e11, default_mbyteps=200.)
+        self.assertEqual(m.transfer_mbyteps, 200.)
+        self.assertAlmostEqual(m.overhead_ms, 7.)
+        self.assertEqual(m.full_seek_ms, m.min_seek_ms)
+
+    def test_seek_time(self):
+        m = HDDModel(min_seek_ms=1., full_seek_ms=15., span_bytes=1e12)
+        self.assertEqual(m.seek_time(0), 0.)
+        self.assertAlmostEqual(m.seek_time(1e12), 15e-3)
+        self.assertAlmostEqual(m.seek_time(2e12), 15e-3)
+        self.assertAlmostEqual(m.seek_time(0.25e12), 8e-3)
+
+    def test_access(self):
+        m = HDDModel(transfer_mbyteps=100., overhead_ms=0.)
+        self.assertAlmostEqual(m.access(0., [(0, 0, 1000000)]), 10e-3)
+        self.assertEqual(m.head, 1000000)
+        # right behind the head
+        self.assertAlmostEqual(m.access(1., [(0, 1000000, 1000000)]), 10e-3)
+        # far away: seek and rotation on top of the transfer
+        elapsed = m.access(2., [(0, 5e11, 1000000)])
+        self.assertGreaterEqual(elapsed, 10e-3 + m.seek_time(5e11 - 2000000))
+        self.assertLessEqual(elapsed, 10e-3 + m.seek_time(5e11 - 2000000) + m.rotation_s)
+
+
+if __name__ == '__main__':
+    unittest.main()
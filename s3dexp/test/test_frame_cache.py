@@ -0,0 +1,126 @@
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import s3dexp.sim.frame_cache as frame_cache
+from s3dexp.sim.frame_cache import SharedFrameCache
+
+
+def _frame(i, shape=(32, 32)):
+    # 1 KB: one chunk
+    return np.full(shape, i, dtype=np.uint8)
+
+
+def _get_in_child(name, key, i):
+    arr = SharedFrameCache(name).get(key)
+    os._exit(0 if arr is not None and np.array_equal(arr, _frame(i)) else 1)
+
+
+class SharedFrameCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shm_dir = tempfile.mkdtemp()
+        self._shm_dir, frame_cache.SHM_DIR = frame_cache.SHM_DIR, self.shm_dir
+        # 8 chunks of 1 KB
+        self.cache = SharedFrameCache('test', mbytes=0.0085, chunk_kbytes=1)
+
+    def tearDown(self):
+        frame_cache.SHM_DIR = self._shm_dir
+        shutil.rmtree(self.shm_dir)
+
+    def test_put_get(self):
+        self.assertEqual(self.cache.num_chunks, 8)
+        self.assertTrue(self.cache.put('a', _frame(1)))
+        self.assertFalse(self.cache.put('a', _frame(2)))
+        self.assertTrue('a' in self.cache)
+        arr = self.cache.get('a')
+        self.assertTrue(np.array_equal(arr, _frame(1)))
+        # a copy
+        arr[:] = 0
+        self.assertTrue(np.array_equal(self.cache.get('a'), _frame(1)))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+    def test_shapes(self):
+        rgb = np.arange(3000, dtype=np.uint32).astype(np.uint8).reshape((20, 50, 3))
+        self.assertTrue(self.cache.put('rgb', rgb))
+        self.assertTrue(np.array_equal(self.cache.get('rgb'), rgb))
+        self.assertEqual(self.cache.used_bytes(), 3 * 1024)
+        self.assertTrue(self.cache.put('1d', np.arange(7, dtype=np.uint8)))
+        self.assertEqual(self.cache.get('1d').shape, (7, ))
+
+    def test_too_large(self):
+        self.assertFalse(self.cache.put('huge', np.zeros(9 * 1024, np.uint8)))
+        self.assertEqual(self.cache.used_bytes(), 0)
+
+    def test_clock_eviction(self):
+        for i in range(8):
+            self.assertTrue(self.cache.put(str(i), _frame(i)))
+        self.assertEqual(self.cache.used_bytes(), self.cache.capacity_bytes)
+
+        # all were referenced when put: a full round clears them, then the oldest goes
+        self.assertTrue(self.cache.put('8', _frame(8)))
+        self.assertFalse('0' in self.cache)
+
+        # 1 is referenced again and gets a second chance
+        self.cache.get('1')
+        self.assertTrue(self.cache.put('9', _frame(9)))
+        self.assertTrue('1' in self.cache)
+        self.assertFalse('2' in self.cache)
+        self.assertEqual(self.cache.used_bytes(), self.cache.capacity_bytes)
+
+        # evicts as many frames as needed
+        self.assertTrue(self.cache.put('big', np.zeros(3 * 1024, np.uint8)))
+        self.assertLessEqual(self.cache.used_bytes(), self.cache.capacity_bytes)
+        self.assertEqual(sum(str(i) in self.cache for i in range(10)), 5)
+
+    def test_many_puts(self):
+        for i in range(1000):
+            self.cache.put(str(i), _frame(i % 256, (i % 40 + 1, 50)))
+        present = [i for i in range(1000) if str(i) in self.cache]
+        self.assertTrue(present)
+        for i in present:
+            self.assertTrue(np.array_equal(self.cache.get(str(i)), _frame(i % 256, (i % 40 + 1, 50))))
+        self.assertLessEqual(self.cache.used_bytes(), self.cache.capacity_bytes)
+
+    def test_shared(self):
+        self.cache.put('a', _frame(1))
+        p = mp.Process(target=_get_in_child, args=('test', 'a', 1))
+        p.start()
+        p.join()
+        self.assertEqual(p.exitcode, 0)
+
+    def test_attach_keeps_size(self):
+        cache = SharedFrameCache('test', mbytes=1.)
+        self.assertEqual(cache.capacity_bytes, self.cache.capacity_bytes)
+        self.cache.put('a', _frame(1))
+        self.assertTrue(np.array_equal(cache.get('a'), _frame(1)))
+
+    def test_reclaim_dead_writer(self):
+        p = mp.Process(target=os._exit, args=(0, ))
+        p.start()
+        p.join()
+
+        self.assertTrue(self.cache.put('a', _frame(1)))
+        # as if the dead process were still filling it in
+        e = self.cache._find(frame_cache._key_hash('a'))
+        self.cache._owner[e] = p.pid
+        self.cache._state[e] = frame_cache._FILLING
+        self.assertFalse('a' in self.cache)
+        self.assertTrue(self.cache.put('a', _frame(2)))
+        self.assertTrue(np.array_equal(self.cache.get('a'), _frame(2)))
+        self.assertEqual(self.cache.used_bytes(), 1024)
+
+    def test_unlink(self):
+        self.cache.put('a', _frame(1))
+        SharedFrameCache.unlink('test')
+        self.assertFalse(os.path.exists(self.cache.path))
+        self.assertFalse('a' in SharedFrameCache('test'))
+
+
+if __name__ == '__main__':
+    unittest.main()
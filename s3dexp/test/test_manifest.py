@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from s3dexp.manifest import Manifest, load_manifest
+
+
+def _write(path, nbytes):
+    with open(path, 'wb') as f:
+        f.write('x' * nbytes)
+
+
+def _touch_dir(d):
+    # directory mtimes can be too coarse to tell apart changes made within the same test
+    t = time.time() + 10
+    os.utime(d, (t, t))
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.tmp_dir, 'data')
+        self.manifest_path = os.path.join(self.tmp_dir, 'manifest.npz')
+        os.makedirs(os.path.join(self.base_dir, 'sub'))
+        _write(self.path('a.jpg'), 10)
+        _write(self.path('b.png'), 10)
+        _write(self.path('sub', 'c.jpg'), 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def path(self, *names):
+        return os.path.join(os.path.realpath(self.base_dir), *names)
+
+    def manifest(self, **kwargs):
+        return load_manifest(self.base_dir, ext='jpg', manifest_path=self.manifest_path, **kwargs)
+
+    def test_build(self):
+        m = self.manifest()
+        self.assertEqual(m.paths, [self.path('a.jpg'), self.path('sub', 'c.jpg')])
+        self.assertEqual(m.size(self.path('sub', 'c.jpg')), 20)
+        self.assertEqual(m.ino(self.path('a.jpg')), os.stat(self.path('a.jpg')).st_ino)
+        self.assertTrue(os.path.exists(self.manifest_path))
+
+    def test_save_load(self):
+        self.manifest()
+        m = Manifest(self.base_dir, ext='.jpg', manifest_path=self.manifest_path)
+        self.assertTrue(m.load())
+        self.assertEqual(m.paths, [self.path('a.jpg'), self.path('sub', 'c.jpg')])
+        self.assertFalse(m.refresh())
+
+    def test_refresh_added_and_deleted(self):
+        self.manifest()
+        _write(self.path('sub', 'd.jpg'), 30)
+        os.unlink(self.path('a.jpg'))
+        _touch_dir(self.path('sub'))
+        _touch_dir(self.path())
+        m = self.manifest()
+        self.assertEqual(m.paths, [self.path('sub', 'c.jpg'), self.path('sub', 'd.jpg')])
+
+    def test_refresh_new_and_deleted_dir(self):
+        self.manifest()
+        os.makedirs(self.path('new'))
+        _write(self.path('new', 'e.jpg'), 40)
+        shutil.rmtree(self.path('sub'))
+        _touch_dir(self.path())
+        m = self.manifest()
+        self.assertEqual(m.paths, [self.path('a.jpg'), self.path('new', 'e.jpg')])
+
+    def test_modified_in_place_needs_verify(self):
+        self.manifest()
+        # rewriting a file doesn't change its directory's mtime
+        _write(self.path('a.jpg'), 50)
+        self.assertEqual(self.manifest().size(self.path('a.jpg')), 10)
+        self.assertEqual(self.manifest(verify=True).size(self.path('a.jpg')), 50)
+
+    def test_extents(self):
+        m = self.manifest(extents=True)
+        self.assertEqual(sorted(m.extent_map().keys()), m.paths)
+        extents = m.extents(self.path('a.jpg'))
+        self.assertIsNotNone(extents)
+
+        # saved along with the files
+        m = Manifest(self.base_dir, ext='jpg', manifest_path=self.manifest_path)
+        m.load()
+        self.assertEqual(m.extents(self.path('a.jpg')), extents)
+
+        # dropped when the file changes
+        _write(self.path('a.jpg'), 5000)
+        m = self.manifest(verify=True)
+        self.assertIsNone(m.extents(self.path('a.jpg')))
+        self.assertIsNotNone(m.extents(self.path('sub', 'c.jpg')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from s3dexp.scan_scheduler import build_extent_map, scan_order, schedule, seek_distance
+
+
+class ScanOrderTest(unittest.TestCase):
+
+    def test_sorted_by_physical_start(self):
+        extent_map = {
+            'c': [(0, 300, 10)],
+            'a': [(0, 100, 10)],
+            'b': [(0, 200, 10)],
+        }
+        self.assertEqual(scan_order(extent_map), ['a', 'b', 'c'])
+
+    def test_fragmented_file_moves_head_to_its_last_extent(self):
+        # a is read in logical order and leaves the head at 510: c is the closest ahead,
+        # then the scan wraps around to b
+        extent_map = {
+            'a': [(0, 100, 10), (10, 500, 10)],
+            'b': [(0, 200, 10)],
+            'c': [(0, 600, 10)],
+        }
+        self.assertEqual(scan_order(extent_map), ['a', 'c', 'b'])
+
+    def test_same_start(self):
+        extent_map = dict((str(i), [(0, 100, 10)]) for i in range(5))
+        self.assertEqual(sorted(scan_order(extent_map)), sorted(extent_map.keys()))
+
+    def test_empty(self):
+        self.assertEqual(scan_order({}), [])
+
+    def test_seek_distance(self):
+        extent_map = {
+            'a': [(0, 100, 10), (10, 500, 10)],
+            'b': [(0, 200, 10)],
+        }
+        # 110 -> 500 within a, then 510 -> 200
+        self.assertEqual(seek_distance(['a', 'b'], extent_map), 390 + 310)
+        # 210 -> 100, then 110 -> 500
+        self.assertEqual(seek_distance(['b', 'a'], extent_map), 110 + 390)
+
+    def test_scan_order_beats_input_order(self):
+        extent_map = dict(('f{}'.format(i), [(0, (i * 7919) % 1000 * 4096, 4096)]) for i in range(1000))
+        paths = sorted(extent_map.keys())
+        self.assertLess(seek_distance(scan_order(extent_map), extent_map), seek_distance(paths, extent_map))
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_unmapped_last_in_input_order(self):
+        extent_map = {
+            'a': [(0, 300, 10)],
+            'b': [],
+            'c': [(0, 100, 10)],
+        }
+        self.assertEqual(schedule(['a', 'x', 'b', 'c'], extent_map=extent_map), ['c', 'a', 'x', 'b'])
+
+    def test_build_extent_map(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'a.jpg')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(64 * 1024))
+            extent_map = build_extent_map([path], num_workers=1)
+            self.assertEqual(extent_map.keys(), [path])
+            # empty if the file system doesn't support FIEMAP
+            if extent_map[path]:
+                self.assertEqual(extent_map[path][0][0], 0)
+                self.assertEqual(sum(e[2] for e in extent_map[path]), 64 * 1024)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from s3dexp.search import Filter, FilterOrderOptimizer, _new_filter_stats, must_precede, required_attrs
+
+
+class _Filter(Filter):
+    def __init__(self, name, reads=(), writes=()):
+        super(_Filter, self).__init__(name)
+        self.name = name
+        self.reads = reads
+        self.writes = writes
+        self.downstream = None
+
+    def __call__(self, item):
+        return True
+
+    def set_downstream(self, filters):
+        self.downstream = [f.name for f in filters]
+
+
+def _measure(st, items, passed_items, wall_time):
+    st['items'] += items
+    st['passed_items'] += passed_items
+    st['wall_time'] += wall_time
+
+
+class DependencyTest(unittest.TestCase):
+
+    def test_must_precede(self):
+        decode = _Filter('decode', reads=('data', ), writes=('array', ))
+        color = _Filter('color', reads=('array', ))
+        size = _Filter('size', reads=('data', ))
+        self.assertTrue(must_precede(decode, color))
+        self.assertFalse(must_precede(decode, size))
+        self.assertFalse(must_precede(color, size))
+        # undeclared: keep the order
+        self.assertTrue(must_precede(_Filter('unknown', writes=None), size))
+        self.assertTrue(must_precede(size, _Filter('unknown', reads=None)))
+
+    def test_required_attrs(self):
+        decode = _Filter('decode', reads=('data', ), writes=('array', ))
+        color = _Filter('color', reads=('array', ))
+        self.assertEqual(required_attrs([decode, color]), set(['data']))
+        self.assertEqual(required_attrs([color]), set(['array']))
+        self.assertIsNone(required_attrs([decode, _Filter('unknown', reads=None)]))
+
+
+class FilterOrderOptimizerTest(unittest.TestCase):
+
+    def optimizer(self, filters, interval=10):
+        self.filter_stats = _new_filter_stats([f.name for f in filters])
+        return FilterOrderOptimizer(filters, self.filter_stats, interval)
+
+    def names(self, opt):
+        return [f.name for f in opt.chain]
+
+    def test_rank(self):
+        opt = self.optimizer([_Filter('a'), _Filter('b'), _Filter('c')])
+        # a: 1 ms, drops half -> 2; b: 1 ms, drops all -> 1; c: 0.1 ms, never drops -> inf
+        _measure(self.filter_stats[0], 100, 50, 0.1)
+        _measure(self.filter_stats[1], 100, 0, 0.1)
+        _measure(self.filter_stats[2], 100, 100, 0.01)
+        opt.tick(10)
+        self.assertEqual(self.names(opt), ['b', 'a', 'c'])
+
+    def test_every_interval(self):
+        opt = self.optimizer([_Filter('a'), _Filter('b')])
+        _measure(self.filter_stats[0], 100, 100, 1.)
+        _measure(self.filter_stats[1], 100, 0, 1.)
+        opt.tick(9)
+        self.assertEqual(self.names(opt), ['a', 'b'])
+        opt.tick(1)
+        self.assertEqual(self.names(opt), ['b', 'a'])
+
+    def test_unmeasured_first(self):
+        opt = self.optimizer([_Filter('a'), _Filter('b')])
+        _measure(self.filter_stats[0], 100, 0, 0.001)
+        opt.tick(10)
+        self.assertEqual(self.names(opt), ['b', 'a'])
+
+    def test_dependencies(self):
+        # color reads what the expensive decode writes: it may not move ahead of it
+        decode = _Filter('decode', reads=('data', ), writes=('array', ))
+        color = _Filter('color', reads=('array', ))
+        size = _Filter('size', reads=('data', ))
+        opt = self.optimizer([decode, color, size])
+        _measure(self.filter_stats[0], 100, 100, 10.)
+        _measure(self.filter_stats[1], 100, 0, 0.01)
+        _measure(self.filter_stats[2], 100, 50, 0.1)
+        opt.tick(10)
+        self.assertEqual(self.names(opt), ['size', 'decode', 'color'])
+
+    def test_set_downstream_after_reorder(self):
+        a, b, c = _Filter('a'), _Filter('b'), _Filter('c')
+        opt = self.optimizer([a, b, c])
+        _measure(self.filter_stats[0], 100, 100, 1.)
+        _measure(self.filter_stats[1], 100, 50, 1.)
+        _measure(self.filter_stats[2], 100, 0, 1.)
+        opt.tick(10)
+        self.assertEqual(self.names(opt), ['c', 'b', 'a'])
+        self.assertEqual(c.downstream, ['b', 'a'])
+        self.assertEqual(b.downstream, ['a'])
+        self.assertEqual(a.downstream, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
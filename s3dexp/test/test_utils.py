@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+import os
+import random
+import shutil
+import struct
+import tempfile
+import unittest
+
+from s3dexp.utils import get_video_keyframes, read_frames, video_segments, with_reference
+
+
+def _box(kind, *payload):
+    payload = ''.join(payload)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def _large_box(kind, *payload):
+    payload = ''.join(payload)
+    return struct.pack('>I4sQ', 1, kind, 16 + len(payload)) + payload
+
+
+def _trak(handler, *stbl):
+    hdlr = _box('hdlr', '\0' * 8, handler, '\0' * 12)
+    return _box('trak', _box('tkhd', '\0' * 84),
+                _box('mdia', _box('mdhd', '\0' * 24), hdlr, _box('minf', _box('stbl', *stbl))))
+
+
+def _stss(*sample_numbers):
+    return _box('stss', '\0' * 4, struct.pack('>I{}I'.format(len(sample_numbers)), len(sample_numbers), *sample_numbers))
+
+
+def _stsz(num_samples):
+    return _box('stsz', '\0' * 8, struct.pack('>I', num_samples), '\0' * 4 * num_samples)
+
+
+class GetVideoKeyframesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def keyframes(self, *boxes):
+        path = os.path.join(self.tmp_dir, 'a.mp4')
+        with open(path, 'wb') as f:
+            f.write(''.join(boxes))
+        return get_video_keyframes(path)
+
+    def test_stss(self):
+        ftyp = _box('ftyp', 'isom', '\0' * 8)
+        mdat = _box('mdat', '\0' * 1000)
+        moov = _box('moov', _box('mvhd', '\0' * 100),
+                    _trak('soun', _stss(1, 2, 3), _stsz(3)),
+                    _trak('vide', _stsz(100), _stss(1, 31, 61, 91)))
+        self.assertEqual(self.keyframes(ftyp, mdat, moov), [0, 30, 60, 90])
+        # moov first, mdat with a 64-bit size
+        self.assertEqual(self.keyframes(ftyp, moov, _large_box('mdat', '\0' * 1000)), [0, 30, 60, 90])
+
+    def test_all_sync_samples(self):
+        moov = _box('moov', _trak('vide', _stsz(5)))
+        self.assertEqual(list(self.keyframes(moov)), [0, 1, 2, 3, 4])
+
+    def test_no_video_track(self):
+        moov = _box('moov', _trak('soun', _stss(1), _stsz(3)))
+        self.assertIsNone(self.keyframes(moov))
+
+    def test_not_mp4(self):
+        self.assertIsNone(self.keyframes('RIFF\0\0\0\0AVI LIST'))
+        self.assertIsNone(self.keyframes(''))
+
+
+def _write_clip(path, num_frames=200, size=(64, 48)):
+    # a panning texture, so that the encoder makes P-frames between key frames (every 12 frames)
+    w, h = size
+    texture = np.random.RandomState(0).randint(0, 256, (h // 2, (w + num_frames) // 2, 3)).astype(np.uint8)
+    texture = cv2.resize(texture, (w + num_frames, h))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25, size)
+    for i in range(num_frames):
+        writer.write(np.ascontiguousarray(texture[:, i:i + w]))
+    writer.release()
+
+
+def _decode(path, every=1, start=0, end=None, keyframes=None):
+    cap = cv2.VideoCapture(path)
+    frames = list(read_frames(cap, every, start, end, keyframes))
+    cap.release()
+    return frames
+
+
+class VideoTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, 'clip.mp4')
+        _write_clip(cls.path)
+        if not cv2.VideoCapture(cls.path).isOpened():
+            shutil.rmtree(cls.tmp_dir)
+            raise unittest.SkipTest("OpenCV cannot write MPEG-4 video")
+        cls.frames = _decode(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_read_frames(self):
+        self.assertEqual([frame_id for _, frame_id in self.frames], range(200))
+        frames = _decode(self.path, every=10, start=20, end=75)
+        self.assertEqual([frame_id for _, frame_id in frames], range(20, 75, 10))
+        for frame, frame_id in frames:
+            self.assertTrue(np.array_equal(frame, self.frames[frame_id][0]), frame_id)
+
+    def test_read_segments_with_seek(self):
+        keyframes = get_video_keyframes(self.path)
+        # segments end at key frames, which are also wanted frames when every is a multiple of the GOP (12)
+        for every, segment_frames in [(60, 50), (30, 50), (24, 30), (10, 50), (25, 12), (1, 50)]:
+            expected = [frame_id for _, frame_id in self.frames if frame_id % every == 0]
+            frames = []
+            for start, end in video_segments(self.path, segment_frames):
+                frames.extend(_decode(self.path, every, start, end, keyframes))
+            self.assertEqual([frame_id for _, frame_id in frames], expected, (every, segment_frames))
+            for frame, frame_id in frames:
+                self.assertTrue(np.array_equal(frame, self.frames[frame_id][0]), (every, segment_frames, frame_id))
+
+    def test_video_segments(self):
+        keyframes = get_video_keyframes(self.path)
+        self.assertEqual(keyframes, range(0, 200, 12))
+        segments = video_segments(self.path, segment_frames=50)
+        self.assertEqual(segments, [(0, 60), (60, 120), (120, 180), (180, None)])
+        self.assertEqual(video_segments(self.path, segment_frames=1000), [(0, None)])
+
+
+def _sliding_window(frame_ids, delta_frames):
+    # what the producer did before frames could arrive out of order: a window of the decoded frames
+    window = []
+    for frame_id in frame_ids:
+        window.append(frame_id)
+        yield frame_id, frame_id, window.pop(0) if frame_id > delta_frames else None
+
+
+class WithReferenceTest(unittest.TestCase):
+
+    def pairs(self, frame_ids, delta_frames, every):
+        # frames are their ids
+        gen = ((frame_id, frame_id) for frame_id in frame_ids)
+        return list(with_reference(gen, delta_frames, every))
+
+    def test_in_order(self):
+        for delta_frames, every in [(30, 10), (2, 1), (5, 2), (0, 1)]:
+            frame_ids = range(0, 100, every)
+            self.assertEqual(self.pairs(frame_ids, delta_frames, every),
+                             list(_sliding_window(frame_ids, delta_frames)), (delta_frames, every))
+
+    def test_out_of_order(self):
+        rnd = random.Random(0)
+        frame_ids = range(0, 300, 10)
+        # segments decoded in parallel finish in any order
+        segments = [frame_ids[i:i + 5] for i in range(0, len(frame_ids), 5)]
+        rnd.shuffle(segments)
+        shuffled = sum(segments, [])
+        pairs = self.pairs(shuffled, 30, 10)
+        self.assertEqual(sorted(pairs), list(_sliding_window(frame_ids, 30)))
+
+    def test_missing_reference(self):
+        # frame 10 never arrives: frame 30 is still yielded, without a reference
+        pairs = self.pairs([0, 20, 30, 40], 15, 10)
+        self.assertEqual(sorted(pairs), [(0, 0, None), (20, 20, 0), (30, 30, None), (40, 40, 20)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import bisect
+import ctypes
+import ctypes.util
 import cv2
 import fnmatch
 import os
+import struct
+import time
 
 from s3dexp.fiemap import fiemap2, FIEMAP_FLAG_SYNC
 
@@ -22,4 +27,180 @@ def get_num_video_frames(path):
     cap = cv2.VideoCapture(path)
     frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
     cap.release()
-    return int(frames)
\ No newline at end of file
+    return int(frames)
+
+
+def _mp4_boxes(f, start, end):
+    # yield (type, payload start, end) of the boxes in [start, end)
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size, = struct.unpack('>Q', f.read(8))
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _mp4_child(f, box, kind):
+    for k, start, end in _mp4_boxes(f, box[0], box[1]):
+        if k == kind:
+            return start, end
+    return None
+
+
+def get_video_keyframes(path):
+    """Frame ids of the key frames of an MP4 video, read from the sync sample table ('stss' box) of its video track.
+    Returns None if the file has no such track, e.g., not an MP4 or a fragmented one.
+    """
+    with open(path, 'rb') as f:
+        moov = _mp4_child(f, (0, os.path.getsize(path)), 'moov')
+        if moov is None:
+            return None
+        for kind, start, end in _mp4_boxes(f, moov[0], moov[1]):
+            if kind != 'trak':
+                continue
+            mdia = _mp4_child(f, (start, end), 'mdia')
+            hdlr = mdia and _mp4_child(f, mdia, 'hdlr')
+            if hdlr is None:
+                continue
+            f.seek(hdlr[0] + 8)  # version/flags, pre_defined
+            if f.read(4) != 'vide':
+                continue
+            minf = _mp4_child(f, mdia, 'minf')
+            stbl = minf and _mp4_child(f, minf, 'stbl')
+            if stbl is None:
+                return None
+            stss = _mp4_child(f, stbl, 'stss')
+            if stss is None:
+                # no sync sample table: every sample is a key frame
+                stsz = _mp4_child(f, stbl, 'stsz')
+                if stsz is None:
+                    return None
+                f.seek(stsz[0] + 8)     # version/flags, sample_size
+                num_samples, = struct.unpack('>I', f.read(4))
+                return range(num_samples)
+            f.seek(stss[0] + 4)     # version/flags
+            num_entries, = struct.unpack('>I', f.read(4))
+            # sample numbers are 1-based
+            return [n - 1 for n in struct.unpack('>{}I'.format(num_entries), f.read(4 * num_entries))]
+    return None
+
+
+def read_frames(cap, every=1, start=0, end=None, keyframes=None, alloc=None):
+    """Yield (frame, frame_id) of every `every`-th frame in [start, end) from an opened cv2.VideoCapture.
+    Skipped frames are only grabbed, not retrieved (color converted).
+    If given, `alloc()` returns the HxWx3 uint8 array to retrieve the next frame into.
+    Given the key frame ids, jumps to the key frame preceding the next wanted frame when that is ahead
+    and grabbing the frames in between is measured to take longer on average than seeking.
+    The first seek is tried once a whole GOP can be skipped."""
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_id = start    # of the next frame to grab
+    grab_time = seek_time = 0.  # total
+    num_grabs = num_seeks = 0
+    while end is None or frame_id < end:
+        tic = time.time()
+        seeked = False
+        wanted = (frame_id + every - 1) // every * every
+        if end is not None and wanted >= end:
+            # no wanted frame left in range. Also keeps the seek below from jumping to a key frame at or past end
+            break
+        if keyframes:
+            i = bisect.bisect_right(keyframes, wanted) - 1
+            if i >= 0 and keyframes[i] > frame_id:
+                if num_seeks == 0:
+                    seeked = i > 0 and keyframes[i-1] > frame_id
+                else:
+                    seeked = (keyframes[i] - frame_id) * grab_time / max(num_grabs, 1) > seek_time / num_seeks
+            if seeked:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, keyframes[i])
+                frame_id = keyframes[i]
+        if not cap.grab():
+            break
+        elapsed = time.time() - tic
+        if seeked:
+            seek_time += elapsed
+            num_seeks += 1
+        else:
+            grab_time += elapsed
+            num_grabs += 1
+        if frame_id % every == 0:
+            ret, frame = cap.retrieve(alloc()) if alloc else cap.retrieve()
+            if not ret:
+                break
+            yield frame, frame_id
+        frame_id += 1
+
+
+def video_segments(path, segment_frames=300):
+    """Split a video into (start, end) frame ranges of about `segment_frames` each that start at key frames,
+    so that each can be decoded independently. end is None for the last one.
+    Without key frame info, splits evenly; seeking then decodes from the preceding key frame.
+
+    Key frame ids come from the MP4 sync sample table, which numbers samples in decode order,
+    whereas OpenCV counts frames in presentation order. The two agree at the key frames of closed-GOP streams.
+    With B-frames and open GOPs, a segment may start a few frames off its key frame. The frames are still right,
+    because seeking decodes from the preceding key frame, but the decoding is less independent."""
+    keyframes = get_video_keyframes(path)
+    if keyframes is None:
+        keyframes = range(0, get_num_video_frames(path), segment_frames)
+    starts = [0]
+    for k in keyframes:
+        if k - starts[-1] >= segment_frames:
+            starts.append(k)
+    return zip(starts, starts[1:] + [None])
+
+
+def with_reference(gen, delta_frames, every=1):
+    """Pair each (frame, frame_id) from `gen` with its reference for the diff detector: the frame `delta_frames` earlier,
+    rounded up to a decoded one, or None for the first `delta_frames`. Frames may arrive out of order;
+    a frame is held until its reference arrives."""
+    lag = (delta_frames // every + 1) * every
+    frames = {}     # frame_id -> frame, until used as a reference
+    waiting = {}    # frame_id -> frame, whose reference hasn't arrived
+    for frame, frame_id in gen:
+        frames[frame_id] = frame
+        if frame_id <= delta_frames:
+            yield frame, frame_id, None
+        elif frame_id - lag in frames:
+            yield frame, frame_id, frames.pop(frame_id - lag)
+        else:
+            waiting[frame_id] = frame
+        if frame_id + lag in waiting:
+            yield waiting.pop(frame_id + lag), frame_id + lag, frames.pop(frame_id)
+    for frame_id in sorted(waiting):
+        yield waiting[frame_id], frame_id, None
+
+
+# From linux/time.h
+CLOCK_THREAD_CPUTIME_ID = 3
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_clock_gettime = None
+
+def thread_cputime():
+    """CPU time (seconds) consumed by the calling thread only.
+    Unlike time.clock(), this is not inflated by other threads of the process,
+    e.g., other search workers' threads or I/O threads."""
+    global _clock_gettime
+    if hasattr(time, 'clock_gettime'):
+        return time.clock_gettime(CLOCK_THREAD_CPUTIME_ID)
+    if _clock_gettime is None:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        _clock_gettime = librt.clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    ts = _timespec()
+    if _clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(ts)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return ts.tv_sec + ts.tv_nsec * 1e-9
@@ -0,0 +1,61 @@
+import logging
+import multiprocessing as mp
+import time
+
+import fire
+import logzero
+from logzero import logger
+
+from s3dexp.search import Context, Filter, FilterConfig, SharedContext, run_search
+
+logzero.loglevel(logging.WARN)
+
+
+class NoopFilter(Filter):
+    reads = ()
+    writes = ()
+
+    def __init__(self):
+        super(NoopFilter, self).__init__()
+
+    def __call__(self, item):
+        return True
+
+
+def _items_per_sec(filter_configs, num_workers, paths, context, batch_size):
+    tic = time.time()
+    run_search(filter_configs, num_workers, paths, context, batch_size=batch_size)
+    elapsed = time.time() - tic
+    assert int(context.stats['num_items']) == len(paths), str(context.stats)
+    return len(paths) / elapsed
+
+
+def run(num_items=100000, workers=(1, 2, 4, 8, 16, 32, 64), batch_size=1, chain_len=3):
+    """Measure items/s of a no-op filter chain with the Manager-based Context vs. SharedContext.
+    
+    Keyword Arguments:
+        num_items {int} -- number of fake paths to push through (default: {100000})
+        workers {tuple} -- worker counts to sweep (default: {(1, 2, 4, 8, 16, 32, 64)})
+        batch_size {int} -- passed to run_search (default: {1})
+        chain_len {int} -- number of no-op filters in the chain (default: {3})
+    """
+    if isinstance(workers, int):
+        workers = (workers, )
+    paths = ['/fake/{:08d}.jpg'.format(i) for i in range(num_items)]
+    filter_configs = [FilterConfig(NoopFilter) for _ in range(chain_len)]
+
+    print("{:>8} {:>16} {:>16}".format('workers', 'manager items/s', 'shared items/s'))
+    for n in workers:
+        results = []
+        for shared in (False, True):
+            if shared:
+                results.append(_items_per_sec(filter_configs, n, paths, SharedContext(), batch_size))
+            else:
+                # one Manager process per sweep point, shut down when done
+                with mp.Manager() as manager:
+                    results.append(_items_per_sec(filter_configs, n, paths, Context(manager), batch_size))
+        print("{:>8} {:>16.0f} {:>16.0f}".format(n, *results))
+
+
+if __name__ == '__main__':
+    fire.Fire(run)
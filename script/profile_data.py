@@ -11,7 +11,7 @@ import time
 from s3dexp import this_hostname
 import s3dexp.db.utils as dbutils
 import s3dexp.db.models as models
-from s3dexp.utils import recursive_glob
+from s3dexp.manifest import load_manifest
 
 
 def _get_meta(path):
@@ -27,15 +27,16 @@ def image_meta(base_dir, ext='jpg', num_workers=16):
     
     pool = mp.Pool(num_workers)
 
-    for path, format, size, width, height in pool.imap(_get_meta, recursive_glob(base_dir, '*.{}'.format(ext)), 64):
-        dbutils.insert_or_update_one(
-            sess, models.ImageMeta,
-            {'path': path},
-            {'format': format, 'size': size, 'width': width, 'height': height}
-        )
+    results = []
+    for path, format, size, width, height in pool.imap(_get_meta, load_manifest(base_dir, ext).paths, 64):
+        results.append({
+            'keys_dict': {'path': path},
+            'vals_dict': {'format': format, 'size': size, 'width': width, 'height': height}
+        })
 
         logger.info("Read {}".format(path))
 
+    dbutils.bulk_insert_or_update(sess, models.ImageMeta, results)
     sess.commit()
     sess.close()
 
@@ -43,10 +44,11 @@ def image_meta(base_dir, ext='jpg', num_workers=16):
 def disk_read(base_dir, disk, ext='jpg', sort_inode=False, store_result=True):
     logger.warn("Make sure you cleaned the OS page buffer!")
     base_dir = os.path.realpath(base_dir)
-    paths = list(recursive_glob(base_dir, '*.{}'.format(ext)))
+    manifest = load_manifest(base_dir, ext)
+    paths = manifest.paths
 
     if sort_inode:
-        paths = sorted(paths, key=lambda p: os.stat(p).st_ino)
+        paths = sorted(paths, key=manifest.ino)
         logger.info("Sort by inode num.")
     else:
         # deterministic pseudo-random
@@ -81,20 +83,16 @@ def disk_read(base_dir, disk, ext='jpg', sort_inode=False, store_result=True):
     if store_result:
         logger.info("Going to write {} results to DB".format(len(results)))
         sess = dbutils.get_session()
-        for r in results:
-            dbutils.insert_or_update_one(
-                sess, models.DiskReadProfile,
-                keys_dict=r['keys_dict'],
-                vals_dict=r['vals_dict']
-            )
+        dbutils.bulk_insert_or_update(sess, models.DiskReadProfile, results)
         sess.commit()
         sess.close()
 
 
 def decode_time(base_dir, ext='jpg', repeat=3):
     sess = dbutils.get_session()
+    results = []
 
-    for path in recursive_glob(base_dir, '*.{}'.format(ext)):
+    for path in load_manifest(base_dir, ext).paths:
         with open(path, 'rb') as f:
             buf = f.read()
 
@@ -118,12 +116,9 @@ def decode_time(base_dir, ext='jpg', repeat=3):
         }
         logger.debug(str(vals_dict))
 
-        dbutils.insert_or_update_one(
-            sess, models.DecodeProfile,
-            keys_dict=keys_dict,
-            vals_dict=vals_dict
-        )
+        results.append({'keys_dict': keys_dict, 'vals_dict': vals_dict})
 
+    dbutils.bulk_insert_or_update(sess, models.DecodeProfile, results)
     sess.commit()
     sess.close()
 
@@ -64,25 +64,23 @@ def run_face(base_dir, ext='jpg', store_results=False):
         logger.info("Writing {} results to DB".format(len(results)))
         sess = dbutils.get_session()
         logger.debug(sess)
+        records = []
         for r in results:
             keys_dict={'path': r['path'], 'basename': os.path.basename(r['path']), 
                         'expname': 'face_detection', 
                         'device': 'cpu',
                         'disk': 'hdd'}
-            
-            dbutils.insert_or_update_one(
-                sess, dbmodels.FaceExp,
-                keys_dict=keys_dict,
-                vals_dict={ 'read_ms': r['read_ms'], 
-                            'decode_ms': r['decode_ms'], 
-                            'total_ms': r['total_ms'],
-                            'size': r['size'], 
-                            'height': r['height'], 
-                            'width': r['width'], 
-                            'num_faces': r['num_faces'],
-                            'box': r['box']
-                            }
-            )
+            vals_dict={ 'read_ms': r['read_ms'], 
+                        'decode_ms': r['decode_ms'], 
+                        'total_ms': r['total_ms'],
+                        'size': r['size'], 
+                        'height': r['height'], 
+                        'width': r['width'], 
+                        'num_faces': r['num_faces'],
+                        'box': r['box']
+                        }
+            records.append({'keys_dict': keys_dict, 'vals_dict': vals_dict})
+        dbutils.bulk_insert_or_update(sess, dbmodels.FaceExp, records)
         sess.commit()
         sess.close()
 
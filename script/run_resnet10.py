@@ -29,9 +29,10 @@ from s3dexp.filter.decoder import DecodeFilter
 from s3dexp.filter.reader import SimpleReadFilter
 from s3dexp.filter.smart_storage import *
 from s3dexp.kinetic.filter import *
-from s3dexp.search import Context, Filter, FilterConfig, run_search
+from s3dexp.manifest import load_manifest
+from s3dexp.ringbuffer import SharedArrayRing
+from s3dexp.search import Context, Filter, FilterConfig, Item, run_search
 from s3dexp.sim.client import SmartStorageClient
-from s3dexp.utils import recursive_glob, get_fie_physical_start
 
 RESOL = (65, 65)
 
@@ -166,15 +167,33 @@ class PytorchResNet(nn.Module):
 
 
 class TransformAndSendFilter(Filter):
+    reads = (Item.ARRAY, )
+    writes = ()
 
     def __init__(self, transform_fn, out_q, resize_to=RESOL):
+        """Resize, transform and send decoded images to the consumer through `out_q`.
+        If `out_q` is a SharedArrayRing of uint8 HxWx3 slots, the resized image is written straight into a slot
+        and `transform_fn` is left to the consumer, which runs it on whole batches.
+        """
         super(TransformAndSendFilter, self).__init__(transform_fn, out_q)
+        assert resize_to or not isinstance(out_q, SharedArrayRing), "Slots have a fixed size"
         self.transform_fn = transform_fn
         self.out_q = out_q
         self.resize_to = resize_to
 
     def __call__(self, item):
         import cv2
+        if isinstance(self.out_q, SharedArrayRing):
+            # resize into shared memory instead of pickling a tensor
+            slot_id, view = self.out_q.acquire()
+            try:
+                cv2.resize(item.array, self.resize_to, dst=view)
+            except:
+                self.out_q.release(slot_id)
+                raise
+            self.out_q.commit(slot_id)
+            return True
+
         if self.resize_to:
             arr = cv2.resize(item.array, self.resize_to)
         else:
@@ -191,7 +210,7 @@ def main(
     base_dir='/home/zf/activedisk/data/flickr15k/', ext='.jpg', sort=None, 
     num_cores=8, workers_per_core=1,
     smartsim=False, kinetic=False, kproxy=False,
-    batch_size=64,
+    batch_size=64, shm=False,
     store_result=False, expname=None, verbose=False, ):
 
     if verbose:
@@ -213,11 +232,11 @@ def main(
     # prepare and sort paths
     assert sort in (None, 'fie', 'name')
     base_dir = str(pathlib.Path(base_dir).resolve())
-    paths = list(filter(lambda p: p.suffix == ext, pathlib.Path(base_dir).rglob('*')))
-    paths = list(map(str, paths))
+    manifest = load_manifest(base_dir, ext, fie=(sort == 'fie'))
+    paths = manifest.paths
     if sort == 'fie':
         logger.info("Sort paths by FIE")
-        paths = sorted(paths, key=get_fie_physical_start)
+        paths = sorted(paths, key=manifest.fie)
     elif sort == 'name':
         logger.info("Sort paths by name")
         paths = sorted(paths, key=lambda p: pathlib.Path(p).name)
@@ -255,7 +274,21 @@ def main(
     ])
 
     # Queue to collect decoded and preprocessed samples
-    preprocessed_q = mp.Queue()
+    if shm:
+        logger.info("Using shared memory ring to collect samples")
+        # resized uint8 HxWx3 images. ToTensor() and normalize run on the GPU on whole batches
+        preprocessed_q = SharedArrayRing(4 * batch_size, (RESOL[1], RESOL[0], 3), np.uint8)
+        gpu_mean = torch.tensor(normalize.mean, dtype=torch.float32).view(1, 3, 1, 1).cuda()
+        gpu_std = torch.tensor(normalize.std, dtype=torch.float32).view(1, 3, 1, 1).cuda()
+    else:
+        preprocessed_q = mp.Queue()
+
+    def get_sample():
+        if shm:
+            slot_id, view, _ = preprocessed_q.get()
+            return slot_id, torch.from_numpy(view)
+        else:
+            return None, preprocessed_q.get()
 
     # prepare the filter chain
     if smartsim:
@@ -302,8 +335,15 @@ def main(
     search_thread.start()
 
     for batch_id in tqdm(range(int(len(paths)/batch_size))):
-        image_tensor = torch.stack([preprocessed_q.get() for _ in range(batch_size)])
+        slot_ids, samples = zip(*[get_sample() for _ in range(batch_size)])
+        image_tensor = torch.stack(samples)
+        if shm:
+            # torch.stack has copied the data out of the slots
+            map(preprocessed_q.release, slot_ids)
         image_tensor = image_tensor.cuda()
+        if shm:
+            # NHWC uint8 -> NCHW float in [0, 1], normalized, as preprocess does per image
+            image_tensor = image_tensor.permute(0, 3, 1, 2).float().div_(255.).sub_(gpu_mean).div_(gpu_std)
         # print image_tensor.shape, image_tensor.dtype
 
         tic_gpu = time.time()
@@ -319,7 +359,9 @@ def main(
 
     # flush the last batch
     for _ in range(len(paths) - num_batches * batch_size):
-        preprocessed_q.get()
+        slot_id, _ = get_sample()
+        if shm:
+            preprocessed_q.release(slot_id)
 
     elapsed = time.time() - tic
     elapsed_cpu = time.clock() - tic_cpu
@@ -14,6 +14,7 @@ import psutil
 import yaml
 
 from s3dexp import this_hostname
+from s3dexp import scan_scheduler
 import s3dexp.db.utils as dbutils
 import s3dexp.db.models as dbmodles
 from s3dexp.filter.bgd_subtract import BackgroundSubtractionFilter
@@ -23,12 +24,14 @@ from s3dexp.filter.decoder import DecodeFilter
 from s3dexp.filter.facedetector import FaceDetectorFilter, ObamaDetectorFilter
 from s3dexp.filter.image_hash import ImageHashFilter
 from s3dexp.filter.object_detection import ObjectDetectionFilter
-from s3dexp.filter.reader import SimpleReadFilter
+from s3dexp.filter.reader import PrefetchReadFilter, SimpleReadFilter
 from s3dexp.filter.rgbhist import RGBHist1dFilter, RGBHist2dFilter, RGBHist3dFilter
-from s3dexp.filter.smart_storage import SmartReadFilter, SmartDecodeFilter, SmartFaceFilter
+from s3dexp.filter.smart_storage import OffloadFilter, SmartReadFilter, SmartDecodeFilter, SmartFaceFilter
 from s3dexp.kinetic.filter import *
-from s3dexp.search import Context, FilterConfig, run_search
-from s3dexp.utils import recursive_glob, get_fie_physical_start
+from s3dexp.manifest import load_manifest
+from s3dexp.search import Context, FilterConfig, SharedContext, dump_filter_stats, format_filter_stats, run_search
+from s3dexp.smart.emcpu import ProcessDilator, dilate_filter_configs
+from s3dexp.smart.emdevice import EmDevice
 
 logzero.loglevel(logging.INFO)
 
@@ -42,9 +45,13 @@ CPU_START = (0+4, 36+4)    # pin on NUMA node 0
 
 def run(
     search_file, base_dir, ext='.jpg', num_cores=8, workers_per_core=1,
-    store_result=False, expname=None, sort=None, 
-    verbose=False):
+    store_result=False, expname=None, sort=None, batch_size=1, shared_context=False,
+    manifest_path=None, dilate_ghz=None, dilate_cores=1, reorder_interval=None, filter_stats_file=None, filter_bytes=False, verbose=False):
     """Run a search consisting of a filter chain defined in an input 'search file'
+
+    A prefix of the filters can be marked `device: true` in the search file to run them on an emulated smart storage device
+    (see s3dexp.smart.emdevice). The device is configured by an optional top-level `device:` section
+    with the keyword arguments of EmDevice, e.g., cpu_ghz, cpu_cores, bus_mbyteps.
     
     Arguments:
         search_file {str} -- path to a yml file
@@ -57,6 +64,14 @@ def run(
         store_result {bool} -- whether store measurements to DB (default: {False})
         expname {[type]} -- expname in DB. If not provided, will try to use from search_file (default: {None})
         sort {str or None} -- sort the paths by 'fie' (Linux FIE), 'name' (file name), or None (random)
+        manifest_path {str} -- where to keep the file manifest of base_dir, including the extents for sort='fie' (default: {None}, under S3DEXP_MANIFEST_DIR)
+        batch_size {int} -- number of paths a worker dequeues at once and passes to Filter.call_batch() (default: {1})
+        shared_context {bool} -- distribute work through shared memory instead of a Manager queue (default: {False})
+        dilate_ghz {float} -- run the filter chain as if on a slower CPU of this clock speed, e.g., a disk's ARM cores (default: {None})
+        dilate_cores {int} -- number of cores of that CPU, shared by all workers (default: {1})
+        reorder_interval {int} -- reorder commutable filters by measured cost and pass rate every so many items per worker (default: {None}, keep the order in search_file)
+        filter_stats_file {str} -- dump per-filter stats to this .json or .csv file (default: {None})
+        filter_bytes {bool} -- also count the bytes each filter reads and writes in the per-filter stats. Adds overhead per call (default: {False})
         verbose {bool} -- [description] (default: {False})
     """
 
@@ -83,19 +98,31 @@ def run(
 
     # prepare filter configs
     filter_configs = []
+    num_device_filters = 0
     for el in search_conf['filters']:
         filter_cls = globals()[el['filter']]
         fc = FilterConfig(filter_cls, args=el.get('args', []), kwargs=el.get('kwargs', {}))
         filter_configs.append(fc)
+        if el.get('device', False):
+            assert num_device_filters == len(filter_configs) - 1, "Only a prefix of filters can run on the device: {}".format(el['filter'])
+            num_device_filters += 1
+    if dilate_ghz:
+        logger.info("Dilating host filters to {} cores at {} GHz".format(dilate_cores, dilate_ghz))
+        filter_configs[num_device_filters:] = dilate_filter_configs(filter_configs[num_device_filters:], ProcessDilator(dilate_ghz, dilate_cores))
+    device = None
+    if num_device_filters:
+        device = EmDevice(filter_configs[:num_device_filters], num_clients=num_cores * workers_per_core, **search_conf.get('device', {}))
+        logger.info("Running {} filters on {}".format(num_device_filters, device))
+        filter_configs = [FilterConfig(OffloadFilter, args=[device])] + filter_configs[num_device_filters:]
 
     # prepare and sort paths
     assert sort in (None, 'fie', 'name')
     base_dir = str(pathlib.Path(base_dir).resolve())
-    paths = list(filter(lambda p: p.suffix == ext, pathlib.Path(base_dir).rglob('*')))
-    paths = list(map(str, paths))
+    manifest = load_manifest(base_dir, ext, manifest_path)
+    paths = manifest.paths
     if sort == 'fie':
         logger.info("Sort paths by FIE")
-        paths = sorted(paths, key=get_fie_physical_start)
+        paths = scan_scheduler.schedule(paths, manifest=manifest)
     elif sort == 'name':
         logger.info("Sort paths by name")
         paths = sorted(paths, key=lambda p: pathlib.Path(p).name)
@@ -107,16 +134,27 @@ def run(
     logger.info("Find {} files under {}".format(len(paths), base_dir))
 
     # create shared data structure by workers
-    manager = mp.Manager()
-    context = Context(manager)
+    if shared_context:
+        context = SharedContext()
+    else:
+        manager = mp.Manager()
+        context = Context(manager)
 
     # run the search with parallel workers
+    if device:
+        device.start()
     tic = time.time()
-    run_search(filter_configs, num_cores * workers_per_core, paths, context)
+    run_search(filter_configs, num_cores * workers_per_core, paths, context, batch_size=batch_size, reorder_interval=reorder_interval, filter_bytes=filter_bytes)
     elapsed = time.time() - tic
+    if device:
+        device.stop()
 
     logger.info("End-to-end elapsed time {:.3f} s".format(elapsed))
     logger.info(str(context.stats))
+    filter_stats = context.stats['filters']
+    logger.info("Per-filter stats:\n" + format_filter_stats(filter_stats))
+    if filter_stats_file:
+        dump_filter_stats(filter_stats, filter_stats_file)
 
     keys_dict={'expname': expname, 'basedir': base_dir, 'ext': ext, 'num_workers': num_cores, 'hostname': this_hostname}
     vals_dict={
@@ -125,6 +163,9 @@ def run(
                     'avg_cpu_ms': 1e3 * context.stats['cpu_time'] / context.stats['num_items'],
                     'avg_mbyteps': context.stats['bytes_from_disk'] * 1e-6 / elapsed,
                 }
+    if context.stats['io_active_s'] > 0:
+        vals_dict['io_depth'] = context.stats['io_busy_s'] / context.stats['io_active_s']
+        vals_dict['io_mbyteps'] = context.stats['io_bytes'] * 1e-6 / context.stats['io_active_s']
 
     logger.info(json.dumps(keys_dict))
     logger.info(json.dumps(vals_dict))
@@ -132,6 +173,7 @@ def run(
 
     if store_result:
         logger.warn("Writing result to DB expname={}".format(expname))
+        vals_dict['filter_stats'] = json.dumps(filter_stats)
         sess = dbutils.get_session()
         dbutils.insert_or_update_one(
             sess, 
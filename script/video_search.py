@@ -1,8 +1,11 @@
+import collections
 import cv2
+import itertools
 import fire
 import logging
 import logzero
 from logzero import logger
+import multiprocessing as mp
 import numpy as np
 import os
 import psutil
@@ -11,12 +14,14 @@ import threading
 import time
 
 from s3dexp import this_hostname
+from s3dexp.diff import mse
 import s3dexp.db.utils as dbutils
 import s3dexp.db.models as dbmodles
 from s3dexp.filter.object_detection import ObjectDetectionFilter
+from s3dexp.ringbuffer import SharedArrayRing
 from s3dexp.search import Item
 from s3dexp.sim.client import SmartStorageClient
-from s3dexp.utils import recursive_glob, get_num_video_frames
+from s3dexp.utils import recursive_glob, get_num_video_frames, get_video_keyframes, read_frames, video_segments, with_reference
 
 logzero.loglevel(logging.INFO)
 
@@ -36,27 +41,17 @@ class Context(object):
             num_workers=0,
             passed_items=0,
             bytes_from_disk=0,
+            num_frames=0,
         )
 
-def mse(arr1, arr2):
-    # Mean Squre Error between two images
-    assert isinstance(arr1, np.ndarray) and isinstance(arr2, np.ndarray)
-    assert arr1.shape == arr2.shape, "{}, {}".format(arr1.shape, arr2.shape)
-    # return np.mean((arr1.astype(np.float) - arr2.astype(np.float))**2)
-
-    sum_squared_error = 0.
-    X_CHUNKSIZE = 40    # empirically chose. Too small -> high GIL overhead. Too large -> large memory writes.
-    for x in range(0, arr1.shape[0], X_CHUNKSIZE):
-        sum_squared_error += np.sum((arr1[x:x+X_CHUNKSIZE,:,:].astype(np.float) - arr2[x:x+X_CHUNKSIZE,:,:].astype(np.float))**2)
-    return sum_squared_error / arr1.size
-
-
 class DiffAndDetector(object):
     """NOT conforming to the Filter interface"""
-    def __init__(self, diff_threshold=1000., detect=False, *args, **kwargs):
+    def __init__(self, diff_threshold=1000., detect=False, diff_threads=1, diff_scale=None, *args, **kwargs):
         super(DiffAndDetector, self).__init__()
         self.diff_threshold = diff_threshold
         self.detect = detect
+        self.diff_threads = diff_threads
+        self.diff_scale = diff_scale
         if self.detect:
             self.detect_filter = ObjectDetectionFilter(*args, **kwargs)
 
@@ -75,7 +70,7 @@ class DiffAndDetector(object):
         Returns:
             bool -- Pass or not.
         """
-        accept = (reference is None) or (mse(item.array, reference) >= self.diff_threshold)
+        accept = (reference is None) or (mse(item.array, reference, self.diff_threads, self.diff_scale) >= self.diff_threshold)
         if accept and self.detect:
             accept = self.detect_filter(item)
         return accept
@@ -110,20 +105,139 @@ def worker(context, *args, **kwargs):
         context.stats['passed_items'] += count_accept
 
 
-def cv2_decoder(path, context, every=1):
+def cv2_decoder(path, context, every=1, seek=False):
     cap = cv2.VideoCapture(path)
-    frame_id = 0
+    keyframes = get_video_keyframes(path) if seek and every > 1 else None
+    for frame, frame_id in read_frames(cap, every, keyframes=keyframes):
+        yield frame, frame_id
+    cap.release()
+    with context.lock:
+        context.stats['bytes_from_disk'] += os.path.getsize(path)
+
+
+def _decoder_main(tasks, ring):
+    # runs in a decoder process of FrameDecoderPool
     while True:
-        ret, frame = cap.read()
-        if ret:
-            if frame_id % every == 0:
-                yield frame, frame_id
-            frame_id += 1
-            continue
-        else:
+        task = tasks.get()
+        if task is None:
             break
-    cap.release()
-    context.stats['bytes_from_disk'] += os.path.getsize(path)
+        task_id, path, start, end, every, seek = task
+        slot = [None]   # acquired but not yet committed
+
+        def alloc():
+            slot[0], buf = ring.acquire()
+            return buf[:h * w * 3].reshape(h, w, 3)
+
+        error = None
+        try:
+            cap = cv2.VideoCapture(path)
+            w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            assert h * w * 3 <= ring.shape[0], "{}x{} exceeds max_resolution: {}".format(w, h, path)
+            keyframes = get_video_keyframes(path) if seek and every > 1 else None
+            for frame, frame_id in read_frames(cap, every, start, end, keyframes, alloc=alloc):
+                if frame.ctypes.data != ring.view(slot[0]).ctypes.data:
+                    # OpenCV didn't decode in place
+                    ring.view(slot[0])[:frame.size] = frame.reshape(-1)
+                ring.commit(slot[0], (task_id, frame_id, frame.shape))
+                slot[0] = None
+            cap.release()
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        if slot[0] is not None:
+            ring.release(slot[0])
+        ring.commit(None, (task_id, None, error))
+
+
+class FrameDecoderPool(object):
+    """Processes that decode video segments (see video_segments()) into a SharedArrayRing.
+    A decoder retrieves each frame straight into a free slot and only the slot id crosses the process boundary.
+    The consumer copies the frame out and frees the slot at once, so the search never holds slots and
+    a few per decoder suffice. Must be created before starting any thread.
+    """
+    def __init__(self, num_procs, max_resolution=(1920, 1080), slots_per_proc=4):
+        super(FrameDecoderPool, self).__init__()
+        w, h = max_resolution
+        self.num_procs = num_procs
+        self.ring = SharedArrayRing(num_procs * slots_per_proc, (w * h * 3, ))
+        self._tasks = mp.Queue()
+        self._procs = [mp.Process(target=_decoder_main, args=(self._tasks, self.ring)) for _ in range(num_procs)]
+        for p in self._procs:
+            p.daemon = True
+            p.start()
+        self._routes = dict()   # task_id -> Queue.Queue
+        self._routes_lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._router = threading.Thread(target=self._route)
+        self._router.daemon = True
+        self._router.start()
+
+    def submit(self, path, start, end, every=1, seek=False):
+        """Queue a segment for decoding. Returns a Queue.Queue that receives (frame, frame_id) of its frames,
+        then None, or an Exception if decoding failed."""
+        task_id = next(self._task_ids)
+        q = Queue.Queue()
+        with self._routes_lock:
+            self._routes[task_id] = q
+        self._tasks.put((task_id, path, start, end, every, seek))
+        return q
+
+    def _route(self):
+        while True:
+            slot_id, view, (task_id, frame_id, shape_or_error) = self.ring.get()
+            if task_id is None:
+                break
+            with self._routes_lock:
+                q = self._routes[task_id]
+                if slot_id is None:
+                    del self._routes[task_id]
+            if slot_id is None:
+                q.put(RuntimeError(shape_or_error) if shape_or_error else None)
+                continue
+            frame = view[:int(np.prod(shape_or_error))].reshape(shape_or_error).copy()
+            self.ring.release(slot_id)
+            q.put((frame, frame_id))
+
+    def close(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for p in self._procs:
+            p.join()
+        self.ring.commit(None, (None, None, None))
+        self._router.join()
+
+
+def parallel_decoder(pool, path, context, every=1, segment_frames=300, ordered=True, max_pending=None, seek=False):
+    """Decode key frame aligned segments of a video in a FrameDecoderPool.
+    Yields (frame, frame_id) in frame order, or, if not `ordered`, as they are decoded.
+    At most `max_pending` segments (default: twice the pool size) are decoding or waiting to be yielded.
+    Frames of segments ahead of the one being yielded are buffered, so ordered=False uses less memory."""
+    segments = video_segments(path, segment_frames)
+    max_pending = max_pending or 2 * pool.num_procs
+    pending = collections.deque(pool.submit(path, start, end, every, seek) for start, end in segments[:max_pending])
+    submitted = len(pending)
+    while pending:
+        if ordered:
+            q = pending.popleft()
+            el = q.get()
+        else:
+            # take from whichever segment has frames; block on the oldest otherwise
+            q = next((q for q in pending if not q.empty()), pending[0])
+            el = q.get()
+            if el is None or isinstance(el, Exception):
+                pending.remove(q)
+        if isinstance(el, Exception):
+            raise el
+        if el is not None:
+            yield el
+            if ordered:
+                pending.appendleft(q)
+            continue
+        if submitted < len(segments):
+            start, end = segments[submitted]
+            pending.append(pool.submit(path, start, end, every, seek))
+            submitted += 1
+    with context.lock:
+        context.stats['bytes_from_disk'] += os.path.getsize(path)
 
 
 def smart_decoder(ss_client, path, context, every=1):
@@ -131,14 +245,41 @@ def smart_decoder(ss_client, path, context, every=1):
     num_frames = get_num_video_frames(path)
     for frame_id in range(0, num_frames, every):
         arr = ss_client.decode_video(path, frame_id)
-        context.stats['bytes_from_disk'] += arr.size
+        with context.lock:
+            context.stats['bytes_from_disk'] += arr.size
         yield arr, frame_id
 
 
+def producer(context, path_q, make_decoder, delta_frames, every=1):
+    """Take videos from `path_q` one at a time until it is empty, and push their frames with references to the workers.
+    Each producer keeps its own reference window, so several can run concurrently on different videos."""
+    while True:
+        try:
+            path = path_q.get_nowait()
+        except Queue.Empty:
+            break
+        try:
+            num_frames = get_num_video_frames(path)
+            logger.info("Processing {} with {} frames".format(path, num_frames))
+            gen = make_decoder(path)
+            for i, (frame, frame_id, reference) in enumerate(with_reference(gen, delta_frames, every)):
+                item = Item('{}-{}'.format(path, frame_id))
+                item.array = frame
+                context.q.put((item, reference))
+                logger.debug("Pushed {}".format(item.src))
+                if frame_id % 100 == 0:
+                    logger.info("Procssed {} frames, frame id {}, {}".format(i, frame_id, path))
+            with context.lock:
+                context.stats['num_frames'] += num_frames
+        except Exception as e:
+            logger.error("Exception on {}".format(path))
+            logger.exception(e)
+
+
 # Use FasterRCNN+ResNet for detection. These video are wide-angle. MobileNet doesn't work well.
 def run(
     video_path='/mnt/hdd/fast20/video/VIRAT/mp4/VIRAT_S_000200_02_000479_000635.mp4', diff_threshold=100., delta_frames=30, every_frame=10, 
-    detect=False, confidence=0.95, num_workers=8, smart=False, expname=None, verbose=False):
+    detect=False, confidence=0.95, num_workers=8, diff_threads=1, diff_scale=None, smart=False, decoders=0, segment_frames=300, ordered=True, max_resolution=(1920, 1080), seek=True, videos=1, ppm_dir=None, cache_mbytes=None, readahead=0, expname=None, verbose=False):
     """Run NoScope's frame skipping + image difference detection on videos. Optionally, pass passing frames to a DNN object detector.
     
     Keyword Arguments:
@@ -148,7 +289,19 @@ def run(
         detect {bool} -- If true, run DNN on passing frames (default: {False})
         every_frame {int} -- For frame skipping, run diff detector every `every_frame` (default: {1})
         num_workers {int} -- Parallel workers (default: {4})
+        diff_threads {int} -- Threads per diff detector MSE computation, see s3dexp.diff.mse() (default: {1})
+        diff_scale {float} -- Downscale frames by this factor for the diff detector, e.g., 0.25 (default: {None})
         smart {bool} -- Use smart disk or not (default: {False})
+        decoders {int} -- If > 0, decode key frame aligned segments of each video in this many processes (default: {0}, decode in the main thread)
+        segment_frames {int} -- With decoders, approximate number of frames per segment (default: {300})
+        ordered {bool} -- With decoders, push frames in order. Otherwise, push frames as they are decoded (default: {True})
+        max_resolution {tuple} -- With decoders, largest (width, height) of the videos, to size the shared frame slots (default: {(1920, 1080)})
+        videos {int} -- Number of videos decoded concurrently, sharing the workers. Memory grows with it by the
+            reference window of delta_frames per video. Segments in flight with decoders are split among them (default: {1})
+        ppm_dir {str} -- With smart, directory of the decoded frames as <video name>/%06d.ppm (default: {None})
+        cache_mbytes {int} -- With smart, keep decoded frames in a shared cache of this size instead of preloading all of them (default: {None})
+        readahead {int} -- With cache_mbytes, number of frames to load ahead at the sampling stride (default: {0})
+        seek {bool} -- For frame skipping, seek to the key frame before the next wanted frame instead of decoding up to it, when it is ahead (default: {True})
         expname {[type]} -- If not None, will store to DB with expname (default: {None})
     
     Raises:
@@ -176,44 +329,50 @@ def run(
     logger.info("cpuset: {}".format(cpuset))
     psutil.Process().cpu_affinity(cpuset)
 
+    # fork decoders before starting any thread
+    assert not (smart and decoders), "decoders only apply to local decoding"
+    assert not (smart and videos > 1), "the smart storage decodes one video at a time"
+    pool = FrameDecoderPool(decoders, max_resolution) if decoders > 0 else None
+
     # Setup and start workers
     context = Context()
     workers = []
     for _ in range(num_workers):
-        w = threading.Thread(target=worker, args=(context, diff_threshold, detect), kwargs={'targets': ['person',], 'confidence': confidence}) # search for persons
+        w = threading.Thread(target=worker, args=(context, diff_threshold, detect), kwargs={'diff_threads': diff_threads, 'diff_scale': diff_scale, 'targets': ['person',], 'confidence': confidence}) # search for persons
         w.daemon = True
         w.start()
         workers.append(w)
 
     # Exclude preload time from measurement
     if smart:
-        ss_client = SmartStorageClient(map_from_dir='/mnt/hdd/fast20/video/VIRAT/mp4', preload=True)
+        ss_client = SmartStorageClient(map_from_dir='/mnt/hdd/fast20/video/VIRAT/mp4', map_to_ppm_dir=ppm_dir,
+                                       preload=not cache_mbytes, cache_mbytes=cache_mbytes, readahead=readahead)
 
     tic = time.time()
     tic_cpu = time.clock()
-    total_frames = 0
-
-    for path in paths:
-        num_frames = get_num_video_frames(path)
-        logger.info("Processing {} with {} frames".format(path, num_frames))
-        window = []
+    tic_children_cpu = sum(os.times()[2:4])     # decoder processes, counted once reaped
 
+    def make_decoder(path):
         if smart:
-            gen = smart_decoder(ss_client, path, context, every_frame)
+            return smart_decoder(ss_client, path, context, every_frame)
+        elif pool:
+            # keep the pool's segments in flight the same regardless of the number of videos
+            return parallel_decoder(pool, path, context, every_frame, segment_frames=segment_frames, ordered=ordered,
+                                    max_pending=max(1, 2 * decoders // videos), seek=seek)
         else:
-            gen = cv2_decoder(path, context, every_frame)
-
-        for i, (frame, frame_id) in enumerate(gen):
-            window.append(frame)
-            reference = window.pop(0) if frame_id > delta_frames else None
-            item = Item('{}-{}'.format(path, frame_id))
-            item.array = frame
-            context.q.put((item, reference))
-            logger.debug("Pushed {}".format(item.src))
-            if frame_id % 100 == 0:
-                logger.info("Procssed {} frames, frame id {}, {}".format(i, frame_id, path))
-
-        total_frames += num_frames
+            return cv2_decoder(path, context, every_frame, seek=seek)
+
+    path_q = Queue.Queue()
+    map(path_q.put, paths)
+    producers = []
+    for _ in range(min(videos, len(paths))):
+        p = threading.Thread(target=producer, args=(context, path_q, make_decoder, delta_frames, every_frame))
+        p.daemon = True
+        p.start()
+        producers.append(p)
+    for p in producers:
+        p.join()
+    total_frames = context.stats['num_frames']
     
     # push sentinels
     for _ in workers:
@@ -223,9 +382,11 @@ def run(
     context.q.join()
     for w in workers:
         w.join()
+    if pool:
+        pool.close()
 
     elapsed = time.time() - tic
-    elapsed_cpu = time.clock() - tic_cpu
+    elapsed_cpu = time.clock() - tic_cpu + sum(os.times()[2:4]) - tic_children_cpu
     
     logger.info("Elapsed {:.2f} s, Elapsed CPU {:.2f} s".format(elapsed, elapsed_cpu))
     logger.info(str(context.stats))